@@ -1,24 +1,81 @@
+import json
+import logging
+import os
+from urllib.parse import urlencode
 import dash
+import flask
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ALL
+import numpy as np
 import pandas as pd
 import utils.functions as fu
 from utils.credentials import DB_CONNECTION_PARAMS #, VALID_USERNAME_PASSWORD_PAIRS
+try:
+    from utils.credentials import DB_POOL_SETTINGS
+except ImportError:
+    DB_POOL_SETTINGS={}
+try:
+    from utils.credentials import SNAPSHOT_SETTINGS
+except ImportError:
+    SNAPSHOT_SETTINGS={}
+try:
+    from utils.credentials import BACKGROUND_SETTINGS
+except ImportError:
+    BACKGROUND_SETTINGS={}
+try:
+    from utils.credentials import FIGURE_CACHE_SETTINGS
+except ImportError:
+    FIGURE_CACHE_SETTINGS={}
+try:
+    from utils.credentials import METRICS_SETTINGS
+except ImportError:
+    METRICS_SETTINGS={}
+try:
+    from utils.credentials import TEXT_STORE_SETTINGS
+except ImportError:
+    TEXT_STORE_SETTINGS={}
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 #import dash_auth
 
 #use external Bootswatch theme
 external_stylesheets = [dbc.themes.FLATLY ]
-
-engine=fu.initialize_engine(DB_CONNECTION_PARAMS)
-dim_ent=fu.load_full_table(engine, 'dim_entity')
-ent_hierarchy=fu.load_full_table(engine, 'map_entity_hierarchy')
-#df=fu.load_full_table(engine, 'aggregation_paper')
-df_k=fu.prep_df_for_display(engine)
-
-
-app=dash.Dash(__name__ , external_stylesheets=external_stylesheets, suppress_callback_exceptions=True) 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+db=fu.initialize_database(DB_CONNECTION_PARAMS, DB_POOL_SETTINGS)
+#entities, hierarchy and paper dataframe come from the local snapshot unless the warehouse changed,
+#with TEXT_STORE_SETTINGS enabled the abstracts are not in df_k but read from the memory mapped text_store when needed
+dim_ent, ent_hierarchy, df_k, paper_entities, paper_journals, paper_institutions, text_store, data_version=fu.load_startup_data(db, SNAPSHOT_SETTINGS, TEXT_STORE_SETTINGS)
+ent_index=fu.build_entity_hierarchy_index(dim_ent, ent_hierarchy)
+#sparse paper x entity matrices for co-occurrence counts, of the categories in df_k and of all detected entities
+incidence={
+    'papers': fu.build_entity_incidence(df_k, dim_ent, ent_index),
+    'detections': fu.build_entity_incidence(df_k, dim_ent, ent_index, paper_entities)
+}
+#df=fu.load_full_table(db, 'aggregation_paper')
+search_index=fu.build_search_index(df_k, text_store)
+#rows of df_k per entity of every entity column, for the entity search
+entity_postings=fu.build_entity_postings(df_k, dim_ent)
+#entity labels that are counted as facets of every search result
+facet_labels=fu.get_facet_labels(incidence['papers'], dim_ent)
+#typeahead completions of the search term (keywords, title n-grams) and of the entity names of every label
+term_completions=fu.build_search_term_completions(df_k)
+entity_completions=fu.build_entity_completions(dim_ent, incidence['papers'])
+#rows of df_k per paper_pk, to select the rows of the selected papers without scanning df_k
+paper_index=fu.build_paper_index(df_k)
+#integer coded journal and author institutions of every paper, the metadata analysis counts them without queries
+paper_dimensions=fu.build_paper_dimensions(paper_journals, paper_institutions)
+#heavy analysis callbacks run as background jobs in forked processes, results are cached per warehouse fingerprint
+background_manager=fu.initialize_background_manager(data_version, BACKGROUND_SETTINGS)
+#rendered analysis figures per selection of papers and chart parameters, shared by all workers
+figure_cache=fu.initialize_figure_cache(data_version, FIGURE_CACHE_SETTINGS)
+
+
+app=dash.Dash(__name__ , external_stylesheets=external_stylesheets, suppress_callback_exceptions=True, background_callback_manager=background_manager) 
+#WSGI application for the production server: gunicorn -c gunicorn.conf.py app:server
+server=app.server
+#latency, response size and database time of every callback defined below, served on /metrics
+metrics=fu.initialize_metrics(app, METRICS_SETTINGS)
 # auth = dash_auth.BasicAuth(
 #     app,
 #     VALID_USERNAME_PASSWORD_PAIRS
@@ -131,7 +188,9 @@ tab_paper_analysis=dbc.Card(
                 html.Div(children=[
                     html.Div([
                         html.H5("Search phrase in column: "),
-                        dbc.Input(id='search_term', type='text', placeholder='Type something', style={'width': '80%'}),#, value='ontology'
+                        #the suggestions are sent once the user stops typing for a moment
+                        dcc.Input(id='search_term', type='text', placeholder='Type something', list='search_term_suggestions', debounce=0.2, className='form-control', style={'width': '80%'}),#, value='ontology'
+                        html.Datalist(id='search_term_suggestions'),
                         html.Br(),
                         "Select Column: ",
                         dbc.Checklist(id='columns_to_search',
@@ -143,6 +202,11 @@ tab_paper_analysis=dbc.Card(
                             ],
                             value=['keywords']
                         ),
+                        dbc.Checklist(id='rank_results',
+                            options=[{'label': 'rank results by relevance', 'value': 1}],
+                            value=[1],
+                            switch=True
+                        ),
                         html.Br(),
                         dbc.Button(id='submit_search_strings_button', n_clicks=0, children='Submit keyword search')
                         ],
@@ -159,7 +223,8 @@ tab_paper_analysis=dbc.Card(
                             style={'width': '29%','padding': '10px', 'vertical-align': 'top', 'display': 'inline-block'}),
                             html.Div([
                                 'available entities: ',
-                                dbc.Select(id='entity_name')
+                                #the options are the most frequent entities matching what the user types, not all entities of the label
+                                dcc.Dropdown(id='entity_name', placeholder='Type to search')
                             ],
                             style={'width': '29%', 'padding': '10px', 'vertical-align': 'top', 'display': 'inline-block'}),
                             html.Div([
@@ -171,6 +236,7 @@ tab_paper_analysis=dbc.Card(
                                 ],
                                 value=0
                                 ),
+                                dbc.Input(id='child_ents_max_depth', type='number', min=1, step=1, placeholder='levels below (all)', size='sm'),
                                 html.Div(id='implied_child_entities')
                             ],
                             style={'width': '22%', 'padding': '10px', 'vertical-align': 'top', 'display': 'inline-block'})
@@ -183,13 +249,22 @@ tab_paper_analysis=dbc.Card(
                     html.Br(),
                     dcc.Markdown(id='searched_term'),
                     dcc.Markdown(id='filter_info'),
+                    html.Div([
+                        'Papers of the result per category, narrow the result by clicking a category. Level of the categories (highest aggregation: 0, empty: no aggregation): ',
+                        dbc.Input(id='facet_level', type='number', min=0, max=8, step=1, value=0, size='sm', style={'width': '80px', 'display': 'inline-block'})
+                    ], style={'font-size': '12px'}),
                     html.Br(),
                     dcc.Loading(id='loading1', type='cube', color='#18bc9c',children=[
+                        dcc.Store(id='search_result_store'),
+                        html.Div(id='search_facets'),
                         html.Div(id='search_output', children=dash_table.DataTable(id='search_result_table')),
-                        html.Div(id='for_select_all_btn')
+                        html.Div(id='for_select_all_btn'),
+                        html.Div(id='search_export_links')
                         ])
             ]),
             html.Div(id='analyse_papers', children=[
+                #the selected papers as encoded set of paper_pks (see utils/selection.py)
+                dcc.Store(id='selected_papers_store', data=''),
                 html.Div(id='manual_selected_papers'),
                 html.Br(),
                 html.Div(id='for_analysis_button'),
@@ -265,118 +340,250 @@ def toggle_dashboard_info(open_click, is_open):
     return is_open
 
 #CALLBACK FUNCTIONS FOR PUBLICATION ANALYSIS TAB
+def run_search(search):
+    """Executes a phrase or entity search as described by the search dict kept in search_result_store."""
+    if search['type']=='phrase':
+        result_df=fu.search_papers_by_searchterm(df_k, search_index, search['search_term'], search['columns_to_search'], rank=search.get('rank', False))
+    else:
+        result_df=fu.filter_df_by_entity(entity_postings, ent_index, search['dropdown_labels'], search['entity_name'], search['include_child_ents'], search.get('max_depth'))
+    #the facets the user clicked narrow the result to the papers that have all of them
+    return fu.filter_df_by_facets(result_df, incidence['papers'], search.get('facets', []))
+
+def get_search_result(result_store):
+    #the result is kept server-side, if it has been evicted (or lives in another worker) the search is run again
+    result_df=fu.get_stored_search_result(result_store['result_id'])
+    if result_df is None:
+        result_df=run_search(result_store['search'])
+        fu.store_search_result(result_df, result_id=result_store['result_id'])
+    return result_df
+
+def describe_search(search):
+    #the searched phrase or entity as markdown heading
+    if search['type']=='phrase':
+        return '##### You searched the **phrase:** {}'.format(search['search_term'])
+    entity_name=search['entity_name']
+    if search['include_child_ents']==1:
+        entity_name='{} (and {} descendant entities)'.format(entity_name, len(fu.find_child_entities(ent_index, entity_name, search.get('max_depth'))))
+    return '##### You searched the **entity:** {}'.format(entity_name)
+
+def facet_level_or_none(level):
+    #the level input is empty for no aggregation
+    return None if level is None or level=='' else int(level)
+
 @app.callback(
     [
         Output(component_id='searched_term', component_property='children'),
         Output(component_id='filter_info', component_property='children'),
         Output(component_id='for_select_all_btn', component_property='children'),
-        Output(component_id='search_output', component_property='children')
+        Output(component_id='search_output', component_property='children'),
+        Output(component_id='search_result_store', component_property='data'),
+        Output(component_id='search_facets', component_property='children')
     ],
     Input(component_id='submit_search_strings_button', component_property='n_clicks'),
     Input(component_id='submit_entity_search', component_property='n_clicks'),
+    Input(component_id={'type': 'search_facet', 'facet': ALL}, component_property='n_clicks'),
+    Input(component_id='facet_level', component_property='value'),
     State(component_id='search_term', component_property='value'),
     State(component_id='columns_to_search', component_property='value'),
     State(component_id='dropdown_labels', component_property='value'),
-    State(component_id='implied_child_entities', component_property='children'),
     State(component_id='entity_name', component_property='value'),
-    State(component_id='include_child_ents', component_property='value')
+    State(component_id='include_child_ents', component_property='value'),
+    State(component_id='child_ents_max_depth', component_property='value'),
+    State(component_id='rank_results', component_property='value'),
+    State(component_id='search_result_store', component_property='data'),
+    State(component_id='selected_papers_store', component_property='data')
 )
-def update_result_table(submit_search_strings_button_clicks, submit_entity_search, search_term, columns_to_search, dropdown_labels, implied_child_entities, entity_name, include_child_ents):
+def update_result_table(submit_search_strings_button_clicks, submit_entity_search, facet_clicks, facet_level, search_term, columns_to_search, dropdown_labels, entity_name, include_child_ents, max_depth, rank_results, result_store, selection):
     ctx=dash.callback_context
     if not ctx.triggered:
         raise PreventUpdate
     else:
-        if ctx.triggered[0]['prop_id']=='submit_search_strings_button.n_clicks':
-            if 'entire_df' in columns_to_search:
-                result_df=fu.filter_entire_df_by_searchterm(df_k, search_term)
-            else:
-                result_df=fu.filter_df_columns_by_searchterm(df_k, search_term, columns_to_search)
-            searchterm='##### You searched the **phrase:** {}'.format(search_term)
-            table=fu.generate_result_table(result_df) 
+        facet_level=facet_level_or_none(facet_level)
+        if ctx.triggered_id=='submit_search_strings_button':
+            search={'type': 'phrase', 'search_term': search_term, 'columns_to_search': columns_to_search, 'rank': bool(rank_results), 'facets': []}
+        elif ctx.triggered_id=='submit_entity_search':
+            #only the search is kept, the descendants of the entity are expanded on the server
+            search={'type': 'entity', 'dropdown_labels': dropdown_labels, 'entity_name': entity_name, 'include_child_ents': include_child_ents, 'max_depth': max_depth, 'facets': []}
+        elif not result_store:
+            raise PreventUpdate
+        elif ctx.triggered_id=='facet_level':
+            #only the counts change
+            result_df=get_search_result(result_store)
+            facet_counts=fu.get_facet_counts(incidence['papers'], facet_labels, result_df['paper_pk'].unique(), facet_level)
+            return [dash.no_update]*5+[fu.generate_facets(facet_counts, result_store['search'].get('facets', []), facet_level)]
+        elif not ctx.triggered[0]['value']:
+            #the facet buttons of a new result are rendered, none was clicked
+            raise PreventUpdate
         else:
-            result_df=fu.filter_df_by_entity(df_k, dropdown_labels, implied_child_entities, entity_name, include_child_ents)
-            if include_child_ents==1:
-                entity_name=str(implied_child_entities)
-            searchterm='##### You searched the **entity:** {}'.format(entity_name)
-            table=fu.generate_result_table(result_df)
+            #a clicked facet narrows the result, a clicked chosen facet is removed
+            facet=json.loads(ctx.triggered_id['facet'])
+            facets=result_store['search'].get('facets', [])
+            search=dict(result_store['search'], facets=[f for f in facets if f!=facet] if facet in facets else facets+[facet])
+        result_df=run_search(search)
+        result_id=fu.store_search_result(result_df)
+        #the already selected papers are ticked on the first page, so that rendering the table does not unselect them
+        table=fu.generate_result_table(result_df, text_store=text_store, selected_pks=fu.decode_paper_pks(selection))
+        facet_counts=fu.get_facet_counts(incidence['papers'], facet_labels, result_df['paper_pk'].unique(), facet_level)
         filter_info='_You can further **filter** the data by any column to find relevant papers. To analyse papers further, **select them with a checkbox** and click the button to **move to analysis**_.'
         return [
-            searchterm, 
+            describe_search(search), 
             filter_info, 
             dbc.Button(id='select_all_button', n_clicks=0, children='Select all', color='success'), 
-            table
+            table,
+            {'result_id': result_id, 'search': search},
+            fu.generate_facets(facet_counts, search['facets'], facet_level)
         ]
-    
+
+@app.callback(
+    Output(component_id='search_result_table', component_property='data'),
+    Output(component_id='search_result_table', component_property='tooltip_data'),
+    Output(component_id='search_result_table', component_property='page_count'),
+    Output(component_id='search_result_table', component_property='selected_rows', allow_duplicate=True),
+    Input(component_id='search_result_table', component_property='page_current'),
+    Input(component_id='search_result_table', component_property='page_size'),
+    Input(component_id='search_result_table', component_property='sort_by'),
+    Input(component_id='search_result_table', component_property='filter_query'),
+    State(component_id='search_result_store', component_property='data'),
+    State(component_id='selected_papers_store', component_property='data'),
+    prevent_initial_call=True
+)
+def update_result_page(page_current, page_size, sort_by, filter_query, result_store, selection):
+    if not result_store:
+        raise PreventUpdate
+    else:
+        result_df=get_search_result(result_store)
+        page_df, page_count, _=fu.get_table_page(result_df, page_current, page_size, sort_by, filter_query)
+        selected_pks=fu.decode_paper_pks(selection)
+        return page_df.to_dict('records'), fu.generate_tooltip_data(page_df, text_store), page_count, fu.get_selected_rows_on_page(page_df, selected_pks)
+
+def export_links(text, scope, params):
+    #links to the streamed export of the search result or of papers in every available format
+    links=[text]
+    for export_format in fu.EXPORT_FORMATS:
+        href='{}?{}'.format(app.get_relative_path('/export/{}.{}'.format(scope, export_format)), urlencode(params))
+        links+=[' ', html.A({'bib': 'BibTeX'}.get(export_format, export_format.upper()), href=href, target='_blank')]
+    return links
+
+@app.callback(
+    Output(component_id='search_export_links', component_property='children'),
+    Input(component_id='search_result_store', component_property='data'),
+    Input(component_id='search_result_table', component_property='sort_by'),
+    Input(component_id='search_result_table', component_property='filter_query')
+)
+def update_search_export_links(result_store, sort_by, filter_query):
+    if not result_store:
+        raise PreventUpdate
+    else:
+        #the search itself is part of the link, so that any worker can run it again if the result is not kept
+        params={'store': json.dumps(result_store), 'sort_by': json.dumps(sort_by or []), 'filter_query': filter_query or ''}
+        return html.P(export_links('Download the result:', 'search', params), style={'font-size': '12px'})
+
+@app.callback(
+    Output(component_id='selection_export_links', component_property='children'),
+    Input(component_id='analysis_papers_checklist', component_property='value')
+)
+def update_selection_export_links(checked_paper_pks):
+    return [
+        html.Span(export_links('Download the selected papers:', 'papers', {'selection': fu.encode_paper_pks(checked_paper_pks)})),
+        html.Span(export_links(' | all papers:', 'papers', {}))
+    ]
 
 @app.callback(
     Output(component_id='entity_name', component_property='options'),
-    Input(component_id='dropdown_labels', component_property='value')
+    Input(component_id='dropdown_labels', component_property='value'),
+    Input(component_id='entity_name', component_property='search_value'),
+    State(component_id='entity_name', component_property='value')
 )
-def update_entity_options(dropdown_label):
-    options=[]
-    for ent_name in dim_ent[dim_ent['entity_label']==dropdown_label]['entity_name'].to_list():
-        options.append({'label': ent_name, 'value': ent_name})
-    return options
+def update_entity_options(dropdown_label, search_value, entity_name):
+    if dropdown_label is None:
+        raise PreventUpdate
+    else:
+        options=fu.complete_entity_names(entity_completions, dropdown_label, search_value)
+        #the chosen entity stays an option, otherwise the dropdown would clear it
+        if entity_name and not search_value and entity_name not in [option['value'] for option in options]:
+            options.append({'label': entity_name, 'value': entity_name})
+        return options
+
+@app.callback(
+    Output(component_id='search_term_suggestions', component_property='children'),
+    Input(component_id='search_term', component_property='value')
+)
+def update_search_term_suggestions(search_term):
+    return [html.Option(value=suggestion) for suggestion in fu.suggest_search_terms(term_completions, search_term)]
 
 @app.callback(
     Output(component_id='implied_child_entities', component_property='children'),
     Input(component_id='entity_name', component_property='value'),
-    Input(component_id='include_child_ents', component_property='value')
+    Input(component_id='include_child_ents', component_property='value'),
+    Input(component_id='child_ents_max_depth', component_property='value')
 )
-def display_included_entitiy_children(chosen_entity, include_child_ents):
+def display_included_entitiy_children(chosen_entity, include_child_ents, max_depth):
     if chosen_entity is None:
         raise PreventUpdate
     else:
         if include_child_ents==1:
-            child_ents=fu.find_child_entities(dim_ent, ent_hierarchy, chosen_entity)
+            child_ents=fu.find_child_entities(ent_index, chosen_entity, max_depth)
         else:
             child_ents=[]
+        #only shown to the user, the search expands the entity again on the server
         return (', '.join(child_ents))
 
 @app.callback(
-    Output('search_result_table', 'selected_rows'),
-    Input('select_all_button', 'n_clicks'),
-    State('search_result_table', 'derived_virtual_data')
+    Output(component_id='selected_papers_store', component_property='data', allow_duplicate=True),
+    Output(component_id='search_result_table', component_property='selected_rows', allow_duplicate=True),
+    Input(component_id='select_all_button', component_property='n_clicks'),
+    State(component_id='search_result_table', component_property='data'),
+    State(component_id='search_result_table', component_property='sort_by'),
+    State(component_id='search_result_table', component_property='filter_query'),
+    State(component_id='search_result_store', component_property='data'),
+    State(component_id='selected_papers_store', component_property='data'),
+    prevent_initial_call=True
 )
-def select_all(selbtn_clicks, search_results):
-    if selbtn_clicks==0:
+def select_all(selbtn_clicks, page_data, sort_by, filter_query, result_store, selection):
+    if selbtn_clicks==0 or not result_store:
         raise PreventUpdate
     else:
-        return [i for i in range(len(search_results))]
+        #select every paper of the filtered result, not only the ones on the visible page
+        _, _, view_df=fu.get_table_page(get_search_result(result_store), 0, 1, sort_by, filter_query)
+        selected_pks=fu.update_selection(fu.decode_paper_pks(selection), add=view_df['paper_pk'].to_numpy())
+        return fu.encode_paper_pks(selected_pks), [i for i in range(len(page_data))]
 
 
 @app.callback(
-    Output(component_id='manual_selected_papers', component_property='children'),
-    Input(component_id='manual_selected_papers', component_property='children'),
-    Input(component_id='search_result_table', component_property='derived_virtual_data'),
-    Input(component_id='search_result_table', component_property='derived_virtual_selected_rows')
+    Output(component_id='selected_papers_store', component_property='data'),
+    Input(component_id='search_result_table', component_property='selected_rows'),
+    State(component_id='search_result_table', component_property='data'),
+    State(component_id='selected_papers_store', component_property='data'),
+    prevent_initial_call=True
 )
-
-def update_selected_titles(previously_selected_papers, derived_virtual_data, derived_virtual_selected_rows):
-    if derived_virtual_selected_rows:
-        sel_data=[derived_virtual_data[i] for i in derived_virtual_selected_rows]
-        sel_keys=[str(pk) for pk in pd.DataFrame(sel_data)['paper_pk'].to_list()]
-        if previously_selected_papers:
-            previous_list=previously_selected_papers.split(', ')
-            delta_keys=[k for k in sel_keys if (k not in previous_list)]
-        else:
-            previous_list=[]
-            delta_keys=sel_keys
-        return_keys=', '.join(previous_list+delta_keys)
-        return return_keys
+def update_selected_papers(selected_rows, page_data, selection):
+    if not page_data:
+        raise PreventUpdate
     else:
-       raise PreventUpdate
+        #the table only holds the visible page: its checked papers are added, its unchecked papers removed
+        page_pks=[row['paper_pk'] for row in page_data]
+        checked_pks=[page_data[i]['paper_pk'] for i in selected_rows or [] if i<len(page_data)]
+        previous_pks=fu.decode_paper_pks(selection)
+        selected_pks=fu.update_selection(previous_pks, add=checked_pks, remove=page_pks)
+        if np.array_equal(selected_pks, previous_pks):
+            raise PreventUpdate
+        return fu.encode_paper_pks(selected_pks)
 
 
 @app.callback(
+    Output(component_id='manual_selected_papers', component_property='children'),
     Output(component_id='for_analysis_button', component_property='children'),
-    Input(component_id='manual_selected_papers', component_property='children')
+    Input(component_id='selected_papers_store', component_property='data')
 )
-def show_analysis_button_upon_selection(manual_selected_papers):
-    if manual_selected_papers:
-        return dbc.Button(id='move_to_analysis_button', n_clicks=0, children='Search finished, move to analysis')
-    else: 
-        raise PreventUpdate
+def show_selected_papers(selection):
+    n_selected=len(fu.decode_paper_pks(selection))
+    if n_selected==0:
+        return None, None
+    else:
+        return (
+            dcc.Markdown('_**{}** selected paper{}_'.format(n_selected, '' if n_selected==1 else 's')),
+            dbc.Button(id='move_to_analysis_button', n_clicks=0, children='Search finished, move to analysis')
+        )
 
 
 @app.callback(
@@ -385,9 +592,9 @@ def show_analysis_button_upon_selection(manual_selected_papers):
         Output(component_id='for_accordion_div', component_property='children')
     ],
     Input(component_id='move_to_analysis_button', component_property='n_clicks'),
-    State(component_id='manual_selected_papers', component_property='children')
+    State(component_id='selected_papers_store', component_property='data')
 )
-def show_accordion(analysis_clicks, selected_papers_string):
+def show_accordion(analysis_clicks, selection):
     if analysis_clicks!=0:
         return [
             [
@@ -401,10 +608,11 @@ def show_accordion(analysis_clicks, selected_papers_string):
                         dcc.Markdown('_in the main page._', style={'display':'inline-block'})
                     ]),
                     html.Br(),
-                    fu.get_checkboxes_from_selected_papers(selected_papers_string, df_k) 
+                    fu.get_checkboxes_from_selected_papers(selection, df_k, paper_index)
                     ],
                     id='selection_offcanvas', is_open=True),
                 dbc.Button(id='open_offcanvas_1', children='edit selection of papers', color='secondary', n_clicks=0),
+                html.Div(id='selection_export_links', style={'padding': '10px 0'}),
                 html.Br(),
                 html.Br(),
                 html.H4('Analysis Options:')
@@ -419,6 +627,7 @@ def show_accordion(analysis_clicks, selected_papers_string):
                             dbc.Button(id='open_offcanvas', children='edit selection of papers', color='secondary', n_clicks=0),
                             dbc.Button(id='content_comparison_button', n_clicks=0, children='Okay, go!'),
                             html.Br(),
+                            dbc.Progress(id='parcats_progress', value=0, striped=True, animated=True, style={'display': 'none'}),
                             html.Div(id='parallel_categories_overview'),
                             html.Br(),
                         ],
@@ -445,6 +654,7 @@ def show_accordion(analysis_clicks, selected_papers_string):
                                 style={'padding': '10px'}
                             ),
                             dbc.Button(id='submit_axes', children='Go!', n_clicks=0),
+                            dbc.Progress(id='bubblechart_progress', value=0, striped=True, animated=True, style={'display': 'none'}),
                             html.Div(
                                 [
                                     dbc.Spinner(html.Div(id='div_for_bubblechart'))
@@ -452,9 +662,50 @@ def show_accordion(analysis_clicks, selected_papers_string):
                             )
                         ]
                     ),
+                    dbc.AccordionItem(
+                        title='Find co-occurring categories',
+                        children=[
+                            html.Div(
+                                [
+                                    html.P('Select the category of the rows and drill down or roll up. Highest aggregation: 0, empty: no aggregation'),
+                                    dbc.Select(id='cooc_x_axis', placeholder='Select row category', options=fu.get_label_options(dim_ent), style={'width': '20%', 'display':'inline-block', 'padding': '5px'}),
+                                    dbc.Input(id='cooc_x_level', type='number', min=0, max=8, step=1, value=1, style={'width': '10%', 'display':'inline-block', 'padding': '5px'}),
+                                ],
+                                style={'padding': '10px'}
+                            ),
+                            html.Div(
+                                [
+                                    html.P('Select the category of the columns and drill down or roll up. Highest aggregation: 0, empty: no aggregation'),
+                                    dbc.Select(id='cooc_y_axis', placeholder='Select column category', options=fu.get_label_options(dim_ent), style={'width': '20%', 'display':'inline-block', 'padding': '5px'}),
+                                    dbc.Input(id='cooc_y_level', type='number', min=0, max=8, step=1, value=1, style={'width': '10%', 'display':'inline-block', 'padding': '5px'}),
+                                ],
+                                style={'padding': '10px'}
+                            ),
+                            html.Div(
+                                [
+                                    dbc.RadioItems(id='cooc_scope', inline=True, value='selection', options=[
+                                        {'label': 'selected papers', 'value': 'selection'},
+                                        {'label': 'all papers', 'value': 'corpus'}
+                                    ]),
+                                    dbc.RadioItems(id='cooc_source', inline=True, value='papers', options=[
+                                        {'label': 'categories of the papers (as in the charts above)', 'value': 'papers'},
+                                        {'label': 'all detected entities', 'value': 'detections'}
+                                    ])
+                                ],
+                                style={'padding': '10px'}
+                            ),
+                            dbc.Button(id='submit_cooccurrence', children='Go!', n_clicks=0),
+                            html.Div(
+                                [
+                                    dbc.Spinner(html.Div(id='div_for_cooccurrence'))
+                                ]
+                            )
+                        ]
+                    ),
                     dbc.AccordionItem(
                         title='Compare metadata (publishing year, main journals and institutes)',
                         children=[
+                            dbc.Progress(id='metadata_progress', value=0, striped=True, animated=True, style={'display': 'none'}),
                             dbc.Spinner(html.Div(id='metadata_figures')),
                             html.Br(),
                             dbc.Button(id='analyse_metadata_button', n_clicks=0, children='update metadata figures')
@@ -468,12 +719,14 @@ def show_accordion(analysis_clicks, selected_papers_string):
                                 'Select Paper for Detail Analysis',
                                 dbc.Select(
                                     id='detail_pk_sel',
-                                    options=fu.get_title_dropdown(selected_papers_string, df_k),
+                                    options=fu.get_title_dropdown(selection, df_k, paper_index),
                                     style={'width': '80%'}
                                 ),
-                                html.Div(id='for_detail_analysis')
+                                html.Div(id='for_detail_analysis'),
+                                dcc.Store(id='detail_prefetch_store')
                             ])
-                        ]
+                        ],
+                        item_id='detail_item'
                     )
                 ],
                 start_collapsed=True,
@@ -510,16 +763,37 @@ def update_too_many_papers_warning(item, checked_papers):
     else:
         raise PreventUpdate
 
+def progress_reporter(set_progress):
+    #maps the steps reported by an analysis function to the value and label of its progress bar
+    return lambda step, total, message: set_progress((int(100*step/total), message))
+
+def background_options(progress_bar, button):
+    #options of the background callbacks: progress bar, disabled button while running, 
+    #cancel if the selection of papers changes, the button clicks are not part of the cache key
+    return dict(
+        background=True,
+        progress=[Output(progress_bar, 'value'), Output(progress_bar, 'label')],
+        running=[
+            (Output(button, 'disabled'), True, False),
+            (Output(progress_bar, 'style'), {'display': 'flex'}, {'display': 'none'})
+        ],
+        cancel=[Input('analysis_papers_checklist', 'value')],
+        cache_args_to_ignore=[0],
+        prevent_initial_call=True
+    )
+
 @app.callback(
     Output(component_id='parallel_categories_overview', component_property='children'),
     Input(component_id='content_comparison_button', component_property='n_clicks'),
-    State(component_id='analysis_papers_checklist', component_property='value')
+    State(component_id='analysis_papers_checklist', component_property='value'),
+    **background_options('parcats_progress', 'content_comparison_button')
 )
-def update_content_analysis(n_clicks, checked_paper_pks):
+def update_content_analysis(set_progress, n_clicks, checked_paper_pks):
     if n_clicks==0:
         raise PreventUpdate
     else:
-        fig=fu.generate_parallel_categories_overview_graph(checked_paper_pks, df_k)
+        fig=figure_cache.get_or_create('parcats', checked_paper_pks, (), 
+            lambda: fu.generate_parallel_categories_overview_graph(checked_paper_pks, df_k, report_progress=progress_reporter(set_progress), paper_index=paper_index).to_plotly_json())
         return(dcc.Graph(figure=fig))
 
 
@@ -530,9 +804,10 @@ def update_content_analysis(n_clicks, checked_paper_pks):
     State(component_id='x_level', component_property='value'),
     State(component_id='y_axis', component_property='value'),
     State(component_id='y_level', component_property='value'),
-    State(component_id='analysis_papers_checklist', component_property='value')
+    State(component_id='analysis_papers_checklist', component_property='value'),
+    **background_options('bubblechart_progress', 'submit_axes')
 )
-def update_category_bubbles(n_clicks, x_value, x_level, y_value, y_level, checked_paper_pks):
+def update_category_bubbles(set_progress, n_clicks, x_value, x_level, y_value, y_level, checked_paper_pks):
     if not n_clicks:
         raise PreventUpdate
     else: 
@@ -541,27 +816,69 @@ def update_category_bubbles(n_clicks, x_value, x_level, y_value, y_level, checke
         elif not y_value:
             return 'Select y-axis first.'
         else:
-            fig_bubble=fu.generate_bubblechart(x_value.lower(), y_value.lower(), checked_paper_pks, df_k, dim_ent, ent_hierarchy, x_level=x_level, y_level=y_level)
+            fig_bubble=figure_cache.get_or_create('bubblechart', checked_paper_pks, (x_value.lower(), x_level, y_value.lower(), y_level),
+                lambda: fu.generate_bubblechart(x_value.lower(), y_value.lower(), checked_paper_pks, df_k, ent_index, x_level=x_level, y_level=y_level, report_progress=progress_reporter(set_progress), paper_index=paper_index).to_plotly_json())
             return dcc.Graph(figure=fig_bubble)
 
 
+@app.callback(
+    Output(component_id='div_for_cooccurrence', component_property='children'),
+    Input(component_id='submit_cooccurrence', component_property='n_clicks'),
+    State(component_id='cooc_x_axis', component_property='value'),
+    State(component_id='cooc_x_level', component_property='value'),
+    State(component_id='cooc_y_axis', component_property='value'),
+    State(component_id='cooc_y_level', component_property='value'),
+    State(component_id='cooc_scope', component_property='value'),
+    State(component_id='cooc_source', component_property='value'),
+    State(component_id='analysis_papers_checklist', component_property='value')
+)
+def update_cooccurrence(n_clicks, x_value, x_level, y_value, y_level, scope, source, checked_paper_pks):
+    if not n_clicks:
+        raise PreventUpdate
+    elif not x_value:
+        return 'Select row category first.'
+    elif not y_value:
+        return 'Select column category first.'
+    else:
+        #the sparse products are fast enough to run in the request, for the whole corpus as well
+        fig=fu.generate_cooccurrence_heatmap(incidence[source], x_value, y_value, checked_paper_pks if scope=='selection' else None, x_level, y_level)
+        if fig is None:
+            return html.P('Sorry, no paper contains entities of both categories.', style={'color': '#e74c3c'})
+        return dcc.Graph(figure=fig)
+
+
 @app.callback(
     Output(component_id='metadata_figures', component_property='children'),
     Input(component_id='analyse_metadata_button', component_property='n_clicks'),
     Input(component_id='analysis_accordion', component_property='active_item'),
-    State(component_id='analysis_papers_checklist', component_property='value')
+    State(component_id='analysis_papers_checklist', component_property='value'),
+    **background_options('metadata_progress', 'analyse_metadata_button')
 )
-def update_metadata_analysis(n_clicks, active_accordion_item, checked_paper_pks):
+def update_metadata_analysis(set_progress, n_clicks, active_accordion_item, checked_paper_pks):
     if n_clicks==0 and active_accordion_item!='metadata_item':
         raise PreventUpdate
     else:
-        fig_time, fig_journals, fig_institutes=fu.generate_metadata_graphs(checked_paper_pks, df_k, engine)
+        #the figures are also requested whenever the accordion item is opened again, which is served from the cache
+        fig_time, fig_journals, fig_institutes=figure_cache.get_or_create('metadata', checked_paper_pks, (),
+            lambda: tuple(fig.to_plotly_json() for fig in fu.generate_metadata_graphs(checked_paper_pks, df_k, db, report_progress=progress_reporter(set_progress), paper_index=paper_index, paper_dimensions=paper_dimensions)))
         return [
            dcc.Graph(figure=fig_time, style={'width': '40%', 'vertical-align': 'top', 'display': 'inline-block'}), 
            dcc.Graph(figure=fig_journals, style={'width': '30%', 'vertical-align': 'top', 'display': 'inline-block'}), 
            dcc.Graph(figure=fig_institutes, style={'width': '30%', 'vertical-align': 'top', 'display': 'inline-block'})
         ]
 
+@app.callback(
+    Output(component_id='detail_prefetch_store', component_property='data'),
+    Input(component_id='analysis_accordion', component_property='active_item'),
+    State(component_id='analysis_papers_checklist', component_property='value')
+)
+def prefetch_detail_analysis(active_accordion_item, checked_paper_pks):
+    if active_accordion_item!='detail_item' or not checked_paper_pks:
+        raise PreventUpdate
+    else:
+        #details and entities of all checked papers with one query each, choosing a paper then needs no query
+        return fu.prefetch_paper_details(checked_paper_pks, db)
+
 @app.callback(
     Output(component_id='for_detail_analysis', component_property='children'),
     Input(component_id='detail_pk_sel', component_property='value')
@@ -570,7 +887,9 @@ def update_detail_analysis(paper_key):
     if not paper_key:
         raise PreventUpdate
     else:
-        summary_div=fu.get_summary_fields(paper_key, engine, dim_ent)
+        #load the detected entities of all labels once, the pie and histogram callbacks take them from memory
+        fu.load_paper_entities(paper_key, db)
+        summary_div=fu.get_summary_fields(paper_key, db, dim_ent)
         return summary_div
 
 @app.callback(
@@ -585,7 +904,7 @@ def update_pie_details(category_label, level, paper_pk):
     elif not level:
         raise PreventUpdate
     else:
-        return fu.generate_detail_piechart_or_hist(paper_pk, category_label, level, engine, dim_ent, ent_hierarchy, fig_type='pie')
+        return fu.generate_detail_piechart_or_hist(paper_pk, category_label, level, db, ent_index, fig_type='pie')
 
 @app.callback(
     Output(component_id='for_detail_hist', component_property='children'),
@@ -599,7 +918,52 @@ def update_hist_details(category_label, level, paper_pk):
     elif not level:
         raise PreventUpdate
     else:
-        return fu.generate_detail_piechart_or_hist(paper_pk, category_label, level, engine, dim_ent, ent_hierarchy, fig_type='hist')
+        return fu.generate_detail_piechart_or_hist(paper_pk, category_label, level, db, ent_index, fig_type='hist')
+
+
+#STREAMED EXPORTS
+@server.route('/export/<scope>.<export_format>')
+def export(scope, export_format):
+    #/export/search.<format>?store=...&sort_by=...&filter_query=... exports the search result as shown in the table,
+    #/export/papers.<format>?pks=1,2,3 (or ?selection=<encoded set of paper_pks>) the given papers and /export/papers.<format> all papers
+    if scope not in ('search', 'papers') or export_format not in fu.EXPORT_FORMATS:
+        flask.abort(404)
+    args=flask.request.args
+    try:
+        if scope=='search':
+            result_df=get_search_result(json.loads(args['store']))
+            export_df=fu.get_export_rows(result_df, json.loads(args.get('sort_by') or '[]'), args.get('filter_query', ''))
+        elif 'selection' in args:
+            export_df=fu.get_selected_papers_df(args['selection'], df_k, paper_index)
+        elif 'pks' in args:
+            export_df=fu.select_papers(df_k, [pk for pk in args['pks'].split(',') if pk], paper_index)
+        else:
+            export_df=df_k
+    except (KeyError, TypeError, ValueError):
+        #a malformed or outdated store, selection or list of pks
+        flask.abort(400)
+    filename='{}_{}.{}'.format('search_result' if scope=='search' else 'papers', pd.Timestamp.now().strftime('%Y%m%d_%H%M%S'), export_format)
+    return flask.Response(fu.stream_export(export_df, export_format, db, text_store=text_store), mimetype=fu.EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
+
+
+#HEALTH ENDPOINTS FOR THE PRODUCTION SERVER
+@server.route('/health')
+def health():
+    #liveness: the worker answers requests
+    return flask.jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@server.route('/metrics')
+def metrics_endpoint():
+    #callback and database helper histograms of all workers in Prometheus text format
+    return flask.Response(metrics.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+@server.route('/ready')
+def ready():
+    #readiness: the startup data of this worker is loaded and indexed
+    status=fu.get_readiness({'df_k': df_k, 'dim_ent': dim_ent, 'ent_hierarchy': ent_hierarchy, 'paper_entities': paper_entities, 'paper_journals': paper_journals}, search_index, db)
+    status['figure_cache']=figure_cache.stats()
+    return flask.jsonify(status), 200 if status['ready'] else 503
 
 
 if __name__ == '__main__':
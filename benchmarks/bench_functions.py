@@ -0,0 +1,180 @@
+"""Microbenchmarks of the hot functions of utils/functions.py: the startup loaders and index builders, the search,
+the result table, the analysis charts and the detail analysis, on a warehouse made by generate_warehouse.py.
+The inputs (search terms, selections, papers) are drawn with a fixed seed, so runs on the same warehouse are comparable.
+The detail functions are timed for a different paper in every repetition, so their first query is not cached.
+With --json the results are written to a file, with --compare they are compared to such a file and the script exits
+with status 1 if a function got slower by more than --tolerance percent. With --text-store the abstracts are kept in a
+text store in the given directory instead of df_k (like TEXT_STORE_SETTINGS in the credentials).
+Run from the repository root:
+    python -m benchmarks.generate_warehouse --url sqlite:///warehouse_10k.db --papers 10000
+    python -m benchmarks.bench_functions --url sqlite:///warehouse_10k.db --json before.json
+    python -m benchmarks.bench_functions --url sqlite:///warehouse_10k.db --compare before.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+import numpy as np
+import utils.functions as fu
+from utils.text_store import load_or_build_text_store
+
+SEARCH_TERMS=['digital platform', 'trust', 'supply chain', 'ontology', 'cloud service', 'knowledge', 'privacy', 'data model']
+PHRASES=['"digital platform"', '"supply chain"', '"cloud service"', '"data model"']
+
+
+def timed(function, repeat):
+    """Calls function(i) for i in range(repeat) and returns the times in seconds."""
+    times=[]
+    for i in range(repeat):
+        start=time.perf_counter()
+        function(i)
+        times.append(time.perf_counter()-start)
+    return times
+
+def load_data(db, text_store_directory=None):
+    """Loads the startup data like app.py (without snapshot) and times every loader and index builder once.
+    Args:
+        db (Database): The data access layer for the warehouse.
+        text_store_directory (str): Keep the abstracts in a text store in this directory (rewritten) instead of df_k.
+    Returns:
+        A dict of the loaded data and indexes, and a list of (group, name, times).
+    """
+    results=[]
+    def run(name, function):
+        start=time.perf_counter()
+        value=function()
+        results.append(('startup', name, [time.perf_counter()-start]))
+        return value
+    data={'db': db, 'text_store': None}
+    data['dim_ent']=run('load_full_table dim_entity', lambda: fu.load_full_table(db, 'dim_entity'))
+    data['ent_hierarchy']=run('load_full_table map_entity_hierarchy', lambda: fu.load_full_table(db, 'map_entity_hierarchy'))
+    data['df_k']=run('prep_df_for_display', lambda: fu.prep_df_for_display(db, abstracts=text_store_directory is None))
+    if text_store_directory is not None:
+        def load_abstracts():
+            abstracts=fu.load_paper_abstracts(db)
+            return abstracts['paper_pk'].to_numpy(), abstracts['abstract'].tolist()
+        #a new fingerprint every run, so that the store is written (and timed) and older ones are removed
+        data['text_store']=run('load_or_build_text_store', lambda: load_or_build_text_store(text_store_directory, 'bench-{}'.format(os.getpid()), load_abstracts))
+    data['paper_entities']=run('load_paper_entity_detections', lambda: fu.load_paper_entity_detections(db))
+    data['paper_journals']=run('load_paper_journals', lambda: fu.load_paper_journals(db))
+    data['paper_institutions']=run('load_paper_institutions', lambda: fu.load_paper_institutions(db))
+    data['ent_index']=run('build_entity_hierarchy_index', lambda: fu.build_entity_hierarchy_index(data['dim_ent'], data['ent_hierarchy']))
+    data['incidence']=run('build_entity_incidence', lambda: fu.build_entity_incidence(data['df_k'], data['dim_ent'], data['ent_index']))
+    run('build_entity_incidence detections', lambda: fu.build_entity_incidence(data['df_k'], data['dim_ent'], data['ent_index'], data['paper_entities']))
+    data['search_index']=run('build_search_index', lambda: fu.build_search_index(data['df_k'], data['text_store']))
+    data['postings']=run('build_entity_postings', lambda: fu.build_entity_postings(data['df_k'], data['dim_ent']))
+    data['term_completions']=run('build_search_term_completions', lambda: fu.build_search_term_completions(data['df_k']))
+    data['entity_completions']=run('build_entity_completions', lambda: fu.build_entity_completions(data['dim_ent'], data['incidence']))
+    data['paper_index']=run('build_paper_index', lambda: fu.build_paper_index(data['df_k']))
+    data['paper_dimensions']=run('build_paper_dimensions', lambda: fu.build_paper_dimensions(data['paper_journals'], data['paper_institutions']))
+    data['facet_labels']=fu.get_facet_labels(data['incidence'], data['dim_ent'])
+    return data, results
+
+def benchmarks(data, selection_size, seed):
+    """Returns the (group, name, function of the repetition) of every benchmark."""
+    rng=np.random.default_rng(seed)
+    db, df_k, dim_ent, ent_index, incidence=data['db'], data['df_k'], data['dim_ent'], data['ent_index'], data['incidence']
+    search_index, paper_index, text_store=data['search_index'], data['paper_index'], data['text_store']
+    paper_pks=df_k['paper_pk'].unique()
+    selection=np.sort(rng.choice(paper_pks, size=min(selection_size, len(paper_pks)), replace=False))
+    detail_pks=rng.choice(paper_pks, size=min(1000, len(paper_pks)), replace=False)
+    detail_pk=lambda i: int(detail_pks[i%len(detail_pks)])
+    #checked papers of the detail analysis, other papers in every repetition
+    prefetch_pks=rng.permutation(paper_pks)
+    topic=dim_ent.loc[dim_ent['entity_label']=='TOPIC', 'entity_name'].iloc[0]
+    result_df=fu.search_papers_by_searchterm(df_k, search_index, 'digital platform', ['title', 'keywords', 'abstract'], rank=True)
+    result_pks=result_df['paper_pk'].unique()
+    facet_counts=fu.get_facet_counts(incidence, data['facet_labels'], result_pks)
+    facets=[[label, None, counts.index[0]] for label, counts in list(facet_counts.items())[:2] if len(counts)]
+    pages=[fu.get_table_page(result_df, page, 10)[0] for page in range(5)]
+    encoded=fu.encode_paper_pks(result_pks)
+    encoded_selection=fu.encode_paper_pks(selection)
+    return [
+        ('search', 'search_papers_by_searchterm', lambda i: fu.search_papers_by_searchterm(df_k, search_index, SEARCH_TERMS[i%len(SEARCH_TERMS)], ['title', 'keywords', 'abstract'])),
+        ('search', 'search_papers_by_searchterm ranked', lambda i: fu.search_papers_by_searchterm(df_k, search_index, SEARCH_TERMS[i%len(SEARCH_TERMS)], ['title', 'keywords', 'abstract'], rank=True)),
+        ('search', 'search_papers_by_searchterm phrase in abstract', lambda i: fu.search_papers_by_searchterm(df_k, search_index, PHRASES[i%len(PHRASES)], ['abstract'])),
+        ('search', 'filter_df_by_entity with children', lambda i: fu.filter_df_by_entity(data['postings'], ent_index, 'TOPIC', topic, 1)),
+        ('search', 'get_facet_counts', lambda i: fu.get_facet_counts(incidence, data['facet_labels'], result_pks)),
+        ('search', 'filter_df_by_facets', lambda i: fu.filter_df_by_facets(result_df, incidence, facets)),
+        ('search', 'suggest_search_terms', lambda i: fu.suggest_search_terms(data['term_completions'], SEARCH_TERMS[i%len(SEARCH_TERMS)][:3])),
+        ('search', 'complete_entity_names', lambda i: fu.complete_entity_names(data['entity_completions'], 'TOPIC', 'top')),
+        ('table', 'generate_result_table', lambda i: fu.generate_result_table(result_df, text_store=text_store)),
+        ('table', 'get_table_page sorted and filtered', lambda i: fu.get_table_page(result_df, i%5, 10, [{'column_id': 'year', 'direction': 'desc'}], '{year} > 2000')),
+        ('table', 'generate_tooltip_data', lambda i: fu.generate_tooltip_data(pages[i%len(pages)], text_store)),
+        ('table', 'encode_paper_pks', lambda i: fu.encode_paper_pks(result_pks)),
+        ('table', 'decode_paper_pks', lambda i: fu.decode_paper_pks(encoded)),
+        ('table', 'stream_export csv', lambda i: sum(len(part) for part in fu.stream_export(result_df, 'csv', db, text_store=text_store))),
+        ('analysis', 'get_paper_options', lambda i: fu.get_paper_options(encoded_selection, df_k, paper_index)),
+        ('analysis', 'generate_parallel_categories_overview_graph', lambda i: fu.generate_parallel_categories_overview_graph(selection, df_k, paper_index=paper_index)),
+        ('analysis', 'generate_bubblechart', lambda i: fu.generate_bubblechart('topic', 'sector', selection, df_k, ent_index, x_level=i%3, y_level=0, paper_index=paper_index)),
+        ('analysis', 'generate_cooccurrence_heatmap', lambda i: fu.generate_cooccurrence_heatmap(incidence, 'TOPIC', 'SECTOR', selection)),
+        ('analysis', 'generate_metadata_graphs', lambda i: fu.generate_metadata_graphs(selection, df_k, db, paper_index=paper_index, paper_dimensions=data['paper_dimensions'])),
+        ('detail', 'get_summary_fields', lambda i: fu.get_summary_fields(detail_pk(i), db, dim_ent)),
+        ('detail', 'generate_detail_piechart_or_hist pie', lambda i: fu.generate_detail_piechart_or_hist(detail_pk(i+500), 'TOPIC', 1, db, ent_index, fig_type='pie')),
+        #the entities of the paper are loaded by the pie chart before, the histogram of another label takes them from the cache
+        ('detail', 'generate_detail_piechart_or_hist hist (cached)', lambda i: fu.generate_detail_piechart_or_hist(detail_pk(i+500), 'SECTOR', 0, db, ent_index, fig_type='hist')),
+        ('detail', 'prefetch_paper_details 64 papers', lambda i: fu.prefetch_paper_details(prefetch_pks[i*64:(i+1)*64], db)),
+    ]
+
+def summarize(times):
+    return {'median': float(np.median(times)), 'p95': float(np.percentile(times, 95)), 'min': float(np.min(times)), 'n': len(times)}
+
+def compare(results, baseline, tolerance):
+    """Prints the change of the median of every function against the baseline, returns the slower functions."""
+    slower=[]
+    print('\n{:<54} {:>12} {:>12} {:>8}'.format('function', 'before [ms]', 'after [ms]', 'change'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after=baseline[name]['median'], result['median']
+        change=(after/before-1)*100 if before>0 else 0.0
+        print('{:<54} {:>12.2f} {:>12.2f} {:>7.0f}%'.format(name, before*1000, after*1000, change))
+        if change>tolerance:
+            slower.append(name)
+    return slower
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='SQLAlchemy URL of the warehouse, DB_CONNECTION_PARAMS of utils/credentials.py by default')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions of every function (the startup functions run once)')
+    parser.add_argument('--selection', type=int, default=500, help='number of selected papers for the analysis charts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare to the results of an earlier run (a file written with --json)')
+    parser.add_argument('--tolerance', type=float, default=20, help='percent of slowdown of the median that fails --compare')
+    parser.add_argument('--text-store', help='keep the abstracts in a text store in this directory instead of df_k')
+    args=parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    if args.url:
+        connection_params={'url': args.url}
+    else:
+        from utils.credentials import DB_CONNECTION_PARAMS as connection_params
+    db=fu.initialize_database(connection_params)
+    data, results=load_data(db, args.text_store)
+    print('{} papers, {} rows in df_k, {} selected papers, {} repetitions'.format(data['df_k']['paper_pk'].nunique(), len(data['df_k']), args.selection, args.repeat))
+    for group, name, function in benchmarks(data, args.selection, args.seed):
+        #warm up with inputs the timed repetitions do not use
+        function(args.repeat)
+        results.append((group, name, timed(function, args.repeat)))
+
+    print('{:<10} {:<54} {:>12} {:>12} {:>12}'.format('group', 'function', 'median [ms]', 'p95 [ms]', 'min [ms]'))
+    summaries={}
+    for group, name, times in results:
+        summaries[name]=dict(summarize(times), group=group)
+        s=summaries[name]
+        print('{:<10} {:<54} {:>12.2f} {:>12.2f} {:>12.2f}'.format(group, name, s['median']*1000, s['p95']*1000, s['min']*1000))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'papers': int(data['df_k']['paper_pk'].nunique()), 'rows': len(data['df_k']), 'selection': args.selection, 'results': summaries}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            slower=compare(summaries, json.load(f)['results'], args.tolerance)
+        if slower:
+            print('\nslower by more than {:.0f}%: {}'.format(args.tolerance, ', '.join(slower)))
+            sys.exit(1)
+
+if __name__=='__main__':
+    main()
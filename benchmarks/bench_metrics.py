@@ -0,0 +1,88 @@
+"""Measures the overhead of the callback and database instrumentation (utils/metrics.py) on the running app.
+The same mix of callback requests (search, result page, entity typeahead, detail pie) is sent through the Flask
+test client with the instrumentation switched on and off in alternating rounds. The difference of the median latencies
+is mostly noise at this scale, so the overhead is measured as the time of the instrumentation itself per request (on a
+no-op callback), relative to the median latency of every callback and to the time of the whole mix.
+Exits with status 1 if the overhead of the mix exceeds --max-overhead percent.
+tests/test_metrics.py checks the same budget without a warehouse, on a callback over in-memory data.
+Run from the repository root (needs utils/credentials.py):
+    python -m benchmarks.bench_metrics --rounds 20
+"""
+import argparse
+import sys
+import time
+import numpy as np
+import app as A
+from utils.metrics import metrics
+from benchmarks.load_driver import callback_body, search_body, page_body, detail_body
+
+
+def request_bodies(client):
+    """The request mix: a phrase search, a page of its result, an entity typeahead and a detail pie chart."""
+    search=search_body('digital platform')
+    store=client.post('/_dash-update-component', json=search).get_json()['response']['search_result_store']['data']
+    page_output=next(key for key in A.app.callback_map if key.startswith('..search_result_table.data'))
+    page=page_body(page_output, store, 1, [])
+    typeahead=callback_body('entity_name.options', [('dropdown_labels', 'value', 'TOPIC'), ('entity_name', 'search_value', 't')], [('entity_name', 'value', None)])
+    pie=detail_body(int(A.df_k['paper_pk'].iloc[0]), 'pie', 'TOPIC', 1)
+    return {'search': search, 'page': page, 'typeahead': typeahead, 'pie': pie}
+
+def run_round(client, bodies, repeat):
+    #latency of every request of the mix, repeat times
+    latencies={name: [] for name in bodies}
+    for _ in range(repeat):
+        for name, body in bodies.items():
+            start=time.perf_counter()
+            response=client.post('/_dash-update-component', json=body)
+            latencies[name].append(time.perf_counter()-start)
+            if response.status_code not in (200, 204):
+                raise RuntimeError('{} failed with status {}'.format(name, response.status_code))
+    return latencies
+
+def instrumentation_cost(client, repeat):
+    """Returns the time of the instrumentation per request in seconds: a request to a no-op callback (the closing
+    of an info modal) with the instrumentation on minus the same request with it off."""
+    body=callback_body('dwh_info.is_open', [('dwh_btn', 'n_clicks', 1)], [('dwh_info', 'is_open', False)])
+    times={True: [], False: []}
+    for _ in range(repeat):
+        for enabled in (True, False):
+            metrics.enabled=enabled
+            start=time.perf_counter()
+            client.post('/_dash-update-component', json=body)
+            times[enabled].append(time.perf_counter()-start)
+    metrics.enabled=True
+    return max(float(np.median(times[True])-np.median(times[False])), 0.0)
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20, help='alternating rounds with the instrumentation on and off')
+    parser.add_argument('--repeat', type=int, default=5, help='requests of every kind per round')
+    parser.add_argument('--max-overhead', type=float, default=1.0, help='maximum overhead in percent of the time of the request mix')
+    args=parser.parse_args()
+
+    client=A.app.server.test_client()
+    bodies=request_bodies(client)
+    run_round(client, bodies, 2)
+    latencies={enabled: {name: [] for name in bodies} for enabled in (True, False)}
+    for _ in range(args.rounds):
+        for enabled in (True, False):
+            metrics.enabled=enabled
+            for name, values in run_round(client, bodies, args.repeat).items():
+                latencies[enabled][name]+=values
+    metrics.enabled=True
+    cost=instrumentation_cost(client, 2000)
+
+    print('{:<12} {:>12} {:>12} {:>10} {:>14}'.format('callback', 'off [ms]', 'on [ms]', 'diff', 'cost/median'))
+    for name in bodies:
+        off=float(np.median(latencies[False][name]))
+        on=float(np.median(latencies[True][name]))
+        print('{:<12} {:>12.2f} {:>12.2f} {:>9.1f}% {:>13.2f}%'.format(name, off*1000, on*1000, 100*(on-off)/off, 100*cost/off))
+    #one instrumented request per callback of the mix, relative to the time of the mix without instrumentation
+    overhead=100*cost*len(bodies)/sum(float(np.median(values)) for values in latencies[False].values())
+    print('instrumentation per request: {:.1f} us, {:.2f}% of the request mix'.format(cost*1e6, overhead))
+    if overhead>args.max_overhead:
+        print('overhead above {}%'.format(args.max_overhead))
+        sys.exit(1)
+
+if __name__=='__main__':
+    main()
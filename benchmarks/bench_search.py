@@ -0,0 +1,85 @@
+"""Compares the inverted index search with the previous regex search on a synthetic corpus.
+Run from the repository root:
+    python -m benchmarks.bench_search --papers 100000
+"""
+import argparse
+import random
+import time
+import numpy as np
+import pandas as pd
+import utils.functions as fu
+
+WORDS=('data model system information process design user network business digital platform ontology '
+    'research method analysis theory adoption trust privacy security cloud service value firm market '
+    'knowledge learning social media health supply chain blockchain artificial intelligence governance '
+    'innovation strategy performance capability sourcing outsourcing team collaboration decision support '
+    'e-commerce data-driven real-time').split()
+
+QUERIES=[
+    (['title'], 'ontology'),
+    (['keywords'], 'supply chain'),
+    (['abstract'], 'trust privacy'),
+    (['title', 'keywords', 'abstract'], 'digital platform'),
+    (['entire_df'], 'supply chain'),
+    #words joined by punctuation are matched with the same punctuation, like the regex search
+    (['title'], 'e-commerce'),
+    (['keywords'], 'data-driven'),
+    (['abstract'], 'real-time decision'),
+    (['title', 'keywords', 'abstract'], 'e-commerce platform'),
+    (['keywords'], 'chain, data'),
+    (['entire_df'], 'data-driven'),
+    (['entire_df'], 'chain, data'),
+]
+
+def generate_corpus(n_papers, seed=0):
+    """Generates a df_k-like dataframe with title, keywords, abstract, year and a few entity columns."""
+    rnd=random.Random(seed)
+    sentence=lambda n: ' '.join(rnd.choice(WORDS) for _ in range(n))
+    rows=[]
+    for pk in range(n_papers):
+        title=sentence(rnd.randint(4, 10)).capitalize()
+        keywords=', '.join(sentence(2) for _ in range(rnd.randint(2, 6)))
+        abstract=sentence(rnd.randint(120, 250))+'.'
+        year=rnd.randint(1989, 2021)
+        for _ in range(rnd.randint(1, 3)):
+            rows.append({'paper_pk': pk, 'keywords': keywords, 'title': title, 'year': year, 'abstract': abstract,
+                'topic': 'topic_{}'.format(rnd.randrange(50)), 'sector': 'sector_{}'.format(rnd.randrange(20)), 'region': 'region_{}'.format(rnd.randrange(10))})
+    return pd.DataFrame(rows)
+
+def regex_search(df, searchphrase, columns_to_search):
+    if 'entire_df' in columns_to_search:
+        return fu.filter_entire_df_by_searchterm(df, searchphrase)
+    return fu.filter_df_columns_by_searchterm(df, searchphrase, columns_to_search)
+
+def timed(func, repeat):
+    times=[]
+    for _ in range(repeat):
+        start=time.perf_counter()
+        result=func()
+        times.append(time.perf_counter()-start)
+    return result, float(np.median(times))
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--papers', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--entire-df', action='store_true', help='also time the regex search over all fields (takes minutes per query at 100k papers)')
+    args=parser.parse_args()
+
+    df=generate_corpus(args.papers)
+    print('corpus: {} papers, {} rows'.format(args.papers, len(df)))
+    index, build_time=timed(lambda: fu.build_search_index(df), 1)
+    print('index build: {:.2f} s'.format(build_time))
+    print('{:<48} {:>12} {:>12} {:>9} {:>10}'.format('query', 'regex [ms]', 'index [ms]', 'speedup', 'papers'))
+    for columns, query in QUERIES:
+        if 'entire_df' in columns and not args.entire_df:
+            continue
+        regex_df, regex_time=timed(lambda: regex_search(df, query, columns), args.repeat)
+        index_df, index_time=timed(lambda: fu.search_papers_by_searchterm(df, index, query, columns), args.repeat)
+        label='{} in {}'.format(query, '+'.join(columns))
+        print('{:<48} {:>12.1f} {:>12.1f} {:>8.0f}x {:>10}'.format(label, regex_time*1000, index_time*1000, regex_time/index_time, index_df.paper_pk.nunique()))
+        if set(regex_df.paper_pk)!=set(index_df.paper_pk):
+            print('  note: regex found {} papers'.format(regex_df.paper_pk.nunique()))
+
+if __name__=='__main__':
+    main()
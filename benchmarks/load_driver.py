@@ -0,0 +1,218 @@
+"""HTTP load driver of a running dashboard (python app.py or gunicorn -c gunicorn.conf.py app:server).
+Closed-loop clients replay the callback requests of a user session against /_dash-update-component:
+search term typeahead, phrase search, a sorted result page, select all, move to analysis, the parallel categories,
+bubble chart and metadata analysis (background callbacks, polled until their result is there) and the detail summary,
+pie chart and histogram of a selected paper. Every client draws its search terms, analysed papers and detail papers
+with its own seed, so runs are reproducible. Latency percentiles (p50, p95, p99) are reported per step, the latency of a
+background step is the time until its result was polled, and the throughput in requests and sessions per second.
+Run from the repository root against a server on a warehouse made by generate_warehouse.py:
+    python -m benchmarks.load_driver --server http://127.0.0.1:8050 --clients 8 --duration 60
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import time
+from urllib.parse import urlsplit
+import numpy as np
+from utils.selection import decode_paper_pks
+
+SEARCH_TERMS=['digital platform', 'trust', 'supply chain', 'ontology', 'cloud service', 'knowledge', 'privacy', 'data model']
+SEARCH_OUTPUT='..searched_term.children...filter_info.children...for_select_all_btn.children...search_output.children...search_result_store.data...search_facets.children..'
+DASH_UPDATE_PATH='/_dash-update-component'
+STEPS=['typeahead', 'search', 'page', 'select_all', 'move_to_analysis', 'parcats', 'bubble', 'metadata', 'detail_summary', 'detail_pie', 'detail_hist']
+
+
+def callback_body(output, inputs, state=(), changed=None):
+    """Builds the JSON body of a request to /_dash-update-component."""
+    outputs=[]
+    for part in output.strip('.').split('...'):
+        component_id, prop=part.split('.', 1)
+        outputs.append({'id': component_id, 'property': prop.split('@')[0]})
+    return {
+        'output': output,
+        'outputs': outputs if output.startswith('..') else outputs[0],
+        #a list stands for the components of a pattern-matching (ALL) input
+        'inputs': [item if isinstance(item, list) else {'id': item[0], 'property': item[1], 'value': item[2]} for item in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+        'changedPropIds': changed or ['{}.{}'.format(inputs[0][0], inputs[0][1])]
+    }
+
+def search_body(term):
+    return callback_body(SEARCH_OUTPUT,
+        [('submit_search_strings_button', 'n_clicks', 1), ('submit_entity_search', 'n_clicks', 0), [], ('facet_level', 'value', 0)],
+        [('search_term', 'value', term), ('columns_to_search', 'value', ['title', 'keywords', 'abstract']), ('dropdown_labels', 'value', None),
+        ('entity_name', 'value', None), ('include_child_ents', 'value', None), ('child_ents_max_depth', 'value', None), ('rank_results', 'value', [1]), ('search_result_store', 'data', None)],
+        changed=['submit_search_strings_button.n_clicks'])
+
+def page_body(page_output, store, page, sort_by, selection=''):
+    return callback_body(page_output,
+        [('search_result_table', 'page_current', page), ('search_result_table', 'page_size', 10), ('search_result_table', 'sort_by', sort_by), ('search_result_table', 'filter_query', '')],
+        [('search_result_store', 'data', store), ('selected_papers_store', 'data', selection)])
+
+def detail_body(paper_pk, fig_type='pie', label='TOPIC', level=1):
+    return callback_body('for_detail_{}.children'.format(fig_type), [('{}_label_sel'.format(fig_type), 'value', label), ('{}_level'.format(fig_type), 'value', level), ('detail_pk_sel', 'value', str(paper_pk))])
+
+def session_bodies(outputs, store, selection, page_data):
+    """The bodies of the requests of a session that depend on the search result: select all and move to analysis."""
+    return {
+        'select_all': callback_body(outputs['select_all'], [('select_all_button', 'n_clicks', 1)],
+            [('search_result_table', 'data', page_data), ('search_result_table', 'sort_by', []), ('search_result_table', 'filter_query', ''),
+            ('search_result_store', 'data', store), ('selected_papers_store', 'data', '')]),
+        'move_to_analysis': callback_body(outputs['move_to_analysis'], [('move_to_analysis_button', 'n_clicks', 1)], [('selected_papers_store', 'data', selection)])
+    }
+
+def analysis_bodies(paper_pks):
+    """The bodies of the background analysis callbacks for the checked papers."""
+    return {
+        'parcats': callback_body('parallel_categories_overview.children', [('content_comparison_button', 'n_clicks', 1)], [('analysis_papers_checklist', 'value', paper_pks)]),
+        'bubble': callback_body('div_for_bubblechart.children', [('submit_axes', 'n_clicks', 1)],
+            [('x_axis', 'value', 'TOPIC'), ('x_level', 'value', 0), ('y_axis', 'value', 'SECTOR'), ('y_level', 'value', 1), ('analysis_papers_checklist', 'value', paper_pks)]),
+        'metadata': callback_body('metadata_figures.children', [('analyse_metadata_button', 'n_clicks', 1), ('analysis_accordion', 'active_item', None)],
+            [('analysis_papers_checklist', 'value', paper_pks)])
+    }
+
+def request(host, port, method, path, body=None):
+    connection=http.client.HTTPConnection(host, port, timeout=300)
+    try:
+        payload=json.dumps(body) if body is not None else None
+        connection.request(method, path, body=payload, headers={'Content-Type': 'application/json'} if payload else {})
+        response=connection.getresponse()
+        data=response.read()
+        return response.status, data
+    finally:
+        connection.close()
+
+def callback_request(host, port, body, poll_interval=0.1, timeout=300):
+    """Posts a callback request. A background callback answers with its job, which is polled (like the browser does)
+    until the result is there.
+    Returns:
+        The status, the response JSON (None if there is none) and the number of HTTP requests.
+    """
+    status, data=request(host, port, 'POST', DASH_UPDATE_PATH, body)
+    result=json.loads(data) if status==200 and data else None
+    requests=1
+    if result is not None and 'cacheKey' in result:
+        job, deadline='?cacheKey={}&job={}'.format(result['cacheKey'], result['job']), time.time()+timeout
+        while time.time()<deadline:
+            time.sleep(poll_interval)
+            status, data=request(host, port, 'POST', DASH_UPDATE_PATH+job, body)
+            result=json.loads(data) if status==200 and data else None
+            requests+=1
+            if result is None or 'response' in result:
+                break
+        else:
+            status=504
+    return status, result, requests
+
+def callback_outputs(host, port):
+    """Returns the output ids of the callbacks with allow_duplicate outputs, which contain a hash, from the app."""
+    dependencies=json.loads(request(host, port, 'GET', '/_dash-dependencies')[1])
+    output=lambda prefix, required='': next(d['output'] for d in dependencies if d['output'].startswith(prefix) and required in json.dumps(d['inputs']))
+    return {
+        'page': output('..search_result_table.data'),
+        'select_all': output('..selected_papers_store.data', 'select_all_button'),
+        'move_to_analysis': output('..for_paper_checkboxes')
+    }
+
+def run_session(post, outputs, rnd, analysis_papers):
+    """Runs the steps of one user session with post(step, body), which returns the response JSON or None."""
+    term=rnd.choice(SEARCH_TERMS)
+    post('typeahead', callback_body('search_term_suggestions.children', [('search_term', 'value', term[:3])]))
+    result=post('search', search_body(term))
+    if result is None:
+        return
+    store=result['response']['search_result_store']['data']
+    result=post('page', page_body(outputs['page'], store, 0, [{'column_id': 'year', 'direction': 'desc'}]))
+    page_data=result['response']['search_result_table']['data'] if result else []
+    result=post('select_all', session_bodies(outputs, store, '', page_data)['select_all'])
+    if result is None:
+        return
+    selection=result['response']['selected_papers_store']['data']
+    post('move_to_analysis', session_bodies(outputs, store, selection, page_data)['move_to_analysis'])
+    #the user keeps a random part of the selection checked, so that the analyses are not all cached
+    paper_pks=[int(pk) for pk in decode_paper_pks(selection)]
+    if not paper_pks:
+        return
+    checked=sorted(rnd.sample(paper_pks, min(analysis_papers, len(paper_pks))))
+    for step, body in analysis_bodies(checked).items():
+        post(step, body)
+    paper_pk=rnd.choice(checked)
+    post('detail_summary', callback_body('for_detail_analysis.children', [('detail_pk_sel', 'value', str(paper_pk))]))
+    post('detail_pie', detail_body(paper_pk, 'pie', 'TOPIC', 1))
+    post('detail_hist', detail_body(paper_pk, 'hist', 'SECTOR', 0))
+
+def client(args):
+    """One closed-loop client, runs sessions until the deadline.
+    Returns:
+        A list of (step, latency, status) and the numbers of HTTP requests and complete sessions.
+    """
+    host, port, deadline, seed, outputs, analysis_papers, poll_interval, think_time=args
+    rnd=random.Random(seed)
+    samples=[]
+    counts={'requests': 0, 'sessions': 0}
+    def post(step, body):
+        start=time.perf_counter()
+        try:
+            status, result, requests=callback_request(host, port, body, poll_interval)
+        except OSError:
+            status, result, requests=599, None, 1
+        samples.append((step, time.perf_counter()-start, status))
+        counts['requests']+=requests
+        if think_time:
+            time.sleep(rnd.uniform(0, 2*think_time))
+        return result if status==200 else None
+    while time.time()<deadline:
+        run_session(post, outputs, rnd, analysis_papers)
+        counts['sessions']+=1
+    return samples, counts
+
+def percentiles(latencies):
+    return {p: float(np.percentile(latencies, p))*1000 for p in (50, 95, 99)}
+
+def report(samples, counts, duration):
+    """Prints the count, errors, p50, p95 and p99 (ms) of every step and the throughput, returns them as dict."""
+    summary={'steps': {}, 'requests_per_second': counts['requests']/duration, 'sessions_per_second': counts['sessions']/duration,
+        'steps_per_second': len(samples)/duration}
+    print('{:<18} {:>7} {:>7} {:>10} {:>10} {:>10}'.format('step', 'count', 'errors', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]'))
+    for step in STEPS+['all']:
+        latencies=[latency for name, latency, status in samples if name==step or step=='all']
+        if not latencies:
+            continue
+        errors=sum(status not in (200, 204) for name, latency, status in samples if name==step or step=='all')
+        p=percentiles(latencies)
+        summary['steps'][step]=dict(count=len(latencies), errors=errors, p50=p[50], p95=p[95], p99=p[99])
+        print('{:<18} {:>7} {:>7} {:>10.1f} {:>10.1f} {:>10.1f}'.format(step, len(latencies), errors, p[50], p[95], p[99]))
+    print('{:.1f} steps/s, {:.1f} HTTP requests/s (including the polls of background callbacks), {:.2f} sessions/s'.format(
+        summary['steps_per_second'], summary['requests_per_second'], summary['sessions_per_second']))
+    return summary
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', default='http://127.0.0.1:8050', help='URL of the running dashboard')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent closed-loop clients')
+    parser.add_argument('--duration', type=int, default=60, help='seconds of load')
+    parser.add_argument('--analysis-papers', type=int, default=500, help='number of checked papers per analysis')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='seconds between the polls of a background callback (the browser polls every second)')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean seconds a client waits after every step')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    args=parser.parse_args()
+
+    server=urlsplit(args.server)
+    host, port=server.hostname, server.port or 80
+    outputs=callback_outputs(host, port)
+    deadline=time.time()+args.duration
+    with multiprocessing.Pool(args.clients) as pool:
+        results=pool.map(client, [(host, port, deadline, args.seed*1000+i, outputs, args.analysis_papers, args.poll_interval, args.think_time) for i in range(args.clients)])
+    samples=[sample for r in results for sample in r[0]]
+    counts={key: sum(r[1][key] for r in results) for key in ('requests', 'sessions')}
+    print('{} clients, {} s, {} checked papers per analysis'.format(args.clients, args.duration, args.analysis_papers))
+    summary=report(samples, counts, args.duration)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(summary, clients=args.clients, duration=args.duration, analysis_papers=args.analysis_papers), f, indent=2)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Starts the production server (gunicorn -c gunicorn.conf.py app:server) with different numbers of workers and
+measures the memory per worker and the requests per second of a mix of search, paging and detail callbacks
+(the requests are built by load_driver.py, which replays whole user sessions against a running server).
+Run from the repository root (needs gunicorn, psutil and utils/credentials.py):
+    python -m benchmarks.load_server --workers 1 4 8 --duration 30 --clients 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+import psutil
+from benchmarks.load_driver import SEARCH_TERMS, search_body, page_body, detail_body, request
+
+
+def client(args):
+    """One closed-loop client: search, two result pages and a detail chart, repeated until the deadline."""
+    host, port, deadline, seed, page_output, paper_pks=args
+    rnd=random.Random(seed)
+    latencies=[]
+    errors=0
+    def post(body):
+        nonlocal errors
+        start=time.perf_counter()
+        status, data=request(host, port, 'POST', '/_dash-update-component', body)
+        latencies.append(time.perf_counter()-start)
+        errors+=status!=200
+        return status, data
+    while time.time()<deadline:
+        status, data=post(search_body(rnd.choice(SEARCH_TERMS)))
+        if status==200:
+            store=json.loads(data)['response']['search_result_store']['data']
+            post(page_body(page_output, store, 1, []))
+            post(page_body(page_output, store, 0, [{'column_id': 'year', 'direction': 'desc'}]))
+        post(detail_body(rnd.choice(paper_pks)))
+    return latencies, errors
+
+def memory(master):
+    """Returns the RSS of the master and RSS, USS (private) and PSS (proportional) of every worker in MB."""
+    mb=lambda b: b/2**20
+    workers=[p.memory_full_info() for p in master.children()]
+    return {
+        'master_rss': mb(master.memory_info().rss),
+        'worker_rss': mb(np.mean([w.rss for w in workers])),
+        'worker_uss': mb(np.mean([w.uss for w in workers])),
+        'worker_pss': mb(np.mean([w.pss for w in workers])),
+        'total_pss': mb(sum(w.pss for w in workers)+master.memory_full_info().pss)
+    }
+
+def run(n_workers, args):
+    env=dict(os.environ, GUNICORN_WORKERS=str(n_workers), GUNICORN_BIND='{}:{}'.format(args.host, args.port), GUNICORN_PRELOAD='0' if args.no_preload else '1')
+    server=subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:server'], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        start=time.time()
+        while True:
+            try:
+                status, data=request(args.host, args.port, 'GET', '/ready')
+                if status==200 and len(psutil.Process(server.pid).children())==n_workers:
+                    break
+            except OSError:
+                pass
+            if server.poll() is not None or time.time()-start>args.startup_timeout:
+                raise RuntimeError('server did not become ready')
+            time.sleep(0.5)
+        ready=json.loads(data)
+        startup=time.time()-start
+        master=psutil.Process(server.pid)
+        idle=memory(master)
+        #the output id of the paging callback contains a hash (allow_duplicate), take it from the app
+        page_output=next(d['output'] for d in json.loads(request(args.host, args.port, 'GET', '/_dash-dependencies')[1]) if d['output'].startswith('..search_result_table.data'))
+        paper_pks=list(range(min(ready['indexed_papers'], 1000)))
+        deadline=time.time()+args.duration
+        with multiprocessing.Pool(args.clients) as pool:
+            results=pool.map(client, [(args.host, args.port, deadline, seed, page_output, paper_pks) for seed in range(args.clients)])
+        latencies=np.concatenate([r[0] for r in results])
+        errors=sum(r[1] for r in results)
+        loaded=memory(master)
+        return {'workers': n_workers, 'startup': startup, 'requests': len(latencies), 'errors': errors, 'rps': len(latencies)/args.duration,
+            'p50': np.percentile(latencies, 50)*1000, 'p95': np.percentile(latencies, 95)*1000, 'p99': np.percentile(latencies, 99)*1000, 'idle': idle, 'loaded': loaded}
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent closed-loop clients')
+    parser.add_argument('--duration', type=int, default=30, help='seconds of load per worker count')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--no-preload', action='store_true', help='load the app in every worker instead of once before forking')
+    parser.add_argument('--startup-timeout', type=int, default=900)
+    args=parser.parse_args()
+
+    print('{} CPUs, {} clients, {} s per run, {}'.format(os.cpu_count(), args.clients, args.duration, 'no preload' if args.no_preload else 'preloaded app'))
+    print('{:>7} {:>9} {:>8} {:>7} {:>9} {:>9} {:>9} {:>11} {:>11} {:>11} {:>11} {:>11}'.format(
+        'workers', 'startup', 'req/s', 'errors', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'master RSS', 'worker RSS', 'worker USS', 'worker PSS', 'total PSS'))
+    for n_workers in args.workers:
+        r=run(n_workers, args)
+        m=r['loaded']
+        print('{:>7} {:>8.1f}s {:>8.1f} {:>7} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB'.format(
+            n_workers, r['startup'], r['rps'], r['errors'], r['p50'], r['p95'], r['p99'], m['master_rss'], m['worker_rss'], m['worker_uss'], m['worker_pss'], m['total_pss']))
+        print('{:>7} {:>9} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB {:>9.0f}MB  (idle, before load)'.format(
+            '', '', '', '', '', '', '', r['idle']['master_rss'], r['idle']['worker_rss'], r['idle']['worker_uss'], r['idle']['worker_pss'], r['idle']['total_pss']))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,30 @@
+#Production server configuration, run from the repository root with
+#    gunicorn -c gunicorn.conf.py app:server
+#The app (and with it all startup data) is loaded once in the master process before the workers are forked,
+#so the workers share the read-only dataframes and indices copy-on-write instead of loading them again.
+import gc
+import os
+
+bind=os.environ.get('GUNICORN_BIND', '0.0.0.0:8090')
+workers=int(os.environ.get('GUNICORN_WORKERS', 4))
+threads=int(os.environ.get('GUNICORN_THREADS', 1))
+timeout=int(os.environ.get('GUNICORN_TIMEOUT', 120))
+#GUNICORN_PRELOAD=0 loads the app in every worker instead (e.g. to compare the memory use)
+preload_app=os.environ.get('GUNICORN_PRELOAD', '1')!='0'
+accesslog=os.environ.get('GUNICORN_ACCESSLOG', None)
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    #the master does not query the database itself, its pooled connections must not be inherited by the workers
+    import app
+    app.db.dispose()
+    #move all objects loaded so far into the permanent generation, so that garbage collections in the workers
+    #do not touch (and thereby copy) the pages of the shared data
+    gc.collect()
+    gc.freeze()
+    server.log.info('startup data loaded, forking %s workers', workers)
+
+def post_fork(server, worker):
+    server.log.info('worker %s started', worker.pid)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+import utils.functions as fu
+from utils.export import stream_csv, stream_parquet
+
+pq=pytest.importorskip('pyarrow.parquet')
+
+DF=pd.DataFrame({
+    'paper_pk': [1, 2, 3, 4],
+    'title': ['A', None, np.nan, 'D'],
+    'topic': pd.Categorical(['x', None, 'y', np.nan]),
+    'year': [2019.0, np.nan, 2020.0, 2021.0],
+    'mixed': [1, 'two', None, 3.5]
+})
+
+
+def test_parquet_keeps_missing_values(tmp_path):
+    path=tmp_path/'export.parquet'
+    path.write_bytes(b''.join(stream_parquet(DF, chunk_size=3)))
+    table=pq.read_table(str(path))
+    assert table.num_rows==4 and pq.ParquetFile(str(path)).num_row_groups==2
+    assert table.column('title').to_pylist()==['A', None, None, 'D']
+    assert table.column('topic').to_pylist()==['x', None, 'y', None]
+    assert table.column('year').to_pylist()==[2019.0, None, 2020.0, 2021.0]
+    assert table.column('mixed').to_pylist()==['1', 'two', None, '3.5']
+
+def test_csv_writes_missing_values_empty():
+    lines=''.join(stream_csv(DF, chunk_size=3)).splitlines()
+    assert lines==['paper_pk,title,topic,year,mixed', '1,A,x,2019.0,1', '2,,,,two', '3,,y,2020.0,', '4,D,,2021.0,3.5']
+
+@pytest.mark.parametrize('selection', ['not a selection!', 'eJwzNDI2MQUAAvgBAA=='])
+def test_malformed_selection_is_a_value_error(selection):
+    #the export endpoint answers ValueErrors with 400
+    with pytest.raises(ValueError):
+        fu.get_selected_papers_df(selection, DF)
+    with pytest.raises(ValueError):
+        fu.select_papers(DF, ['99999999999999999999'])
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+import pandas as pd
+import pytest
+from utils.db import Database
+import utils.functions as fu
+
+
+def sqlite_db(tmp_path, tables):
+    db=Database('sqlite:///'+str(tmp_path/'warehouse.db'))
+    with db.engine.begin() as connection:
+        for name, df in tables.items():
+            df.to_sql(name, connection, index=False)
+    return db
+
+def test_keywords_are_sorted_on_sqlite(tmp_path):
+    #inserted in reverse order, so that an aggregation in insertion order would not be sorted
+    db=sqlite_db(tmp_path, {
+        'aggregation_paper': pd.DataFrame({'paper_pk': [2, 1, 1, 3], 'keywordgroup_pk': [20, 10, 10, None],
+            'title': ['B', 'A', 'A', 'C'], 'year': [2002, 2001, 2001, 2003], 'abstract': ['b', 'a', 'a', 'c']}),
+        'dim_keyword': pd.DataFrame({'keyword_pk': [5, 4, 3, 2, 1], 'keyword_string': ['zeta', 'mu', 'beta', 'alpha', 'mu']}),
+        'bridge_paper_keyword': pd.DataFrame({'keywordgroup_pk': [10, 10, 10, 20, 20, 20], 'keyword_pk': [5, 4, 2, 3, 1, 4]})
+    })
+    papers=fu.load_papers_with_keywords(db)
+    assert list(papers.columns)==['paper_pk', 'keywords', 'title', 'year', 'abstract']
+    assert list(papers['paper_pk'])==[1, 2, 3]
+    assert list(papers['keywords'])==['alpha, mu, zeta', 'beta, mu, mu', '']
+    assert list(fu.load_papers_with_keywords(db, abstracts=False).columns)==['paper_pk', 'keywords', 'title', 'year']
+
+FILTER_DF=pd.DataFrame({
+    'paper_pk': [1, 2, 3, 4, 5],
+    'title': ['Digital Platforms', 'supply chain trust', 'Platform "ecosystems"', 'Data-driven decisions', "Firms' platforms"],
+    'year': [2015, 2018, 2018, 2021, 2009],
+    'score': [0.5, 1.25, 2.0, 0.0, 10.0],
+    'topic': ['platforms', None, 'platforms', '', 'firms']
+})
+
+@pytest.mark.parametrize('filter_query, paper_pks', [
+    ('', [1, 2, 3, 4, 5]),
+    #contains is case sensitive, icontains not
+    ('{title} contains Platform', [1, 3]),
+    ('{title} contains "platform"', [5]),
+    ('{title} icontains platform', [1, 3, 5]),
+    ('{title} scontains chain', [2]),
+    ('{title} contains "supply chain"', [2]),
+    ("{title} contains 'Data-driven'", [4]),
+    ('{title} contains "Platform \\"ecosystems\\""', [3]),
+    ("{title} contains \"Firms' platforms\"", [5]),
+    #numbers compare numerically on numeric columns
+    ('{year} = 2018', [2, 3]),
+    ('{year} eq 2018', [2, 3]),
+    ('{year} != 2018', [1, 4, 5]),
+    ('{year} > 2015', [2, 3, 4]),
+    ('{year} >= 2015', [1, 2, 3, 4]),
+    ('{year} < 2015', [5]),
+    ('{year} le 2015', [1, 5]),
+    ('{score} > 1', [2, 3, 5]),
+    ('{score} = 1.25', [2]),
+    ('{score} < 2', [1, 2, 4]),
+    ('{year} > "2015"', [2, 3, 4]),
+    ('{year} = abc', []),
+    #and as strings on text columns
+    ('{title} = supply chain trust', [2]),
+    ('{title} ieq "DIGITAL PLATFORMS"', [1]),
+    ('{title} > S', [2]),
+    ('{topic} ne platforms', [2, 4, 5]),
+    ('{topic} is blank', [2, 4]),
+    ('{topic} is not blank', [1, 3, 5]),
+    ('{year} datestartswith 201', [1, 2, 3]),
+    #conditions are combined with and, unknown columns and operators are ignored
+    ('{year} >= 2015 && {title} icontains platform', [1, 3]),
+    ('{year} > 2010 && {topic} = platforms && {score} > 1', [3]),
+    ('{unknown} = 1 && {year} = 2021', [4]),
+    ('{year} between 2015 && {year} < 2010', [5]),
+])
+def test_filter_df_by_query(filter_query, paper_pks):
+    assert list(fu.filter_df_by_query(FILTER_DF, filter_query)['paper_pk'])==paper_pks
+
+@pytest.mark.parametrize('filter_part, parsed', [
+    ('{year} >= 2015', ('year', 'ge', '2015')),
+    ('{year} > 2015', ('year', 'gt', '2015')),
+    ('{title} contains "a b"', ('title', 'contains', 'a b')),
+    ("{title} icontains 'it\\'s'", ('title', 'icontains', "it's")),
+    ('{title}eq x', ('title', 'eq', 'x')),
+    ('{journal title} is blank', ('journal title', 'blank', '')),
+    #an operator word must be followed by a space
+    ('{title} lexicon', (None, None, None)),
+    ('year >= 2015', (None, None, None)),
+])
+def test_split_filter_part(filter_part, parsed):
+    assert fu.split_filter_part(filter_part)==parsed
+
+
+class SlowEntityQuery:
+    """Stands in for load_named_query: counts the queries per paper and records if two ran for the same paper at once."""
+    def __init__(self, delay=0.02):
+        self.delay=delay
+        self.lock=threading.Lock()
+        self.calls=Counter()
+        self.running=Counter()
+        self.overlaps=0
+
+    def __call__(self, db, name, pks):
+        with self.lock:
+            self.calls[pks[0]]+=1
+            self.running[pks[0]]+=1
+            self.overlaps+=self.running[pks[0]]>1
+        time.sleep(self.delay*random.random())
+        with self.lock:
+            self.running[pks[0]]-=1
+        return pd.DataFrame({'entity_label': ['TOPIC'], 'entity_name': ['t{}'.format(pks[0])], 'entity_count': [1], 'paper_pk': pks})
+
+@pytest.fixture
+def entity_query(monkeypatch):
+    query=SlowEntityQuery()
+    monkeypatch.setattr(fu, 'load_named_query', query)
+    monkeypatch.setattr(fu, '_entity_facts', OrderedDict())
+    monkeypatch.setattr(fu, '_entity_facts_loading', {})
+    return query
+
+def run_threads(n, target):
+    barrier=threading.Barrier(n)
+    results=[None]*n
+    def run(i):
+        barrier.wait()
+        results[i]=target(i)
+    threads=[threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_entity_loads_run_one_query(entity_query):
+    results=run_threads(16, lambda i: fu.load_paper_entities(7, None))
+    assert entity_query.calls[7]==1
+    assert all(result is results[0] for result in results)
+    assert fu._entity_facts_loading=={}
+    assert fu.load_paper_entities('7', None) is results[0] and entity_query.calls[7]==1
+
+def test_entity_loads_never_overlap(entity_query, monkeypatch):
+    #every cached entry is outdated at once, so that loads of a paper follow each other while others still wait
+    monkeypatch.setattr(fu, 'ENTITY_FACT_CACHE_TTL', -1)
+    run_threads(24, lambda i: [fu.load_paper_entities(i%3, None) for _ in range(20)])
+    assert entity_query.overlaps==0
+    assert fu._entity_facts_loading=={}
+
+def test_failed_entity_load_is_retried(entity_query, monkeypatch):
+    def failing(db, name, pks):
+        monkeypatch.setattr(fu, 'load_named_query', entity_query)
+        raise TimeoutError('No database connection available within 0 seconds.')
+    monkeypatch.setattr(fu, 'load_named_query', failing)
+    with pytest.raises(TimeoutError):
+        fu.load_paper_entities(3, None)
+    assert fu._entity_facts_loading=={}
+    assert fu.load_paper_entities(3, None)['paper_pk'].tolist()==[3]
+
+def test_readiness_of_empty_frames(tmp_path):
+    db=Database('sqlite:///'+str(tmp_path/'warehouse.db'))
+    df_k=pd.DataFrame({'paper_pk': [1], 'title': ['A'], 'keywords': [''], 'abstract': ['a'], 'year': [2020]})
+    search_index=fu.build_search_index(df_k)
+    frames={'df_k': df_k, 'paper_entities': pd.DataFrame({'paper_pk': [], 'entity_pk': []})}
+    status=fu.get_readiness(frames, search_index, db)
+    assert status['ready'] and status['rows']=={'df_k': 1, 'paper_entities': 0} and status['indexed_papers']==1
+    assert not fu.get_readiness(dict(frames, paper_entities=None), search_index, db)['ready']
+    assert not fu.get_readiness(frames, None, db)['ready']
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+import utils.functions as fu
+
+#two trees of one label: A > B > D > E, A > C and F > G, stored as closure (every ancestor with its distance and the entity itself)
+DIM_ENT=pd.DataFrame({'entity_pk': [1, 2, 3, 4, 5, 6, 7], 'entity_name': ['A', 'B', 'C', 'D', 'E', 'F', 'G'], 'entity_label': ['TOPIC']*7})
+CLOSURE=pd.DataFrame([(1, 1, 0), (2, 2, 0), (1, 2, 1), (3, 3, 0), (1, 3, 1), (4, 4, 0), (2, 4, 1), (1, 4, 2),
+    (5, 5, 0), (4, 5, 1), (2, 5, 2), (1, 5, 3), (6, 6, 0), (7, 7, 0), (6, 7, 1)], columns=['parent_entity_pk', 'child_entity_pk', 'depth_from_parent'])
+
+
+@pytest.fixture(scope='module')
+def ent_index():
+    return fu.build_entity_hierarchy_index(DIM_ENT, CLOSURE)
+
+def baseline_drill_to_level(ent_name, level, dim_ent, ent_hierarchy):
+    #the scan over both tables that drill_to_level replaced
+    if ent_name=='MISSING':
+        return 'MISSING'
+    ent_pk=dim_ent[dim_ent['entity_name']==ent_name]['entity_pk'].values[0]
+    all_parents=ent_hierarchy[ent_hierarchy['child_entity_pk']==ent_pk]
+    depth_from_level_zero=all_parents['depth_from_parent'].max()
+    try:
+        return dim_ent[dim_ent['entity_pk']==(all_parents[all_parents['depth_from_parent']==(depth_from_level_zero-level)]['parent_entity_pk'].values[0])]['entity_name'].values[0]
+    except IndexError:
+        return ent_name
+
+@pytest.mark.parametrize('level', list(range(9))+[-1, 1.5])
+def test_drill_to_level_matches_baseline(ent_index, level):
+    for ent_name in list(DIM_ENT['entity_name'])+['MISSING']:
+        assert fu.drill_to_level(ent_name, level, ent_index)==baseline_drill_to_level(ent_name, level, DIM_ENT, CLOSURE)
+
+def test_drill_column_to_level(ent_index):
+    names=pd.Series(['E', 'MISSING', 'G', 'C', 'unknown'], index=[10, 11, 12, 13, 14], name='topic')
+    rolled=fu.drill_column_to_level(names, 1, ent_index)
+    assert rolled.tolist()==['B', 'MISSING', 'G', 'C', 'unknown']
+    assert rolled.index.tolist()==[10, 11, 12, 13, 14] and rolled.name=='topic'
+    assert [fu.drill_to_level('E', level, ent_index) for level in range(5)]==['A', 'B', 'D', 'E', 'E']
+
+def test_descendants(ent_index):
+    #nearest first, entities of the same depth in the order of dim_entity
+    assert ent_index.descendants('A')==['A', 'B', 'C', 'D', 'E']
+    assert ent_index.descendants('A', max_depth=1)==['A', 'B', 'C']
+    assert ent_index.descendants('A', include_self=False)==['B', 'C', 'D', 'E']
+    assert ent_index.descendants('B')==['B', 'D', 'E']
+    assert ent_index.descendants('F')==['F', 'G']
+    #a leaf and an unknown entity
+    assert ent_index.descendants('E')==['E']
+    assert ent_index.descendants('E', include_self=False)==[]
+    assert ent_index.descendants('unknown')==[]
+    assert fu.find_child_entities(ent_index, 'B', max_depth=1)==['D']
+
+def test_descendants_from_direct_links_only():
+    #the closure is completed transitively if the hierarchy table only holds the direct links
+    ent_index=fu.build_entity_hierarchy_index(DIM_ENT, CLOSURE[CLOSURE['depth_from_parent']==1])
+    assert ent_index.descendants('A')==['A', 'B', 'C', 'D', 'E']
+    assert ent_index.descendants('A', max_depth=2, include_self=False)==['B', 'C', 'D']
+    assert ent_index.descendants('G')==['G']
+
+def test_ancestors(ent_index):
+    #the ancestor of every level of a leaf, a root stays itself at every level
+    assert [fu.drill_to_level('E', level, ent_index) for level in range(4)]==['A', 'B', 'D', 'E']
+    assert [fu.drill_to_level('A', level, ent_index) for level in range(4)]==['A']*4
+    assert fu.drill_to_level('G', 0, ent_index)=='F'
+    assert fu.drill_to_level('unknown', 0, ent_index)=='unknown'
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import pandas as pd
+from dash import Dash, html, Input, Output
+from utils.db import Database
+from utils.metrics import Metrics
+
+#the instrumentation may add at most 1% to the latency of a callback
+OVERHEAD_BUDGET=0.01
+#timing noise of the test machine that is allowed on top of the budget
+TOLERANCE=0.02
+REQUEST={'output': 'out.children', 'outputs': {'id': 'out', 'property': 'children'},
+    'inputs': [{'id': 'btn', 'property': 'n_clicks', 'value': 1}], 'state': [], 'changedPropIds': ['btn.n_clicks']}
+
+
+def load_counts(db):
+    return db.read_sql_query('select entity, count(*) as n from facts group by entity')
+
+def build_app(df, db, recorder=None):
+    #the same callback (a database helper and a groupby of an in-memory frame), instrumented by recorder or bare
+    app=Dash(__name__)
+    load=load_counts
+    if recorder is not None:
+        recorder.instrument_app(app)
+        load=recorder.timed_db(load_counts)
+    app.layout=html.Div([html.Button(id='btn'), html.Div(id='out')])
+
+    @app.callback(Output('out', 'children'), Input('btn', 'n_clicks'))
+    def summarize(n_clicks):
+        counts=load(db)
+        top=df.groupby('entity')['value'].sum().nlargest(5)
+        return '{} {}'.format(len(counts), top.to_dict())
+    return app
+
+def test_instrumentation_overhead(tmp_path):
+    rng=np.random.default_rng(0)
+    df=pd.DataFrame({'entity': rng.integers(1000, size=200000), 'value': rng.random(200000)})
+    db=Database('sqlite:///'+str(tmp_path/'metrics.db'))
+    with db.engine.begin() as connection:
+        df.iloc[:20000].to_sql('facts', connection, index=False)
+    recorder=Metrics()
+    recorder.configure(enabled=True, directory=None)
+    clients={True: build_app(df, db, recorder).server.test_client(), False: build_app(df, db).server.test_client()}
+    times={True: [], False: []}
+    for i in range(160):
+        #paired requests in alternating order, the first rounds warm up both apps
+        for instrumented in ((True, False) if i%2 else (False, True)):
+            client=clients[instrumented]
+            start=time.perf_counter()
+            response=client.post('/_dash-update-component', json=REQUEST)
+            elapsed=time.perf_counter()-start
+            assert response.status_code==200
+            if i>=10:
+                times[instrumented].append(elapsed)
+    snapshot=recorder.snapshot()
+    assert snapshot[('slr_callback_duration_seconds', 'summarize')][2]==160
+    assert snapshot[('slr_db_helper_duration_seconds', 'load_counts')][2]==160
+    #the median difference of the paired requests is the least disturbed by other processes
+    overhead=np.median(np.subtract(times[True], times[False]))/np.median(times[False])
+    assert overhead<OVERHEAD_BUDGET+TOLERANCE, 'instrumentation overhead {:.2%}'.format(overhead)
@@ -0,0 +1,148 @@
+import math
+import re
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+import utils.functions as fu
+from utils.search import top_k, tokenize
+
+PAPERS=[
+    (1, 'Digital platforms in supply chain management', 'supply chain, platform economy', 'We study digital platforms and their governance.', 2019),
+    (2, 'Trust and privacy of cloud services', 'cloud computing, trust', 'Privacy concerns reduce the adoption of cloud services.', 2020),
+    (3, 'An e-commerce ontology', 'e-commerce, ontology', 'The ontology describes e-commerce data-driven processes.', 2018),
+    (4, 'Data-driven decision support', 'decision support, data', 'Real-time decision support with supply data and chain analytics.', 2021),
+    (5, 'Blockchain for supply chains', 'blockchain, supply chain', 'Blockchains make the supply chain transparent. Trust follows.', 2019),
+    (6, 'Platform ecosystems', 'platform, ecosystem', 'Platform owners govern ecosystems of complementors.', 2017),
+    (7, 'Outsourcing decisions', 'outsourcing, sourcing', 'Firms decide on outsourcing and sourcing of IT services.', 2016),
+    (8, 'Privacy by design', 'privacy, design science', 'A design science study of privacy in digital health platforms.', 2020),
+]
+#papers with several rows (one per entity), like df_k
+TOPICS={1: ['platforms', 'governance'], 2: ['trust'], 3: ['ontologies'], 4: ['decision support', 'analytics'], 5: ['blockchain'],
+    6: ['platforms'], 7: ['outsourcing', 'sourcing'], 8: ['privacy', 'health']}
+
+
+@pytest.fixture(scope='module')
+def df():
+    rows=[{'paper_pk': pk, 'keywords': keywords, 'title': title, 'year': year, 'abstract': abstract, 'topic': topic}
+        for pk, title, keywords, abstract, year in PAPERS for topic in TOPICS[pk]]
+    return pd.DataFrame(rows)
+
+@pytest.fixture(scope='module')
+def index(df):
+    return fu.build_search_index(df)
+
+def regex_oracle(df, query, columns):
+    """The paper_pks found by the previous regex search: every word anywhere inside a column (all words of a column),
+    or the whole query in any cell with entire_df. Quoted parts must occur as they are."""
+    if 'entire_df' in columns:
+        return set(fu.filter_entire_df_by_searchterm(df, query)['paper_pk'])
+    patterns=[re.escape(quoted) if quoted else re.escape(word) for quoted, word in re.findall(r'"([^"]*)"|(\S+)', query)]
+    found=set()
+    for column in columns:
+        texts=df[column].astype(str)
+        matches=np.logical_and.reduce([texts.str.contains(pattern, case=False, regex=True) for pattern in patterns])
+        found|=set(df.loc[matches, 'paper_pk'])
+    return found
+
+def search(df, index, query, columns, **kwargs):
+    return set(fu.search_papers_by_searchterm(df, index, query, columns, **kwargs)['paper_pk'])
+
+@pytest.mark.parametrize('columns, query', [
+    (['title'], 'platform'),
+    (['title'], 'PLATFORM'),
+    #infix: inside a word
+    (['title'], 'latfor'),
+    (['abstract'], 'chain'),
+    (['keywords'], 'sourcing'),
+    #multi-word: all words in the same column
+    (['abstract'], 'supply chain'),
+    (['title'], 'supply chain'),
+    (['abstract'], 'trust supply'),
+    (['title', 'keywords', 'abstract'], 'digital platform'),
+    (['title', 'keywords'], 'privacy design'),
+    #words with punctuation
+    (['title'], 'e-commerce'),
+    (['abstract'], 'data-driven'),
+    (['keywords'], 'chain, platform'),
+    (['keywords'], 'support,'),
+    #quoted phrases
+    (['abstract'], '"supply chain"'),
+    (['abstract'], '"supply data"'),
+    (['title', 'abstract'], '"cloud services" privacy'),
+    #entire_df: the whole query in any column, also in the entity and year columns
+    (['entire_df'], 'supply chain'),
+    (['entire_df'], 'chain analytics'),
+    (['entire_df'], 'governance'),
+    (['entire_df'], '2019'),
+    (['entire_df'], 'data-driven'),
+    (['entire_df'], 'support, data'),
+    #nothing found
+    (['title'], 'quantum'),
+    (['abstract'], 'supply quantum'),
+])
+def test_index_matches_regex_oracle(df, index, columns, query):
+    assert search(df, index, query, columns)==regex_oracle(df, query, columns)
+
+def test_column_scope(df, index):
+    #transparent only occurs in the abstract of paper 5, ecosystem in title, keywords and abstract of paper 6
+    assert search(df, index, 'transparent', ['abstract'])=={5}
+    assert search(df, index, 'transparent', ['title', 'keywords'])==set()
+    assert search(df, index, 'transparent', ['entire_df'])=={5}
+    assert search(df, index, 'complementors', ['keywords'])==set()
+
+def test_result_rows_of_matching_papers(df, index):
+    result_df=fu.search_papers_by_searchterm(df, index, 'platform', ['title'])
+    assert result_df.equals(df[df['paper_pk'].isin([1, 6])])
+
+def naive_bm25(texts, tokens, k1=1.2, b=0.75):
+    #BM25 of exactly matching tokens, computed text by text
+    docs=[Counter(tokenize(text)) for text in texts]
+    average_length=max(np.mean([sum(doc.values()) for doc in docs]), 1.0)
+    scores=np.zeros(len(docs))
+    for token in tokens:
+        df=sum(token in doc for doc in docs)
+        idf=math.log(1+(len(docs)-df+0.5)/(df+0.5))
+        for i, doc in enumerate(docs):
+            tf=doc[token]
+            if tf:
+                scores[i]+=idf*tf*(k1+1)/(tf+k1*(1-b+b*sum(doc.values())/average_length))
+    return scores
+
+@pytest.mark.parametrize('query', ['supply chain', 'platform', 'privacy trust', '"decision support"'])
+def test_bm25_scores(df, index, query):
+    papers=df.drop_duplicates('paper_pk')
+    tokens=tokenize(query)
+    expected=sum(weight*naive_bm25(papers[field], tokens) for field, weight in fu.BM25_FIELD_WEIGHTS.items())
+    np.testing.assert_allclose(index.score(query, fu.BM25_FIELD_WEIGHTS, match='exact'), expected)
+
+def test_ranking_prefers_matches_in_more_fields(df, index):
+    result_df=fu.search_papers_by_searchterm(df, index, 'privacy', ['title', 'keywords', 'abstract'], rank=True)
+    ranked=result_df.drop_duplicates('paper_pk').sort_values('score', ascending=False, kind='stable')
+    #privacy in title, keywords and abstract (8) before title and abstract only (2)
+    assert list(ranked['paper_pk'])==[8, 2]
+    assert list(result_df.columns)==['score']+list(df.columns)
+    assert (result_df['score']>0).all()
+
+@pytest.mark.parametrize('n, k', [(0, 5), (10, 0), (10, 3), (10, 10), (10, 25), (1000, 1), (1000, 50), (1000, 999)])
+def test_top_k_equals_full_sort(n, k):
+    rng=np.random.default_rng(n+k)
+    #few distinct values, so that many scores are tied, also at the cut
+    scores=rng.integers(0, 5, size=n).astype(float)
+    expected=np.lexsort((np.arange(n), -scores))[:k]
+    np.testing.assert_array_equal(top_k(scores, k), expected)
+
+def test_top_k_breaks_ties_by_position():
+    scores=np.array([1.0, 3.0, 2.0, 3.0, 2.0, 3.0, 0.0])
+    assert top_k(scores, 2).tolist()==[1, 3]
+    assert top_k(scores, 4).tolist()==[1, 3, 5, 2]
+    assert top_k(scores, 4).tolist()==top_k(scores.copy(), 4).tolist()
+    assert top_k(np.zeros(4), 3).tolist()==[0, 1, 2]
+
+def test_ranked_pages_follow_the_full_sort():
+    rng=np.random.default_rng(1)
+    result_df=pd.DataFrame({'score': rng.integers(0, 4, size=53).astype(float), 'paper_pk': np.arange(53)})
+    expected=result_df.sort_values('score', ascending=False, kind='stable')
+    pages=[fu.get_table_page(result_df, page, 10)[0] for page in range(6)]
+    assert pd.concat(pages).equals(expected)
+    assert fu.get_export_rows(result_df).equals(expected)
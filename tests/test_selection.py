@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from utils.selection import encode_paper_pks, decode_paper_pks, update_selection
+
+
+@pytest.mark.parametrize('paper_pks', [
+    [],
+    [7],
+    [0],
+    [5, 3, 9, 1],
+    [4, 4, 2, 2, 2],
+    ['12', '3'],
+    np.arange(0, 300000, 3),
+    np.random.default_rng(0).choice(2**40, size=50000, replace=False),
+])
+def test_round_trip(paper_pks):
+    encoded=encode_paper_pks(paper_pks)
+    assert isinstance(encoded, str)
+    decoded=decode_paper_pks(encoded)
+    assert decoded.dtype==np.int64
+    np.testing.assert_array_equal(decoded, np.unique(np.asarray(paper_pks, dtype=np.int64)))
+
+def test_empty_selection():
+    assert encode_paper_pks([])=='' and encode_paper_pks(None)==''
+    assert len(decode_paper_pks(''))==0 and len(decode_paper_pks(None))==0
+
+def test_large_selection_stays_small():
+    #the byte planes of small differences compress well, 100k papers need 800 kB as int64
+    assert len(encode_paper_pks(np.arange(100000)))<2000
+
+def test_store_round_trip():
+    #the selected_papers_store after ticking papers on two pages and unticking one of them
+    store=encode_paper_pks(update_selection(decode_paper_pks(''), add=[30, 10, 20]))
+    store=encode_paper_pks(update_selection(decode_paper_pks(store), add=[40, 10], remove=[20, 99]))
+    assert decode_paper_pks(store).tolist()==[10, 30, 40]
+    store=encode_paper_pks(update_selection(decode_paper_pks(store), remove=[10, 30, 40]))
+    assert store=='' and len(decode_paper_pks(store))==0
+
+#not base64, truncated, not a multiple of 8 bytes (zlib of b'12345') and not a string
+@pytest.mark.parametrize('encoded', ['not a selection!', 'AAAA', encode_paper_pks([1, 2, 3])[:-4], 'eJwzNDI2MQUAAvgBAA==', [1, 2], 12])
+def test_malformed_store(encoded):
+    with pytest.raises(ValueError):
+        decode_paper_pks(encoded)
@@ -0,0 +1,37 @@
+import pandas as pd
+from utils.text_store import TextStore
+from utils.search import StoredTexts
+import utils.functions as fu
+
+TEXTS={3: 'Third abstract', 1: 'First abstract', 2: 'Zweites Abstract, mit Umlaut: ä', 5: None}
+
+
+def write_store(tmp_path):
+    return TextStore.write(str(tmp_path/'store'), list(TEXTS), list(TEXTS.values()))
+
+def test_get_many_keeps_order_and_duplicates(tmp_path):
+    store=write_store(tmp_path)
+    assert store.get_many([3, 1, 1, 2])==[TEXTS[3], TEXTS[1], TEXTS[1], TEXTS[2]]
+    assert store.get_many([9, 3, 9], default=None)==[None, TEXTS[3], None]
+    assert list(store.positions([2, 2, 7, 1]))==[1, 1, -1, 0]
+    assert store.get(5)==''
+    assert store.get_many([])==[]
+
+def test_stored_texts_follow_the_index_order(tmp_path):
+    store=write_store(tmp_path)
+    texts=StoredTexts(store, [2, 3, 1])
+    assert [texts[pos] for pos in range(len(texts))]==[TEXTS[2].lower(), TEXTS[3].lower(), TEXTS[1].lower()]
+
+def test_tooltips_of_unsorted_page_with_duplicate_pks(tmp_path):
+    store=write_store(tmp_path)
+    page_df=pd.DataFrame({'paper_pk': [3, 1, 3, 2], 'title': ['c', 'a', 'c', 'b'], 'year': [2003, 2001, 2003, 2002]})
+    tooltips=fu.generate_tooltip_data(page_df, store)
+    assert [tooltip['title']['value'] for tooltip in tooltips]==[
+        '**c**\n\n'+TEXTS[3], '**a**\n\n'+TEXTS[1], '**c**\n\n'+TEXTS[3], '**b**\n\n'+TEXTS[2]]
+
+def test_add_stored_abstracts_after_year(tmp_path):
+    store=write_store(tmp_path)
+    df=pd.DataFrame({'paper_pk': [2, 1, 2], 'title': ['b', 'a', 'b'], 'year': [2002, 2001, 2002], 'topic': ['x', 'y', 'z']})
+    df=fu.add_stored_abstracts(df, store)
+    assert list(df.columns)==['paper_pk', 'title', 'year', 'abstract', 'topic']
+    assert list(df['abstract'])==[TEXTS[2], TEXTS[1], TEXTS[2]]
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from dash import DiskcacheManager
+
+#background callback settings that are used if the credentials do not define BACKGROUND_SETTINGS
+DEFAULT_BACKGROUND_SETTINGS={
+    'directory': os.path.join(tempfile.gettempdir(), 'slr_dashboard_jobs'),
+    'expire': 600
+}
+
+
+class DedupingDiskcacheManager(DiskcacheManager):
+    """Background callback manager that runs every job in a forked process and keeps results in a local diskcache
+    (no external broker). The cache is shared by all worker processes of the server.
+    In addition to the DiskcacheManager, identical jobs (same callback and arguments) that are still running are
+    started only once: later requests attach to the running job. A job is only terminated (cancelled) when no
+    request is waiting for it anymore, and results are kept for expire seconds, so that repeated requests are
+    answered from the cache. Errors and PreventUpdate results are not kept.
+    Args:
+        cache (diskcache.Cache): The cache holding results, progress and running jobs.
+        cache_by (list): Zero-argument functions whose values are part of every cache key (e.g. a data version).
+        expire (int): Seconds a result is kept after it was last read.
+    """
+    def __init__(self, cache, cache_by=None, expire=None):
+        super().__init__(cache, cache_by=cache_by, expire=expire)
+        self.job_expire=expire
+
+    def call_job_fn(self, key, job_fn, args, context):
+        with self.handle.transact():
+            job=self.handle.get(('running', key))
+            if job is not None and self.job_running(job):
+                #attach to the identical job that is already running
+                self.handle.incr(('waiting', job), default=0)
+                return job
+            job=super().call_job_fn(key, job_fn, args, context)
+            self.handle.set(('running', key), job, expire=self.job_expire)
+            self.handle.set(('job_key', job), key, expire=self.job_expire)
+            self.handle.set(('waiting', job), 1, expire=self.job_expire)
+        return job
+
+    def terminate_job(self, job):
+        if job is None:
+            return
+        job=int(job)
+        with self.handle.transact():
+            waiting=self.handle.get(('waiting', job), 0)
+            if waiting>1:
+                #other requests still wait for the result of this job
+                self.handle.set(('waiting', job), waiting-1, expire=self.job_expire)
+                return
+            self.handle.delete(('waiting', job))
+            self._forget(job)
+        super().terminate_job(job)
+
+    def _forget(self, job):
+        #the job is finished or cancelled, identical requests must not attach to its (possibly reused) process id
+        key=self.handle.pop(('job_key', job), None)
+        if key is not None and self.handle.get(('running', key))==job:
+            self.handle.delete(('running', key))
+
+    def get_result(self, key, job):
+        result=super().get_result(key, job)
+        if result is not self.UNDEFINED and job:
+            with self.handle.transact():
+                self._forget(int(job))
+        if isinstance(result, dict) and ('long_callback_error' in result or '_dash_no_update' in result):
+            self.clear_cache_entry(key)
+        return result
+
+
+def create_background_manager(settings=None, cache_by=None):
+    """Creates the manager of the background callbacks with a diskcache in the configured directory.
+    Args:
+        settings (dict): 'directory' of the cache and 'expire' (seconds results are kept), missing values are
+            taken from DEFAULT_BACKGROUND_SETTINGS.
+        cache_by (list): Zero-argument functions whose values are part of every cache key.
+    Returns:
+        A DedupingDiskcacheManager.
+    """
+    import diskcache
+    settings=dict(DEFAULT_BACKGROUND_SETTINGS, **(settings or {}))
+    return DedupingDiskcacheManager(diskcache.Cache(settings['directory']), cache_by=cache_by, expire=settings['expire'])
@@ -0,0 +1 @@
+DB_CONNECTION_PARAMS = {'url': 'postgresql://postgres:@/postgres?host=/tmp/pgdata'}
@@ -0,0 +1,205 @@
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, event, inspect, text
+from sqlalchemy.pool import QueuePool
+from utils.queries import QUERIES
+
+#bound parameters (:name, but not ::type casts) and array parameters (= ANY(:name)) of the registered statements
+PARAMETER_PATTERN=re.compile(r'(?<![:\w]):(\w+)')
+ARRAY_PARAMETER_PATTERN=re.compile(r'=\s*ANY\(:(\w+)\)', re.IGNORECASE)
+
+#pool settings that are used if the credentials do not define DB_POOL_SETTINGS
+DEFAULT_POOL_SETTINGS={
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'max_concurrent_queries': None,
+    'queue_timeout': 120,
+    'prepare_statements': True
+}
+
+
+class Database:
+    """Data access layer around an SQLAlchemy engine with a configurable QueuePool.
+    Every query runs in a connection scoped by a context manager, so connections always go back to the pool.
+    A semaphore bounds the number of concurrent queries: a burst of callbacks waits for a free slot
+    instead of failing with a pool timeout.
+    Args:
+        url (str): The SQLAlchemy database URL (PostgreSQL, or e.g. sqlite:///file.db as local stand-in).
+        pool_size (int): Number of connections kept open in the pool.
+        max_overflow (int): Number of additional connections opened under load.
+        pool_timeout (int): Seconds to wait for a connection from the pool.
+        pool_pre_ping (bool): Test connections before handing them out, to replace connections dropped by the server.
+        pool_recycle (int): Seconds after which connections are replaced.
+        max_concurrent_queries (int): Maximum number of queries running at the same time, pool_size+max_overflow if None.
+        queue_timeout (int): Seconds a query waits for a free slot before a TimeoutError is raised, None to wait forever.
+        prepare_statements (bool): On PostgreSQL, run the registered queries as server-side prepared statements.
+    """
+    def __init__(self, url, pool_size=5, max_overflow=10, pool_timeout=30, pool_pre_ping=True, pool_recycle=1800, max_concurrent_queries=None, queue_timeout=120, prepare_statements=True):
+        connect_args={'check_same_thread': False} if url.startswith('sqlite') else {}
+        self.engine=create_engine(url, future=True, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow,
+            pool_timeout=pool_timeout, pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle, connect_args=connect_args)
+        self.max_concurrent_queries=max_concurrent_queries or pool_size+max_overflow
+        self.queue_timeout=queue_timeout
+        self._slots=threading.BoundedSemaphore(self.max_concurrent_queries)
+        self._lock=threading.Lock()
+        self._stats={'queries': 0, 'queued': 0, 'max_queued': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0, 'queue_timeouts': 0, 'connects': 0, 'checkouts': 0}
+        self.prepare_statements=prepare_statements and self.engine.dialect.name=='postgresql'
+        self._statements={}
+        self._query_stats={}
+        self._parent_pools=[]
+        event.listen(self.engine, 'connect', self._on_connect)
+        event.listen(self.engine, 'checkout', self._on_checkout)
+        if hasattr(os, 'register_at_fork'):
+            ref=weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+
+    def _after_fork(self):
+        #a forked process (a server worker or a background job) must not share the connections and locks of its parent.
+        #The parent's pool is kept referenced and never closed here, so that its connections stay intact for the parent.
+        self._parent_pools.append(self.engine.pool)
+        self.engine.pool=self.engine.pool.recreate()
+        self._slots=threading.BoundedSemaphore(self.max_concurrent_queries)
+        self._lock=threading.Lock()
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        #a new (or recycled) DBAPI connection has no prepared statements yet
+        connection_record.info['prepared_statements']=set()
+        with self._lock:
+            self._stats['connects']+=1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self._stats['checkouts']+=1
+
+    @contextmanager
+    def connect(self):
+        """Context manager yielding a pooled connection, waiting for a free query slot first.
+        Raises:
+            TimeoutError: If no slot became free within queue_timeout seconds.
+        """
+        start=time.perf_counter()
+        with self._lock:
+            self._stats['queued']+=1
+            self._stats['max_queued']=max(self._stats['max_queued'], self._stats['queued'])
+        try:
+            acquired=self._slots.acquire(timeout=self.queue_timeout) if self.queue_timeout is not None else self._slots.acquire()
+        finally:
+            with self._lock:
+                self._stats['queued']-=1
+        if not acquired:
+            with self._lock:
+                self._stats['queue_timeouts']+=1
+            raise TimeoutError('No database connection available within {} seconds.'.format(self.queue_timeout))
+        try:
+            with self.engine.connect() as connection:
+                #time spent waiting for a slot and for a connection from the pool
+                waited=time.perf_counter()-start
+                with self._lock:
+                    self._stats['queries']+=1
+                    self._stats['wait_time_total']+=waited
+                    self._stats['wait_time_max']=max(self._stats['wait_time_max'], waited)
+                yield connection
+        finally:
+            self._slots.release()
+
+    def read_sql_table(self, table):
+        """Loads an entire table as dataframe."""
+        with self.connect() as connection:
+            return pd.read_sql_table(table, connection)
+
+    def read_sql_query(self, querystring, params=None):
+        """Loads the result of a SELECT statement (with optional bound parameters) as dataframe."""
+        with self.connect() as connection:
+            return pd.read_sql_query(text(querystring), connection, params=params)
+
+    def table_columns(self, table):
+        """Returns the column names of a table in their order in the database."""
+        with self.connect() as connection:
+            return [column['name'] for column in inspect(connection).get_columns(table)]
+
+    def _statement(self, name):
+        #the registered statement as SQLAlchemy text, array parameters become expanding IN lists for other databases than PostgreSQL
+        if name not in self._statements:
+            querystring=QUERIES[name]
+            statement=text(querystring)
+            if self.engine.dialect.name!='postgresql':
+                array_params=ARRAY_PARAMETER_PATTERN.findall(querystring)
+                statement=text(ARRAY_PARAMETER_PATTERN.sub(r'IN :\1', querystring)).bindparams(*[bindparam(p, expanding=True) for p in array_params])
+            self._statements[name]=statement
+        return self._statements[name]
+
+    def _read_prepared(self, connection, name, params):
+        #PREPARE the statement once per DBAPI connection, afterwards only EXECUTE it with the new values
+        querystring=QUERIES[name]
+        param_names=list(dict.fromkeys(PARAMETER_PATTERN.findall(querystring)))
+        positional=PARAMETER_PATTERN.sub(lambda m: '${}'.format(param_names.index(m.group(1))+1), querystring)
+        dbapi_connection=connection.connection
+        prepared=dbapi_connection.info.setdefault('prepared_statements', set())
+        cursor=dbapi_connection.cursor()
+        try:
+            if name not in prepared:
+                cursor.execute('PREPARE {} AS {}'.format(name, positional))
+                prepared.add(name)
+            cursor.execute('EXECUTE {}({})'.format(name, ', '.join(['%s']*len(param_names))), [params[p] for p in param_names])
+            columns=[column[0] for column in cursor.description]
+            return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+        finally:
+            cursor.close()
+
+    def read_named_query(self, name, params=None):
+        """Runs a statement of the query registry (utils/queries.py) with bound parameters and records its timing.
+        Args:
+            name (str): The name of the statement in QUERIES.
+            params (dict): The parameter values, lists for array parameters.
+        Returns:
+            A pandas dataframe of the selected data.
+        """
+        params=params or {}
+        start=time.perf_counter()
+        with self.connect() as connection:
+            if self.prepare_statements:
+                result=self._read_prepared(connection, name, params)
+            else:
+                result=pd.read_sql_query(self._statement(name), connection, params=params)
+        elapsed=time.perf_counter()-start
+        with self._lock:
+            stats=self._query_stats.setdefault(name, {'count': 0, 'time_total': 0.0, 'time_max': 0.0})
+            stats['count']+=1
+            stats['time_total']+=elapsed
+            stats['time_max']=max(stats['time_max'], elapsed)
+        return result
+
+    def query_timings(self):
+        """Returns count, total, average and maximum run time (in seconds) of every registered statement run so far."""
+        with self._lock:
+            timings={name: dict(stats) for name, stats in self._query_stats.items()}
+        for stats in timings.values():
+            stats['time_avg']=stats['time_total']/stats['count']
+        return timings
+
+    def pool_status(self):
+        """Returns the pool metrics: size, checked out and overflow connections, and the query queue and wait times."""
+        pool=self.engine.pool
+        with self._lock:
+            stats=dict(self._stats)
+        stats.update({
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'max_concurrent_queries': self.max_concurrent_queries,
+            'wait_time_avg': stats['wait_time_total']/stats['queries'] if stats['queries'] else 0.0
+        })
+        return stats
+
+    def dispose(self):
+        """Closes all pooled connections, e.g. after forking a worker process."""
+        self.engine.dispose()
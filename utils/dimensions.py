@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from utils.selection import to_paper_pk_array
+
+
+class PaperDimensions:
+    """The journal of every paper and the institution and country of every author of a paper, as integer codes,
+    built once at startup from the dimension tables, which do not change while the app runs.
+    The journals are stored as one code per paper (sorted by paper_pk), the authors as one institution and country
+    code per (paper, author) row, sorted by paper_pk and author position, with the rows of the i-th paper at
+    _author_ptr[i]:_author_ptr[i+1]. Counting the journals or institutions of a selection of papers is a binary
+    search and a bincount over these arrays, no query.
+    Args:
+        paper_journals (pandas dataframe): paper_pk and journal (title of the journal, missing if none) of every paper.
+        paper_institutions (pandas dataframe): paper_pk, author_position, institution and country of every author of a paper.
+    """
+    def __init__(self, paper_journals, paper_institutions):
+        journals=paper_journals.drop_duplicates(subset='paper_pk').sort_values('paper_pk')
+        self.paper_pks=journals['paper_pk'].to_numpy(dtype=np.int64)
+        codes, journal_names=pd.factorize(journals['journal'])
+        self.journals=np.asarray(journal_names, dtype=object)
+        self.journal_codes=codes.astype(np.int32)
+        #authors of papers that are not in paper_journals can never be selected
+        authors=paper_institutions[paper_institutions['paper_pk'].isin(self.paper_pks)].sort_values(['paper_pk', 'author_position'], kind='stable')
+        pos=np.searchsorted(self.paper_pks, authors['paper_pk'].to_numpy(dtype=np.int64))
+        self._author_ptr=np.concatenate([[0], np.cumsum(np.bincount(pos, minlength=len(self.paper_pks)))])
+        #MISSING institutions are not counted, like missing ones
+        institutions=authors['institution'].where(authors['institution']!='MISSING')
+        codes, institution_names=pd.factorize(institutions)
+        self.institutions=np.asarray(institution_names, dtype=object)
+        self.institution_codes=codes.astype(np.int32)
+        codes, country_names=pd.factorize(authors['country'])
+        self.countries=np.asarray(country_names, dtype=object)
+        self.country_codes=codes.astype(np.int32)
+
+    def __len__(self):
+        return len(self.paper_pks)
+
+    def positions(self, paper_pks):
+        """Returns the positions of the given paper_pks in self.paper_pks, unknown pks are left out."""
+        pks=to_paper_pk_array(paper_pks)
+        pos=np.searchsorted(self.paper_pks, pks)
+        inside=pos<len(self.paper_pks)
+        pos, pks=pos[inside], pks[inside]
+        return pos[self.paper_pks[pos]==pks]
+
+    def _author_rows(self, pos):
+        #positions of the author rows of the papers at pos
+        starts=self._author_ptr[pos]
+        lengths=self._author_ptr[pos+1]-starts
+        return np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(lengths.sum())
+
+    def journal_counts(self, paper_pks):
+        """Returns the number of the given papers per journal (papers without journal are left out).
+        Returns:
+            A pandas dataframe with the columns journal and papers, in the order of the journals.
+        """
+        codes=self.journal_codes[self.positions(paper_pks)]
+        counts=np.bincount(codes[codes>=0], minlength=len(self.journals))
+        found=np.flatnonzero(counts)
+        return pd.DataFrame({'journal': self.journals[found], 'papers': counts[found]})
+
+    def institution_counts(self, paper_pks):
+        """Returns the number of authors of the given papers per institution (an author of several papers is counted
+        for each paper), with the country of the first author of the institution (lowest paper_pk and position).
+        Returns:
+            A pandas dataframe with the columns institution, country and authors, in the order of the institutions.
+        """
+        rows=self._author_rows(self.positions(paper_pks))
+        codes=self.institution_codes[rows]
+        known=codes>=0
+        codes, rows=codes[known], rows[known]
+        counts=np.bincount(codes, minlength=len(self.institutions))
+        found, first=np.unique(codes, return_index=True)
+        #code -1 (no country) takes the None appended at the end
+        countries=np.append(self.countries, None)[self.country_codes[rows[first]]]
+        return pd.DataFrame({'institution': self.institutions[found], 'country': countries, 'authors': counts[found]})
@@ -0,0 +1,134 @@
+import io
+import re
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa=None
+
+#rows (CSV, Parquet) or papers (BibTeX) that are converted and sent at a time
+EXPORT_CHUNK_SIZE=2000
+#mimetype of every available export format
+EXPORT_FORMATS={
+    'csv': 'text/csv',
+    'bib': 'application/x-bibtex'
+}
+if pa is not None:
+    EXPORT_FORMATS['parquet']='application/vnd.apache.parquet'
+BIBTEX_SPECIAL_CHARACTERS=re.compile(r'([{}&%$#_\\])')
+
+
+def iter_chunks(df, chunk_size=EXPORT_CHUNK_SIZE, prepare=None):
+    """Yields consecutive slices of chunk_size rows of a dataframe, passed through prepare (a function returning
+    the chunk with added columns, e.g. the abstracts of a TextStore) if given."""
+    for start in range(0, len(df), chunk_size):
+        chunk=df.iloc[start:start+chunk_size]
+        yield chunk if prepare is None else prepare(chunk)
+
+def stream_csv(df, chunk_size=EXPORT_CHUNK_SIZE, prepare=None):
+    """Yields a dataframe as CSV text: the header first, so that the download starts at once, then chunk_size rows at a time."""
+    yield (df.iloc[:0] if prepare is None else prepare(df.iloc[:0])).to_csv(index=False)
+    for chunk in iter_chunks(df, chunk_size, prepare):
+        yield chunk.to_csv(index=False, header=False)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that keeps the written bytes until they are taken with drain(), and its absolute position."""
+    def __init__(self):
+        super().__init__()
+        self.parts=[]
+        self.position=0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position+=len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data=b''.join(self.parts)
+        self.parts=[]
+        return data
+
+def _arrow_schema(df):
+    #text and categorical columns are written as strings, numeric columns keep their type
+    fields=[]
+    for col, dtype in df.dtypes.items():
+        if dtype==object or isinstance(dtype, pd.CategoricalDtype):
+            fields.append(pa.field(str(col), pa.string()))
+        else:
+            fields.append(pa.field(str(col), pa.from_numpy_dtype(dtype)))
+    return pa.schema(fields)
+
+def _text_values(chunk):
+    #the values of the text and categorical columns as str, missing values stay missing (null, not "None" or "nan")
+    chunk=chunk.copy(deep=False)
+    for col in chunk.columns[(chunk.dtypes==object) | (chunk.dtypes=='category')]:
+        values=chunk[col].astype(object)
+        chunk[col]=values.where(values.isna(), values.astype(str))
+    return chunk
+
+def stream_parquet(df, chunk_size=EXPORT_CHUNK_SIZE, prepare=None):
+    """Yields a dataframe as Parquet file, written as one row group per chunk_size rows.
+    Every row group is sent as soon as it is written, the file footer comes with the last part.
+    """
+    schema=_arrow_schema(df if prepare is None else prepare(df.iloc[:0]))
+    sink=_ChunkSink()
+    writer=pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in iter_chunks(df, chunk_size, prepare):
+            writer.write_table(pa.Table.from_pandas(_text_values(chunk), schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def bibtex_value(value):
+    """Escapes the characters of a value that have a special meaning in BibTeX and LaTeX."""
+    return BIBTEX_SPECIAL_CHARACTERS.sub(r'\\\1', str(value))
+
+def format_bibtex_entry(key, fields):
+    """Formats one @article entry.
+    Args:
+        key (str): The citation key.
+        fields (list): (name, value) tuples, empty values are left out.
+    Returns:
+        The entry as string.
+    """
+    lines=['  {} = {{{}}}'.format(name, bibtex_value(value)) for name, value in fields if not pd.isna(value) and value!='']
+    return '@article{{{},\n{}\n}}\n\n'.format(key, ',\n'.join(lines))
+
+def stream_bibtex(papers, load_references, chunk_size=EXPORT_CHUNK_SIZE, prepare=None):
+    """Yields BibTeX @article entries of papers, chunk_size papers at a time.
+    Args:
+        papers (pandas dataframe): One row per paper with paper_pk, title, year, abstract and keywords.
+        load_references (function): Returns for a list of paper_pks a tuple of two dataframes, the citation key
+            and journal (paper_pk, citekey, journal) and the authors in order (paper_pk, surname, firstname, middlename).
+        chunk_size (int): The number of papers per part.
+        prepare (function): Returns a chunk of papers with added columns (see iter_chunks).
+    """
+    for chunk in iter_chunks(papers, chunk_size, prepare):
+        references, authors=load_references([int(pk) for pk in chunk['paper_pk']])
+        references=references.drop_duplicates(subset='paper_pk').set_index('paper_pk')
+        names=authors[['surname', 'firstname', 'middlename']].fillna('').replace('MISSING', '')
+        authors=authors.assign(name=names['surname']+', '+(names['firstname']+' '+names['middlename']).str.strip())
+        author_lists=authors.groupby('paper_pk', sort=False)['name'].agg(' and '.join)
+        entries=[]
+        for paper in chunk.itertuples(index=False):
+            citekey=references['citekey'].get(paper.paper_pk)
+            entries.append(format_bibtex_entry(citekey if isinstance(citekey, str) and citekey else 'paper{}'.format(paper.paper_pk), [
+                ('author', author_lists.get(paper.paper_pk)),
+                ('title', paper.title),
+                ('journal', references['journal'].get(paper.paper_pk)),
+                ('year', None if pd.isna(paper.year) else int(paper.year)),
+                ('abstract', paper.abstract),
+                ('keywords', paper.keywords)
+            ]))
+        yield ''.join(entries)
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+#figure cache settings that are used if the credentials do not define FIGURE_CACHE_SETTINGS
+DEFAULT_FIGURE_CACHE_SETTINGS={
+    'directory': os.path.join(tempfile.gettempdir(), 'slr_dashboard_figures'),
+    'size_limit': 256*2**20
+}
+
+
+def selection_key(paper_pks):
+    """Returns a canonical hash of a selection of papers, independent of the order, duplicates and the type (int or str) of the pks."""
+    pks=np.unique(np.asarray([int(pk) for pk in paper_pks], dtype=np.int64))
+    return hashlib.sha1(pks.tobytes()).hexdigest()
+
+
+class FigureCache:
+    """Cache of rendered figures (as plotly JSON dicts) in a local diskcache, shared by all worker processes.
+    Entries are keyed by the chart, the canonical hash of the selected paper_pks and the chart parameters.
+    The cache is bounded by the size of the stored figures in bytes and evicts the least recently used entries.
+    Hits and misses are counted in the cache itself, so the counters cover all processes.
+    Args:
+        directory (str): The directory of the cache.
+        size_limit (int): Maximum size of the stored figures in bytes.
+        version (str): Version of the loaded data (the warehouse fingerprint), part of every key so that figures of older data are never returned.
+    """
+    def __init__(self, directory, size_limit=256*2**20, version=''):
+        import diskcache
+        self.cache=diskcache.Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self.cache.stats(enable=True)
+        self.size_limit=size_limit
+        self.version=version
+
+    def key(self, chart, paper_pks, params=()):
+        """Returns the cache key of a chart of the selected papers with the given parameters."""
+        return (self.version, chart, selection_key(paper_pks))+tuple(params)
+
+    def get_or_create(self, chart, paper_pks, params, create):
+        """Returns the cached figure(s) of the chart, or creates them with create() and stores them.
+        Args:
+            chart (str): The name of the chart, e.g. 'bubblechart'.
+            paper_pks (list): The selected paper_pks.
+            params (tuple): The other parameters the figure depends on (axes, levels, ...), hashable values.
+            create (function): Creates the figure(s) as plotly JSON dicts if they are not cached.
+        """
+        key=self.key(chart, paper_pks, params)
+        figure=self.cache.get(key, default=None, retry=True)
+        if figure is None:
+            figure=create()
+            self.cache.set(key, figure, retry=True)
+        return figure
+
+    def stats(self):
+        """Returns hits, misses and hit rate (of all processes) and the number and size in bytes of the cached figures."""
+        hits, misses=self.cache.stats()
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits/(hits+misses) if hits+misses else 0.0,
+            'entries': len(self.cache),
+            'bytes': self.cache.volume(),
+            'size_limit': self.size_limit
+        }
@@ -1,66 +1,277 @@
+import json
+import os
 import pandas as pd
 import numpy as np
 import re
-from sqlalchemy import create_engine, text
+import time
+import uuid
+import threading
+from collections import OrderedDict
 from dash import dash_table, dcc, html
 import plotly.graph_objects as go
 import plotly.subplots as sub
 import plotly.express as px
 import dash_bootstrap_components as dbc
+from utils.db import Database, DEFAULT_POOL_SETTINGS
+from utils.hierarchy import EntityHierarchyIndex
+from utils.incidence import EntityIncidence, EntityPostings
+from utils.dimensions import PaperDimensions
+from utils.selection import PaperIndex, to_paper_pk_array, encode_paper_pks, decode_paper_pks, update_selection
+from utils.search import SearchIndex, PrefixIndex, ALL_FIELDS, top_k, title_ngrams
+from utils.snapshot import SnapshotCache, DEFAULT_SNAPSHOT_SETTINGS, warehouse_fingerprint
+from utils.text_store import DEFAULT_TEXT_STORE_SETTINGS, load_or_build_text_store
+from utils.background import create_background_manager
+from utils.figure_cache import FigureCache, DEFAULT_FIGURE_CACHE_SETTINGS
+from utils.metrics import metrics, create_metrics
+from utils.export import EXPORT_FORMATS, EXPORT_CHUNK_SIZE, stream_csv, stream_parquet, stream_bibtex
 
 #DB
-def initialize_engine(connection_params):
-    """Initializes SQLAlchemy engine with given connection parameters, 
-    enable logging the SQL output and use the future version  (2.0)
+def initialize_database(connection_params, pool_settings=None):
+    """Initializes the data access layer (SQLAlchemy engine with a QueuePool, future version (2.0)) with given connection parameters.
     Args:
         connection_params (dict): The connection parameters for the database. 
-            Must contain username, password, host, port and database values.   
+            Must contain username, password, host, port and database values, or a complete SQLAlchemy 'url'
+            (e.g. sqlite:///warehouse.db for a local stand-in).
+        pool_settings (dict): Settings of the connection pool and the query queue, see Database. 
+            Missing values are taken from DEFAULT_POOL_SETTINGS.
     Returns:
-        An SQL Alchemy engine object.
+        A Database object.
     """
-    engine = create_engine('postgresql://{}:{}@{}:{}/{}'.format(
-        connection_params['username'], connection_params['password'], connection_params['host'], connection_params['port'], connection_params['database']), 
-        future=True) 
-    return engine
+    if 'url' in connection_params:
+        url=connection_params['url']
+    else:
+        url='postgresql://{}:{}@{}:{}/{}'.format(
+            connection_params['username'], connection_params['password'], connection_params['host'], connection_params['port'], connection_params['database'])
+    settings=dict(DEFAULT_POOL_SETTINGS, **(pool_settings or {}))
+    return Database(url, **settings)
 
-def load_full_table(engine, table):
+@metrics.timed_db
+def load_full_table(db, table):
     """Loads full table that is existing in the specified database table and returns it as dataframe.
     Args: 
-        engine (SQL Alchemy engine object): The engine for the target database.
+        db (Database): The data access layer for the target database.
         table (str): The name of the DB table to load.   
     Returns: 
         A pandas dataframe of the entire table.
     Raises:
         ValueError: If the table does not exist in the DB.
         """
-    return (pd.read_sql_table(table, engine.connect()))
+    return db.read_sql_table(table)
+
+@metrics.timed_db
+def load_named_query(db, name, **params):
+    """Loads the result of a statement of the query registry (utils/queries.py) with bound parameter values.
+    Args: 
+        db (Database): The data access layer for the target database.
+        name (str): The name of the statement.
+        params: The values of the statement's parameters, e.g. pks=[1, 2, 3].
+    Returns: 
+        A pandas dataframe of the selected data.
+    """
+    return db.read_named_query(name, params)
 
-def load_df_from_query(engine, querystring):
+@metrics.timed_db
+def load_df_from_query(db, querystring, params=None):
     """Loads full table that is existing in the specified database table and returns it as dataframe.
     Args: 
-        engine (SQL Alchemy engine object): The engine for the target database.
+        db (Database): The data access layer for the target database.
         querystring (str): The SQL SELECT statement to load the data.
+        params (dict): Values of bound parameters in the statement.
     Returns: 
         A pandas dataframe of the selected data.
     """
-    return (pd.read_sql_query(text(querystring), engine.connect()))
+    return db.read_sql_query(querystring, params=params)
     
 #entrypoint functions
 
-def load_papers_with_keywords(engine):
-    query="select * from aggregation_paper ap left join (select keywordgroup_pk, keyword_string from bridge_paper_keyword bpk join dim_keyword dk on bpk.keyword_pk =dk.keyword_pk) as kg_join on ap.keywordgroup_pk = kg_join.keywordgroup_pk"
-    pap_kw=load_df_from_query(engine, query)
-    pap_kw.drop(columns=['keywordgroup_pk'], inplace=True)
-    return pap_kw
- 
-def prep_df_for_display(engine):
-    pap=load_papers_with_keywords(engine)
-    pap_kw=pap[['paper_pk','keyword_string']]
-    #put together the keywords to a keyword string
-    pap_kw=pap_kw.groupby('paper_pk')['keyword_string'].apply(', '.join).reset_index()
-    final_df=pd.merge(pap_kw, pap.drop(columns='keyword_string'), how='left', on='paper_pk').rename(columns={'keyword_string': 'keywords'}).drop_duplicates().drop(columns=['citekey', 'article_source_id', 'authorgroup_pk', 'journal_pk'])
-    final_df['year']=final_df['year'].apply(lambda y: y.year)
-    return final_df
+#columns of aggregation_paper that are not shown in the dashboard
+HIDDEN_PAPER_COLUMNS=['citekey', 'article_source_id', 'authorgroup_pk', 'journal_pk', 'keywordgroup_pk']
+#columns that are the same in all rows of a paper, loaded once per paper
+PAPER_TEXT_COLUMNS=['title', 'year', 'abstract']
+
+@metrics.timed_db
+def load_papers_with_keywords(db, abstracts=True):
+    """Loads title, year, abstract (unless abstracts is False) and the aggregated keyword string of every paper, one row per paper.
+    The keywords are sorted alphabetically so that the string is deterministic. PostgreSQL joins them in the query,
+    other databases (e.g. a SQLite stand-in, whose group_concat does not keep the order of a sorted subquery) in pandas.
+    """
+    abstract=(', pap.abstract', ', min(abstract) as abstract') if abstracts else ('', '')
+    papers=("select paper_pk, min(keywordgroup_pk) as keywordgroup_pk, min(title) as title, min(year) as year{} "
+        "from aggregation_paper group by paper_pk".format(abstract[1]))
+    if db.engine.dialect.name=='postgresql':
+        keywords=("select bpk.keywordgroup_pk, string_agg(dk.keyword_string, ', ' order by dk.keyword_string, dk.keyword_pk) as keywords "
+            "from bridge_paper_keyword bpk join dim_keyword dk on bpk.keyword_pk = dk.keyword_pk group by bpk.keywordgroup_pk")
+        query=("select pap.paper_pk, coalesce(kw.keywords, '') as keywords, pap.title, pap.year{} from ({}) as pap "
+            "left join ({}) as kw on pap.keywordgroup_pk = kw.keywordgroup_pk order by pap.paper_pk".format(abstract[0], papers, keywords))
+        return load_df_from_query(db, query)
+    df=load_df_from_query(db, 'select pap.paper_pk, pap.keywordgroup_pk, pap.title, pap.year{} from ({}) as pap order by pap.paper_pk'.format(abstract[0], papers))
+    rows=load_df_from_query(db, ('select bpk.keywordgroup_pk, dk.keyword_string, dk.keyword_pk from bridge_paper_keyword bpk '
+        'join dim_keyword dk on bpk.keyword_pk = dk.keyword_pk where dk.keyword_string is not null'))
+    rows=rows.sort_values(['keywordgroup_pk', 'keyword_string', 'keyword_pk'], kind='stable')
+    keywords=rows.groupby('keywordgroup_pk', sort=False)['keyword_string'].agg(', '.join)
+    df.insert(1, 'keywords', df.pop('keywordgroup_pk').map(keywords).fillna(''))
+    return df
+
+@metrics.timed_db
+def load_paper_abstracts(db):
+    """Loads the abstract of every paper, one row per paper, ordered by paper_pk."""
+    return load_df_from_query(db, 'select paper_pk, min(abstract) as abstract from aggregation_paper group by paper_pk order by paper_pk')
+
+@metrics.timed_db
+def load_paper_entity_rows(db, columns):
+    """Loads the distinct rows of the given columns of aggregation_paper, ordered by paper_pk."""
+    query='select distinct {} from aggregation_paper order by paper_pk'.format(', '.join(columns))
+    return load_df_from_query(db, query)
+
+@metrics.timed_db
+def load_paper_entity_detections(db):
+    """Loads the distinct (paper_pk, entity_pk) pairs of all entity detections, ordered by paper_pk."""
+    query=("select distinct dp.paper_pk, fed.entity_pk from fact_entity_detection fed "
+        "join dim_sentence ds on fed.sentence_pk = ds.sentence_pk join dim_paragraph dp on ds.paragraph_pk = dp.paragraph_pk "
+        "order by dp.paper_pk, fed.entity_pk")
+    return load_df_from_query(db, query)
+
+@metrics.timed_db
+def load_paper_journals(db):
+    """Loads the journal title of every paper (dim_paper to dim_journal), one row per paper, ordered by paper_pk."""
+    query='select dp.paper_pk, dj.title as journal from dim_paper dp left join dim_journal dj on dp.journal_pk = dj.journal_pk order by dp.paper_pk'
+    journals=load_df_from_query(db, query)
+    journals['journal']=journals['journal'].astype('category')
+    return journals
+
+@metrics.timed_db
+def load_paper_institutions(db):
+    """Loads institution and country of every author of every paper (dim_paper to bridge_paper_author to dim_author),
+    ordered by paper_pk and author position."""
+    query=("select dp.paper_pk, bpa.author_position, da.institution, da.country from dim_paper dp "
+        "join bridge_paper_author bpa on dp.authorgroup_pk = bpa.authorgroup_pk join dim_author da on bpa.author_pk = da.author_pk "
+        "order by dp.paper_pk, bpa.author_position")
+    institutions=load_df_from_query(db, query)
+    for col in ['institution', 'country']:
+        institutions[col]=institutions[col].astype('category')
+    return institutions
+
+@metrics.timed_db
+def prep_df_for_display(db, abstracts=True):
+    """Builds the paper dataframe df_k: the distinct entity rows of every paper with its keyword string, title, year and abstract.
+    The texts are loaded once per paper and shared by all rows of the paper, the entity columns are categoricals.
+    Args:
+        db (Database): The data access layer for the warehouse.
+        abstracts (bool): Whether df_k has the abstract column, False if the abstracts are read from a TextStore.
+    Returns:
+        A pandas dataframe with the columns paper_pk, keywords and the shown columns of aggregation_paper.
+    """
+    hidden=HIDDEN_PAPER_COLUMNS+['paper_pk']+([] if abstracts else ['abstract'])
+    columns=['paper_pk', 'keywords']+[c for c in db.table_columns('aggregation_paper') if c not in hidden]
+    papers=load_papers_with_keywords(db, abstracts)
+    papers['year']=pd.to_datetime(papers['year']).dt.year
+    rows=load_paper_entity_rows(db, [c for c in columns if c not in ['keywords']+PAPER_TEXT_COLUMNS])
+    #low cardinality text columns (the entities) are stored as categoricals
+    for col in rows.columns[rows.dtypes==object]:
+        rows[col]=rows[col].astype('category')
+    final_df=rows.merge(papers, how='left', on='paper_pk')
+    return final_df[columns]
+
+@metrics.timed_db
+def load_startup_data(db, snapshot_settings=None, text_store_settings=None):
+    """Loads the entities, the entity hierarchy, the prepared paper dataframe, the entities detected per paper and the
+    journal and author institutions of every paper, from the local snapshot cache if the warehouse has not changed since it was written, otherwise from the
+    warehouse (and stores a new snapshot).
+    If the text store is enabled, df_k has no abstract column, the abstracts are kept in a compressed, memory mapped
+    TextStore (see utils/text_store.py) of the same warehouse fingerprint, which is written on the first start.
+    Args:
+        db (Database): The data access layer for the warehouse.
+        snapshot_settings (dict): Settings of the snapshot cache ('enabled', 'directory', 'warehouse_version'),
+            missing values are taken from DEFAULT_SNAPSHOT_SETTINGS.
+        text_store_settings (dict): Settings of the text store ('enabled', 'directory', 'level'), missing values are
+            taken from DEFAULT_TEXT_STORE_SETTINGS.
+    Returns:
+        A tuple of the dataframes dim_ent, ent_hierarchy, df_k, paper_entities (paper_pk, entity_pk),
+        paper_journals (paper_pk, journal) and paper_institutions (paper_pk, author_position, institution, country),
+        the TextStore of the abstracts (None if it is disabled) and the warehouse fingerprint, which keys the
+        caches of results computed from the data.
+    """
+    settings=dict(DEFAULT_SNAPSHOT_SETTINGS, **(snapshot_settings or {}))
+    text_settings=dict(DEFAULT_TEXT_STORE_SETTINGS, **(text_store_settings or {}))
+    stored_abstracts=text_settings['enabled']
+    cache=SnapshotCache(settings['directory'], enabled=settings['enabled'])
+    build=lambda: {
+        'dim_entity': load_full_table(db, 'dim_entity'),
+        'map_entity_hierarchy': load_full_table(db, 'map_entity_hierarchy'),
+        'df_k': prep_df_for_display(db, abstracts=not stored_abstracts),
+        'paper_entities': load_paper_entity_detections(db),
+        'paper_journals': load_paper_journals(db),
+        'paper_institutions': load_paper_institutions(db)
+    }
+    fingerprint=warehouse_fingerprint(db, warehouse_version=settings['warehouse_version'])
+    if not cache.enabled:
+        frames=build()
+    else:
+        #a snapshot of df_k with abstracts is not used without them and vice versa
+        frames=cache.load_or_build(fingerprint+'-stored_abstracts' if stored_abstracts else fingerprint, build)
+    text_store=None
+    if stored_abstracts:
+        def load_abstracts():
+            abstracts=load_paper_abstracts(db)
+            return abstracts['paper_pk'].to_numpy(), abstracts['abstract'].tolist()
+        text_store=load_or_build_text_store(text_settings['directory'], fingerprint, load_abstracts, text_settings['level'])
+    return (frames['dim_entity'], frames['map_entity_hierarchy'], frames['df_k'], frames['paper_entities'],
+        frames['paper_journals'], frames['paper_institutions'], text_store, fingerprint)
+
+def initialize_background_manager(data_version, background_settings=None):
+    """Initializes the manager of the background callbacks (forked processes, results in a local diskcache).
+    Cached results are keyed by the warehouse fingerprint, so results of an older warehouse state are never reused.
+    Args:
+        data_version (str): The warehouse fingerprint returned by load_startup_data.
+        background_settings (dict): Settings of the job cache ('directory', 'expire'), see utils/background.py.
+    Returns:
+        A DedupingDiskcacheManager.
+    """
+    return create_background_manager(background_settings, cache_by=[lambda: data_version])
+
+def initialize_figure_cache(data_version, figure_cache_settings=None):
+    """Initializes the disk-backed LRU cache of rendered figures, keyed to the warehouse fingerprint, so that figures
+    of an older warehouse state are never returned, also after a restart.
+    Args:
+        data_version (str): The warehouse fingerprint returned by load_startup_data.
+        figure_cache_settings (dict): 'directory' and 'size_limit' (bytes) of the cache, missing values are
+            taken from DEFAULT_FIGURE_CACHE_SETTINGS.
+    Returns:
+        A FigureCache.
+    """
+    settings=dict(DEFAULT_FIGURE_CACHE_SETTINGS, **(figure_cache_settings or {}))
+    return FigureCache(settings['directory'], size_limit=settings['size_limit'], version=data_version)
+
+def initialize_metrics(app, metrics_settings=None):
+    """Instruments the callbacks of the app (call it before they are defined) and the database helpers.
+    Args:
+        app (dash.Dash): The app.
+        metrics_settings (dict): See create_metrics in utils/metrics.py.
+    Returns:
+        The Metrics instance, its metrics_text() is served on /metrics.
+    """
+    return create_metrics(app, metrics_settings)
+
+def get_readiness(frames, search_index, db):
+    """Reports whether the startup data of this process is loaded, for the readiness endpoint.
+    Args:
+        frames (dict): The global dataframes by name (e.g. df_k, dim_ent, ent_hierarchy).
+        search_index (SearchIndex): The full text index built at startup.
+        db (Database): The data access layer.
+    Returns:
+        A dict with 'ready' (bool), the process id, the number of rows of every dataframe and the pool metrics.
+    """
+    rows={name: (len(df) if df is not None else 0) for name, df in frames.items()}
+    #empty frames are valid (e.g. a warehouse without entity detections), only data that was not loaded is not ready
+    ready=all(df is not None for df in frames.values()) and search_index is not None
+    pool=db.pool_status()
+    return {
+        'ready': ready,
+        'pid': os.getpid(),
+        'rows': rows,
+        'indexed_papers': len(search_index.paper_pks) if search_index is not None else 0,
+        'database': {key: pool[key] for key in ('pool_size', 'checked_out', 'overflow', 'queued')}
+    }
 
 def filter_df_columns_by_searchterm(df, searchphrase, columns_to_search):
     matches=pd.DataFrame()
@@ -83,37 +294,168 @@ def filter_entire_df_by_searchterm(df, searchterm):
     res=regsearch(dfs.values).any(1)
     return df[res]
 
-def find_child_entities(dim_ents, entity_hierarchy, parent_ent):
-    children_ents=dim_ents[dim_ents['entity_pk'].isin(entity_hierarchy[entity_hierarchy['parent_entity_pk']==(dim_ents[dim_ents['entity_name']==parent_ent]['entity_pk'].values[0])]['child_entity_pk'].to_list())]
-    children_names=children_ents['entity_name'].to_list()
-    #escape single quotes with another single quote to avoid mistakes when querying these values from postgres
-    children_names=[s.translate(str.maketrans({"'" : ""}, )) for s in children_names]
-    return children_names
+def build_search_index(df, text_store=None):
+    """Builds the inverted full text index over title, keywords, abstract and all fields of the papers in df once at startup.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        text_store (TextStore): The abstracts, if df has no abstract column.
+    Returns:
+        A SearchIndex.
+    """
+    return SearchIndex(df, fields=('title', 'keywords', 'abstract'), text_store=text_store)
 
-def filter_df_by_entity(df, dropdown_labels, implied_child_entities, entity_name, include_child_ents):
-    if include_child_ents==1:
-        search_ents=implied_child_entities.split(', ')
+#weights of the fields in the relevance score, a match in the title counts more than one in the abstract
+BM25_FIELD_WEIGHTS={'title': 3.0, 'keywords': 2.0, 'abstract': 1.0}
+
+def search_papers_by_searchterm(df, search_index, searchphrase, columns_to_search, match='infix', rank=False):
+    """Finds the papers matching searchphrase with the inverted index instead of regex scans over df.
+    Within a column all words of the searchphrase must match (anywhere inside a word, case insensitive, like the 
+    previous regex search), results of several columns are combined. As before, the entire_df option matches the 
+    whole searchphrase at once.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        search_index (SearchIndex): The index built on df.
+        searchphrase (str): The search phrase, quoted parts are matched as phrases.
+        columns_to_search (list): The columns to search, or containing 'entire_df' to search all fields.
+        match (str): How words match the indexed tokens, 'exact', 'prefix' or 'infix'.
+        rank (bool): Add a 'score' column with the BM25 relevance over title, keywords and abstract (see BM25_FIELD_WEIGHTS).
+    Returns:
+        The rows of df belonging to the matching papers, without duplicates.
+    """
+    searchphrase=searchphrase or ''
+    if 'entire_df' in columns_to_search:
+        paper_pks=search_index.search(searchphrase, [ALL_FIELDS], as_phrase=True, match=match)
     else:
-        search_ents=[entity_name]
-    result_df=pd.DataFrame()
-    for ent in search_ents:
-        matches=df[df[dropdown_labels.lower()]==ent]
-        result_df=pd.concat([result_df, matches])
+        paper_pks=search_index.search(searchphrase, columns_to_search, match=match)
+    result_df=df[df.paper_pk.isin(paper_pks)]
+    if rank:
+        #the rows are not sorted here, get_table_page only orders the rows of the displayed page by score
+        scores=pd.Series(search_index.score(searchphrase, BM25_FIELD_WEIGHTS, match=match), index=search_index.paper_pks)
+        result_df=result_df.copy()
+        result_df.insert(0, 'score', result_df['paper_pk'].map(scores).round(3))
     return result_df
 
-def drill_to_level(ent_name, level, dim_ent, ent_hierarchy):
-    if ent_name=='MISSING':
-        return 'MISSING'
+#number of completions returned by the typeahead of the search term and the entity name
+TYPEAHEAD_SIZE=10
+
+def build_search_term_completions(df, max_n=3):
+    """Builds the typeahead index of the search term once at startup: the keywords and the word n-grams of the
+    titles (n-grams of more than one word only if they occur in two or more papers), ranked by their number of papers.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        max_n (int): The maximum number of words of the title n-grams.
+    Returns:
+        A PrefixIndex.
+    """
+    papers=df.drop_duplicates(subset='paper_pk')
+    keywords=papers['keywords'].fillna('').str.lower().str.split(', ').explode()
+    keywords=keywords[keywords!=''].reset_index().drop_duplicates()['keywords'].value_counts()
+    ngrams=pd.Series([ngram for ngrams in title_ngrams(papers['title'], max_n) for ngram in ngrams], dtype=object).value_counts()
+    ngrams=ngrams[(ngrams>1) | ~ngrams.index.str.contains(' ')]
+    counts=pd.concat([keywords, ngrams])
+    return PrefixIndex(counts.index, counts.to_numpy(), word_starts=False)
+
+def build_entity_completions(dim_ent, incidence):
+    """Builds the typeahead index of the entity names of every entity label once at startup, every entity is ranked
+    by its number of papers in the paper x entity incidence matrix (0 if it is not a category of the papers).
+    Returns:
+        A dict entity_label: PrefixIndex.
+    """
+    completions={}
+    for label, names in dim_ent.groupby('entity_label')['entity_name']:
+        papers=incidence.entity_papers(label) if label.lower() in incidence.labels else pd.Series(dtype=np.int64)
+        names=names.drop_duplicates()
+        completions[label]=PrefixIndex(names, papers.reindex(names.to_numpy()).fillna(0).to_numpy())
+    return completions
+
+def complete_entity_names(entity_completions, entity_label, prefix, k=TYPEAHEAD_SIZE):
+    """Returns the k most frequent entity names of a label with a word starting with prefix as dropdown options."""
+    if entity_label not in entity_completions:
+        return []
+    return [{'label': name, 'value': name} for name in entity_completions[entity_label].complete(prefix, k)]
+
+def suggest_search_terms(term_completions, text, k=TYPEAHEAD_SIZE):
+    """Returns the k most frequent completions of a typed search term. If the whole text cannot be completed, its
+    last word is completed and the rest of the text is kept."""
+    text=(text or '').lower().lstrip()
+    if not text:
+        return []
+    suggestions=term_completions.complete(text, k)
+    head, _, last=text.rpartition(' ')
+    if not suggestions and head and last:
+        suggestions=[head+' '+completion for completion in term_completions.complete(last, k)]
+    return suggestions
+
+def find_child_entities(ent_index, parent_ent, max_depth=None):
+    """Returns the names of all descendants of an entity (up to max_depth levels below it, all if None), nearest first."""
+    return ent_index.descendants(parent_ent, max_depth, include_self=False)
+
+def build_entity_postings(df, dim_ent):
+    """Builds the posting lists (entity -> rows of df) of the entity columns of the paper dataframe once at startup.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        dim_ent (pandas dataframe): The dim_entity table.
+    Returns:
+        An EntityPostings.
+    """
+    return EntityPostings(df, get_entity_columns(df, dim_ent))
+
+def filter_df_by_entity(postings, ent_index, entity_label, entity_name, include_child_ents, max_depth=None):
+    """Returns the rows of df_k that hold an entity, or the entity or any of its descendants, in their entity_label column.
+    Args:
+        postings (EntityPostings): The posting lists of df_k.
+        ent_index (EntityHierarchyIndex): The entity hierarchy with the precomputed descendants.
+        entity_label (str): The entity label, e.g. 'TOPIC'.
+        entity_name (str): The searched entity.
+        include_child_ents (int): 1 to include the descendants of the entity.
+        max_depth (int): The maximum number of levels below the entity, None for all levels.
+    """
+    search_ents=[entity_name]
+    if include_child_ents==1:
+        search_ents+=find_child_entities(ent_index, entity_name, max_depth)
+    return postings.select(entity_label, search_ents)
+
+def build_entity_hierarchy_index(dim_ent, ent_hierarchy):
+    """Builds the in-memory entity hierarchy index once at startup.
+    Args:
+        dim_ent (pandas dataframe): The dim_entity table.
+        ent_hierarchy (pandas dataframe): The map_entity_hierarchy table.
+    Returns:
+        An EntityHierarchyIndex with name/pk lookups, max depths and the ancestor-at-level table.
+    """
+    return EntityHierarchyIndex(dim_ent, ent_hierarchy)
+
+def get_entity_columns(df, dim_ent):
+    """Returns the columns of the paper dataframe that hold entities (named like the lower case entity labels)."""
+    labels=set(dim_ent['entity_label'].str.lower())
+    return [col for col in df.columns if col in labels]
+
+def build_entity_incidence(df, dim_ent, ent_index, paper_entities=None):
+    """Builds the sparse paper x entity incidence matrix used for co-occurrence analysis.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k), its papers are the rows of the matrix.
+        dim_ent (pandas dataframe): The dim_entity table.
+        ent_index (EntityHierarchyIndex): The entity hierarchy, for the roll-up to a level.
+        paper_entities (pandas dataframe): The (paper_pk, entity_pk) pairs of all detections. If given, the matrix
+            holds every detected entity, otherwise the entities of the entity columns of df.
+    Returns:
+        An EntityIncidence.
+    """
+    paper_pks=df['paper_pk'].unique()
+    if paper_entities is None:
+        entities={col: (df['paper_pk'].to_numpy(), df[col].to_numpy(dtype=object)) for col in get_entity_columns(df, dim_ent)}
     else:
-        ent_pk=dim_ent[dim_ent['entity_name']==ent_name]['entity_pk'].values[0]
-        #get depth from level 0 (the maximum depth for this entity)
-        all_parents=ent_hierarchy[ent_hierarchy['child_entity_pk']==ent_pk]
-        depth_from_level_zero=all_parents['depth_from_parent'].max()
-        #now try drill down to desired level, if that is not possible return last possible level (the initial ent itself)
-        try:
-            return dim_ent[dim_ent['entity_pk']==(all_parents[all_parents['depth_from_parent']==(depth_from_level_zero-level)]['parent_entity_pk'].values[0])]['entity_name'].values[0]
-        except:
-            return ent_name
+        detected=paper_entities.merge(dim_ent[['entity_pk', 'entity_name', 'entity_label']].drop_duplicates(subset='entity_pk'), on='entity_pk')
+        entities={label: (group['paper_pk'].to_numpy(), group['entity_name'].to_numpy(dtype=object)) for label, group in detected.groupby('entity_label')}
+    return EntityIncidence(paper_pks, entities, ent_index)
+
+def drill_to_level(ent_name, level, ent_index):
+    #roll up a single entity, if that is not possible return the initial ent itself
+    return ent_index.roll_up([ent_name], level).iloc[0]
+
+def drill_column_to_level(ent_names, level, ent_index):
+    #roll up an entire column of entities with one lookup in the ancestor table
+    return ent_index.roll_up(ent_names, level)
     
 
 #VISUALIZATION
@@ -124,23 +466,227 @@ def get_label_options(dim_entitiy_df):
         options.append({'label': ent_label, 'value': ent_label})
     return options
 
-def generate_result_table(result_df):
+#server-side search results, kept per result id so that only the visible page is sent to the browser
+SEARCH_RESULT_CACHE_SIZE=32
+_search_results=OrderedDict()
+_search_results_lock=threading.Lock()
+
+def store_search_result(result_df, result_id=None):
+    """Keeps a search result on the server and returns the id under which it can be retrieved.
+    The oldest results are evicted once SEARCH_RESULT_CACHE_SIZE results are stored.
+    Args:
+        result_df (pandas dataframe): The complete search result.
+        result_id (str): An existing id to store the result under again, a new one is generated if None.
+    Returns:
+        The result id (str).
+    """
+    result_id=result_id or uuid.uuid4().hex
+    with _search_results_lock:
+        _search_results[result_id]=result_df.reset_index(drop=True)
+        while len(_search_results)>SEARCH_RESULT_CACHE_SIZE:
+            _search_results.popitem(last=False)
+    return result_id
+
+def get_stored_search_result(result_id):
+    """Returns the search result stored under result_id, or None if it is unknown or has been evicted."""
+    with _search_results_lock:
+        result_df=_search_results.get(result_id)
+        if result_df is not None:
+            _search_results.move_to_end(result_id)
+    return result_df
+
+#operators of the DataTable filter query syntax, longest first so that e.g. 'icontains' is not read as 'contains'
+FILTER_OPERATORS=[
+    ('is not blank', 'notblank'), ('is blank', 'blank'),
+    ('datestartswith', 'datestartswith'),
+    ('icontains', 'icontains'), ('scontains', 'contains'), ('contains', 'contains'),
+    ('ieq', 'ieq'), ('seq', 'eq'), ('ine', 'ine'), ('sne', 'ne'),
+    ('>=', 'ge'), ('<=', 'le'), ('!=', 'ne'), ('ge', 'ge'), ('le', 'le'), ('gt', 'gt'), ('lt', 'lt'), ('ne', 'ne'), ('eq', 'eq'),
+    ('>', 'gt'), ('<', 'lt'), ('=', 'eq')
+]
+
+def split_filter_part(filter_part):
+    """Splits one part of a DataTable filter query (e.g. '{year} >= 2015') into column, operator and value.
+    Returns:
+        A tuple (column_name, operator, value). All three are None if the part cannot be parsed.
+    """
+    filter_part=filter_part.strip()
+    match=re.match(r'^\{(?P<col>[^}]*)\}\s*(?P<rest>.*)$', filter_part)
+    if not match:
+        return None, None, None
+    col_name=match.group('col')
+    rest=match.group('rest')
+    for op_string, operator in FILTER_OPERATORS:
+        if rest.startswith(op_string) and (not op_string[-1].isalpha() or rest[len(op_string):len(op_string)+1] in ('', ' ')):
+            value=rest[len(op_string):].strip()
+            if value and value[0]==value[-1] and value[0] in ('"', "'", '`') and len(value)>1:
+                value=value[1:-1].replace('\\'+value[0], value[0])
+            return col_name, operator, value
+    return None, None, None
+
+def _filter_mask(column, operator, value):
+    """Returns the boolean mask for one parsed filter condition on a dataframe column."""
+    if operator=='blank':
+        return column.isna() | (column.astype(str).str.strip()=='')
+    if operator=='notblank':
+        return ~(column.isna() | (column.astype(str).str.strip()==''))
+    if operator in ('contains', 'icontains'):
+        return column.astype(str).str.contains(value, case=(operator=='contains'), regex=False, na=False)
+    if operator=='datestartswith':
+        return column.astype(str).str.startswith(value, na=False)
+    if operator in ('ieq', 'ine'):
+        mask=column.astype(str).str.lower()==value.lower()
+        return mask if operator=='ieq' else ~mask
+    #relational operators compare numerically on numeric columns and as strings otherwise
+    if pd.api.types.is_numeric_dtype(column):
+        try:
+            value=float(value)
+        except ValueError:
+            return pd.Series(False, index=column.index)
+    else:
+        column=column.astype(str)
+    if operator=='eq':
+        return column==value
+    elif operator=='ne':
+        return column!=value
+    elif operator=='lt':
+        return column<value
+    elif operator=='le':
+        return column<=value
+    elif operator=='gt':
+        return column>value
+    else:
+        return column>=value
+
+def filter_df_by_query(df, filter_query):
+    """Translates a DataTable filter query ('{col} op value && ...') into pandas operations.
+    Conditions on unknown columns or with unknown operators are ignored, like the native filter does.
+    Args:
+        df (pandas dataframe): The data to filter.
+        filter_query (str): The filter_query property of the DataTable.
+    Returns:
+        The filtered dataframe.
+    """
+    if not filter_query:
+        return df
+    mask=pd.Series(True, index=df.index)
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, value=split_filter_part(filter_part)
+        if col_name not in df.columns or operator is None:
+            continue
+        mask&=_filter_mask(df[col_name], operator, value)
+    return df[mask]
+
+def sort_df_by(df, sort_by):
+    """Sorts a dataframe by the sort_by property of a DataTable (list of column_id/direction dicts)."""
+    sort_by=[s for s in (sort_by or []) if s['column_id'] in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(
+        by=[s['column_id'] for s in sort_by],
+        ascending=[s['direction']=='asc' for s in sort_by],
+        kind='mergesort',
+        na_position='last')
+
+def get_table_page(result_df, page_current, page_size, sort_by=None, filter_query=''):
+    """Filters and sorts the complete search result on the server and cuts out the requested page.
+    Ranked results (with a 'score' column) that are not sorted by the user are shown by descending score, 
+    only the rows up to the requested page are selected and ordered (partial sort).
+    Args:
+        result_df (pandas dataframe): The complete search result.
+        page_current (int): The page shown in the table, starting at 0.
+        page_size (int): The number of rows per page.
+        sort_by (list): The sort_by property of the DataTable.
+        filter_query (str): The filter_query property of the DataTable.
+    Returns:
+        A tuple of the page dataframe, the number of pages and the complete filtered and sorted dataframe.
+    """
+    view_df=sort_df_by(filter_df_by_query(result_df, filter_query), sort_by)
+    page_count=max(1, -(-len(view_df)//page_size))
+    page_current=min(page_current or 0, page_count-1)
+    if not sort_by and 'score' in view_df.columns:
+        top_rows=top_k(view_df['score'].to_numpy(dtype=float), (page_current+1)*page_size)
+        page_df=view_df.iloc[top_rows[page_current*page_size:]]
+    else:
+        page_df=view_df.iloc[page_current*page_size:(page_current+1)*page_size]
+    return page_df, page_count, view_df
+
+def get_export_rows(result_df, sort_by=None, filter_query=''):
+    """Returns the rows of a search result as shown in the table (filtered and sorted, ranked results by descending score)."""
+    _, _, view_df=get_table_page(result_df, 0, 1, sort_by, filter_query)
+    if not sort_by and 'score' in view_df.columns:
+        view_df=view_df.sort_values('score', ascending=False, kind='stable')
+    return view_df
+
+def add_stored_abstracts(df, text_store):
+    """Returns a copy of rows of df_k with the abstract column read from the text store, after the year like in df_k
+    loaded with abstracts. Every abstract is decompressed once, also if the paper has several rows."""
+    paper_pks, inverse=np.unique(df['paper_pk'].to_numpy(dtype=np.int64), return_inverse=True)
+    abstracts=np.array(text_store.get_many(paper_pks), dtype=object)[inverse] if len(df) else np.empty(0, dtype=object)
+    df=df.copy(deep=False)
+    df.insert(df.columns.get_loc('year')+1 if 'year' in df.columns else len(df.columns), 'abstract', abstracts)
+    return df
+
+def stream_export(df, export_format, db, chunk_size=EXPORT_CHUNK_SIZE, text_store=None):
+    """Returns a generator of the parts of an export file of the rows of df, which is converted chunk by chunk,
+    so that the download starts at once and the whole file is never held in memory.
+    Args:
+        df (pandas dataframe): The rows to export (of df_k or a search result).
+        export_format (str): 'csv', 'parquet' or 'bib' (one entry per paper, with authors and journal from the database).
+        db (Database): The data access layer, for the BibTeX export.
+        chunk_size (int): Rows (papers for BibTeX) per part.
+        text_store (TextStore): The abstracts, if df has no abstract column, they are added to every chunk.
+    Returns:
+        A generator of str (CSV, BibTeX) or bytes (Parquet).
+    """
+    prepare=None if text_store is None or 'abstract' in df.columns else (lambda chunk: add_stored_abstracts(chunk, text_store))
+    if export_format=='csv':
+        return stream_csv(df, chunk_size, prepare)
+    elif export_format=='parquet':
+        return stream_parquet(df, chunk_size, prepare)
+    else:
+        load_references=lambda pks: (load_named_query(db, 'paper_references', pks=pks), load_named_query(db, 'paper_author_names', pks=pks))
+        return stream_bibtex(df.drop_duplicates(subset='paper_pk'), load_references, chunk_size, prepare)
+
+def generate_tooltip_data(page_df, text_store=None):
+    #tooltips are only built for the rows that are actually displayed
+    tooltips=[
+        {
+            column: {'value': str(value), 'type': 'markdown'}
+            for column, value in row.items()
+        } for row in page_df.to_dict('records')
+        ]
+    if text_store is not None and 'title' in page_df.columns:
+        #abstracts kept in the text store are no column of the table, they are read for the rows of the page and shown with the title
+        for tooltip, title, abstract in zip(tooltips, page_df['title'], text_store.get_many(page_df['paper_pk'])):
+            tooltip['title']={'value': '**{}**\n\n{}'.format(title, abstract), 'type': 'markdown'}
+    return tooltips
+
+def get_selected_rows_on_page(page_df, selected_pks):
+    #positions of the already selected papers on the displayed page, so that their checkboxes stay ticked
+    return [i for i, checked in enumerate(page_df['paper_pk'].isin(selected_pks)) if checked]
+
+def generate_result_table(result_df, page_size=10, text_store=None, selected_pks=()):
+    page_df, page_count, _=get_table_page(result_df, 0, page_size)
     return(dash_table.DataTable(
         id='search_result_table',
         columns=[{"name": i, "id": i, "selectable": True} for i in result_df.columns], #"deletable": True, 
-        data=result_df.to_dict('records'),
+        data=page_df.to_dict('records'),
         #editable=True,
-        filter_action="native",
-        sort_action="native",
+        filter_action="custom",
+        filter_query='',
+        sort_action="custom",
         sort_mode="multi",
+        sort_by=[],
         #column_selectable="single",
         row_selectable="multi",
         #row_deletable=True,
         selected_columns=[],
-        selected_rows=[],
-        page_action="native",
+        selected_rows=get_selected_rows_on_page(page_df, selected_pks),
+        page_action="custom",
         page_current= 0,
-        page_size= 10,
+        page_size= page_size,
+        page_count=page_count,
         style_table={'overflowX': 'auto'},#'height': '500px', 
         #fixed_rows={'headers': True},
         style_data={'whiteSpace': 'normal'},
@@ -158,12 +704,7 @@ def generate_result_table(result_df):
         'rule': 'background-color: grey; font-family: "Times New Roman", Times, serif; color: white; width: 1000px; max-width: 1000px'
         }],
         tooltip_header={i: i for i in result_df.columns},
-        tooltip_data=[
-        {
-            column: {'value': str(value), 'type': 'markdown'}
-            for column, value in row.items()
-        } for row in result_df.to_dict('records')
-        ],
+        tooltip_data=generate_tooltip_data(page_df, text_store),
         tooltip_duration=None,
         style_cell={
             'textAlign': 'left',
@@ -184,32 +725,131 @@ def generate_result_table(result_df):
             {
                 'if':{'column_id': 'metric_value'},
                 'textAlign': 'right'
+            },
+            {
+                'if':{'column_id': 'score'},
+                'textAlign': 'right'
             }
         ]))
 
-def get_filtered_df_from_string_of_paper_pks(selected_pks_string, df_complete):
-    #transform string back to list of integer paper_pks
-    pks=selected_pks_string.split(', ')
-    int_pks=[int(pk) for pk in pks]
-    #get df entries of selected keys
-    filtered_df=df_complete[df_complete.paper_pk.isin(int_pks)]
-    return filtered_df
-
-def get_checkboxes_from_selected_papers(selected_pks_string, df_complete):
-    filtered_df=get_filtered_df_from_string_of_paper_pks(selected_pks_string, df_complete)
-    options=filtered_df[['paper_pk', 'title']].apply(lambda row: {'label': str(row['paper_pk']) + ' - ' + row['title'], 'value': row['paper_pk']}, axis=1).to_list()
-    return dcc.Checklist(id='analysis_papers_checklist', options=options, value=filtered_df['paper_pk'].to_list(), labelStyle={'font-size': '12px'})
-
-def generate_parallel_categories_overview_graph(selected_pks_list, df_complete):
-    filtered_df=df_complete[df_complete.paper_pk.isin(selected_pks_list)]
-    #build dimensions for 3 subplots
+#number of entities per label that are shown as facets of a search result
+FACET_SIZE=8
+
+def get_facet_labels(incidence, dim_ent):
+    #the entity labels of dim_ent (in their order) that are columns of the paper dataframe
+    return [label for label in dim_ent['entity_label'].unique() if label.lower() in incidence.labels]
+
+def get_facet_counts(incidence, labels, paper_pks, level=None, facet_size=FACET_SIZE):
+    """Counts the papers of a search result per entity of every label in the paper x entity incidence matrices.
+    Args:
+        incidence (EntityIncidence): The paper x entity incidence matrix of the paper dataframe.
+        labels (list): The entity labels, e.g. ['TOPIC', 'SECTOR'].
+        paper_pks (array): The papers of the search result.
+        level (int): The level to roll the entities up to, None for the entities themselves.
+        facet_size (int): The number of entities per label, the most frequent first.
+    Returns:
+        A dict label: pandas series of the number of papers per entity.
+    """
+    #the result papers are marked once and intersected with the entries of every label
+    mask=incidence.paper_mask(paper_pks)
+    return {label: incidence.entity_papers(label, level=level, mask=mask).iloc[:facet_size] for label in labels}
+
+def filter_df_by_facets(df, incidence, facets):
+    """Narrows a search result to the papers that have all chosen facets.
+    Args:
+        df (pandas dataframe): The search result.
+        incidence (EntityIncidence): The paper x entity incidence matrix of the paper dataframe.
+        facets (list): The chosen facets as [label, level, entity name].
+    """
+    for label, level, ent_name in facets:
+        df=df[df['paper_pk'].isin(incidence.papers_with(label, ent_name, level))]
+    return df
+
+def generate_facets(facet_counts, facets, level):
+    """Lists the facets of a search result as buttons, clicking a facet narrows the result, clicking a chosen facet removes it.
+    Args:
+        facet_counts (dict): label: pandas series of the number of papers per entity (see get_facet_counts).
+        facets (list): The chosen facets as [label, level, entity name].
+        level (int): The level of the counted entities.
+    """
+    def facet_button(label, facet_level, ent_name, text, active):
+        #the facet is part of the id, so that the search callback knows which one was clicked
+        return dbc.Button(text, id={'type': 'search_facet', 'facet': json.dumps([label, facet_level, ent_name])},
+            size='sm', color='primary' if active else 'light', style={'margin': '2px', 'font-size': '11px'})
+    chosen=[facet_button(label, facet_level, ent_name, '{}: {} \u2715'.format(label.lower(), ent_name), True) for label, facet_level, ent_name in facets]
+    columns=[]
+    for label, counts in facet_counts.items():
+        if counts.empty:
+            continue
+        buttons=[facet_button(label, level, ent_name, '{} ({})'.format(ent_name, count), False) for ent_name, count in counts.items() if [label, level, ent_name] not in facets]
+        columns.append(html.Div([html.B(label.lower(), style={'font-size': '12px'}), html.Br()]+buttons,
+            style={'display': 'inline-block', 'vertical-align': 'top', 'width': '190px', 'padding': '5px'}))
+    return html.Div(([html.Div(['Narrowed to: ']+chosen)] if chosen else [])+columns)
+
+def build_paper_dimensions(paper_journals, paper_institutions):
+    """Builds the integer coded journals and author institutions of all papers (see PaperDimensions), for the metadata analysis."""
+    return PaperDimensions(paper_journals, paper_institutions)
+
+def build_paper_index(df):
+    """Builds the index of the rows of every paper in the prepared paper dataframe, used to select papers."""
+    return PaperIndex(df)
+
+def select_papers(df, paper_pks, paper_index=None):
+    """Returns the rows of df of the given papers (int or str pks), looked up in paper_index if it is built on df."""
+    if paper_index is not None and paper_index.df is df:
+        return paper_index.select(paper_pks)
+    return df[df.paper_pk.isin(to_paper_pk_array(paper_pks))]
+
+def select_paper_columns(df, paper_pks, columns, paper_index=None, per_paper=False):
+    """Returns paper_pk and only the given columns of the selected papers, taken from the split frames of
+    paper_index if it is built on df (see PaperIndex), otherwise filtered from df.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        paper_pks (list): The selected papers (int or str pks).
+        columns (list): The columns the caller needs.
+        paper_index (PaperIndex): The index of df by paper_pk.
+        per_paper (bool): One row per paper (the columns must be the same in all rows of a paper) instead of
+            one row per row of df.
+    Returns:
+        A pandas dataframe sorted by paper_pk.
+    """
+    if paper_index is not None and paper_index.df is df:
+        if per_paper:
+            return paper_index.paper_frame(paper_pks, columns)
+        return paper_index.row_frame(paper_pks, columns)
+    selected=select_papers(df, paper_pks)[['paper_pk']+list(columns)].sort_values('paper_pk', kind='stable')
+    if per_paper:
+        selected=selected.drop_duplicates(subset='paper_pk')
+    return selected.reset_index(drop=True)
+
+def get_selected_papers_df(selection, df_complete, paper_index=None):
+    #the selection is kept in the browser as encoded set of paper_pks (see utils/selection.py)
+    return select_papers(df_complete, decode_paper_pks(selection), paper_index)
+
+def get_paper_options(selection, df_complete, paper_index=None):
+    #one option (paper_pk - title) per selected paper
+    papers=select_paper_columns(df_complete, decode_paper_pks(selection), ['title'], paper_index, per_paper=True)
+    labels=papers['paper_pk'].astype(str)+' - '+papers['title'].astype(str)
+    return [{'label': label, 'value': pk} for label, pk in zip(labels, papers['paper_pk'].tolist())]
+
+def get_checkboxes_from_selected_papers(selection, df_complete, paper_index=None):
+    options=get_paper_options(selection, df_complete, paper_index)
+    return dcc.Checklist(id='analysis_papers_checklist', options=options, value=[option['value'] for option in options], labelStyle={'font-size': '12px'})
+
+def generate_parallel_categories_overview_graph(selected_pks_list, df_complete, report_progress=None, paper_index=None):
+    report_progress=report_progress or (lambda step, total, message: None)
+    report_progress(0, 4, 'Selecting papers')
     subject_labels=['paper_pk', 'topic', 'technology', 'theory', 'paradigm']
+    scope_labels=['paper_pk', 'sector', 'region', 'level', 'company_type', 'collection_method', 'participants']
+    methodology_labels=['paper_pk', 'conceptual_method', 'model_element', 'sampling', 'analysis_method', 'validity', 'metric']
+    #only the entity columns of the selected papers are needed
+    columns=[label for label in subject_labels+scope_labels+methodology_labels if label!='paper_pk']
+    filtered_df=select_paper_columns(df_complete, selected_pks_list, columns, paper_index)
+    #build dimensions for 3 subplots
     subject_dimensions=[dict(values=filtered_df[label], label=label) for label in subject_labels]
 
-    scope_labels=['paper_pk', 'sector', 'region', 'level', 'company_type', 'collection_method', 'participants']
     scope_dimensions=[dict(values=filtered_df[label], label=label) for label in scope_labels]
 
-    methodology_labels=['paper_pk', 'conceptual_method', 'model_element', 'sampling', 'analysis_method', 'validity', 'metric']
     methodology_dimensions=[dict(values=filtered_df[label], label=label) for label in methodology_labels]
 
     #define figure and subplots
@@ -219,6 +859,7 @@ def generate_parallel_categories_overview_graph(selected_pks_list, df_complete):
         subplot_titles=("Subjects", "Scope", "Methodology")
         ))
 
+    report_progress(1, 4, 'Drawing subjects')
     fig.add_trace(go.Parcats(
             dimensions=subject_dimensions,
             line={'color': filtered_df.paper_pk, 'colorscale': 'turbo', 'shape':'hspline'},
@@ -226,6 +867,7 @@ def generate_parallel_categories_overview_graph(selected_pks_list, df_complete):
             arrangement='freeform',
         ), row=1, col=1)
 
+    report_progress(2, 4, 'Drawing scope')
     fig.add_trace(go.Parcats(
             dimensions=scope_dimensions,
             line={'color': filtered_df.paper_pk,'colorscale': 'turbo', 'shape':'hspline'},
@@ -233,6 +875,7 @@ def generate_parallel_categories_overview_graph(selected_pks_list, df_complete):
             arrangement='freeform'
         ), row=2, col=1)
 
+    report_progress(3, 4, 'Drawing methodology')
     fig.add_trace(go.Parcats(
             dimensions=methodology_dimensions,
             line={'color': filtered_df.paper_pk, 'colorscale': 'turbo','shape':'hspline'},
@@ -248,32 +891,43 @@ def generate_parallel_categories_overview_graph(selected_pks_list, df_complete):
     fig.layout.annotations[2].update(y=0.275, font={'size': 18}, x=0.05, xanchor= 'left')
     return fig
 
-def generate_bubblechart(x_value, y_value, checked_paper_pks, df_complete, dim_ent, ent_hierarchy, x_level=0, y_level=0):
-    filtered_df=df_complete[df_complete.paper_pk.isin(checked_paper_pks)][[x_value, y_value]]
+def generate_bubblechart(x_value, y_value, checked_paper_pks, df_complete, ent_index, x_level=0, y_level=0, report_progress=None, paper_index=None):
+    report_progress=report_progress or (lambda step, total, message: None)
+    report_progress(0, 3, 'Selecting papers')
+    filtered_df=select_paper_columns(df_complete, checked_paper_pks, [x_value, y_value], paper_index)[[x_value, y_value]]
     filtered_df=filtered_df[(filtered_df[x_value]!='MISSING') & (filtered_df[y_value]!='MISSING')]
     #aggregate the axes to the desired level
-    filtered_df[x_value]=filtered_df[x_value].apply(lambda x: drill_to_level(x, x_level, dim_ent, ent_hierarchy))
-    filtered_df[y_value]=filtered_df[y_value].apply(lambda y: drill_to_level(y, y_level, dim_ent, ent_hierarchy))
+    report_progress(1, 3, 'Aggregating categories')
+    filtered_df[x_value]=drill_column_to_level(filtered_df[x_value], x_level, ent_index)
+    filtered_df[y_value]=drill_column_to_level(filtered_df[y_value], y_level, ent_index)
     #groupby selected categories and count group sizes, then remove MISSING
-    df_grouped=filtered_df.groupby([x_value, y_value]).size().reset_index(name='counts')
+    report_progress(2, 3, 'Counting papers')
+    df_grouped=filtered_df.groupby([x_value, y_value], observed=True).size().reset_index(name='counts')
     #df_grouped=df_grouped[(df_grouped[x_value]!='MISSING') & (df_grouped[y_value]!='MISSING')]
     #make from long format df a wide format df
     fig=px.scatter(data_frame=df_grouped, x=x_value, y=y_value, size='counts')
     return fig
 
-def generate_metadata_graphs(checked_paper_pks, df_complete, engine):
-    filtered_df=df_complete[df_complete.paper_pk.isin(checked_paper_pks)]
+def generate_metadata_graphs(checked_paper_pks, df_complete, db, report_progress=None, paper_index=None, paper_dimensions=None):
+    report_progress=report_progress or (lambda step, total, message: None)
+    report_progress(0, 3, 'Counting publications per year')
+    #one row per paper, so that every paper is counted once
+    filtered_df=select_paper_columns(df_complete, checked_paper_pks, ['title', 'year'], paper_index, per_paper=True)
     #time histogram
     nbins=int(filtered_df.year.max()-filtered_df.year.min())
     fig_time=go.Figure()
     fig_time.add_trace(go.Histogram(x=filtered_df.year, y=filtered_df.title, nbinsx=nbins, marker_color='#000099', opacity=0.75))
     fig_time.update_layout(bargap=0.2, title_text='Publications over time')
     #journals pie chart
-    #first, get journal information for each paper in the selection
-    pk_tup=tuple(checked_paper_pks) if len(checked_paper_pks)>1 else ('({})'.format(checked_paper_pks[0]))
-    jour_sql='select * from (select journal_pk, paper_pk, title as paper_title from dim_paper dp where paper_pk in {}) as pap left join dim_journal dj on pap.journal_pk = dj.journal_pk '.format(pk_tup)
-    journals_filtered=load_df_from_query(engine, querystring=jour_sql)
-    fig_journals=px.pie(journals_filtered, names='title', color_discrete_sequence=px.colors.sequential.Plasma, title='Publications per journal')
+    #the journal and author institutions of the papers are counted in memory, without paper_dimensions they are queried
+    report_progress(1, 3, 'Counting journals')
+    if paper_dimensions is None:
+        pks=[int(pk) for pk in checked_paper_pks]
+        journals=load_named_query(db, 'paper_journals', pks=pks)
+        paper_journals=pd.DataFrame({'paper_pk': journals['paper_pk'], 'journal': journals['title']})
+        paper_dimensions=PaperDimensions(paper_journals, load_named_query(db, 'paper_authors', pks=pks)[['paper_pk', 'author_position', 'institution', 'country']])
+    journal_counts=paper_dimensions.journal_counts(checked_paper_pks)
+    fig_journals=px.pie(journal_counts, names='journal', values='papers', color_discrete_sequence=px.colors.sequential.Plasma, title='Publications per journal')
     fig_journals.update_traces(textinfo='value')
     fig_journals.update_layout(
         legend=dict(
@@ -285,10 +939,9 @@ def generate_metadata_graphs(checked_paper_pks, df_complete, engine):
     )
     #institutes pie chart
     #which authors are involved?
-    auth_sql='select * from (select * from (select authorgroup_pk, paper_pk, title as paper_title from dim_paper dp where paper_pk in {}) as pap left join bridge_paper_author bpa on pap.authorgroup_pk = bpa.authorgroup_pk) as agr left join dim_author da on agr.author_pk=da.author_pk'.format(pk_tup)
-    authors_filtered=load_df_from_query(engine, querystring=auth_sql)
-    authors_filtered=authors_filtered[authors_filtered['institution']!='MISSING']
-    fig_institutes=px.pie(authors_filtered, names='institution', color_discrete_sequence=px.colors.sequential.Plasma, hover_data=['country'], title='Institutes of publishing authors')
+    report_progress(2, 3, 'Counting institutes')
+    institution_counts=paper_dimensions.institution_counts(checked_paper_pks)
+    fig_institutes=px.pie(institution_counts, names='institution', values='authors', color_discrete_sequence=px.colors.sequential.Plasma, hover_data=['country'], title='Institutes of publishing authors')
     fig_institutes.update_traces(textinfo='value')
     fig_institutes.update_layout(
         legend=dict(
@@ -301,36 +954,47 @@ def generate_metadata_graphs(checked_paper_pks, df_complete, engine):
     #fig_institutes.update_layout(uniformtext_minsize=9, uniformtext_mode='hide')
     return fig_time, fig_journals, fig_institutes
 
-def get_title_dropdown(selected_papers_string, df_k):
-    filtered_df=get_filtered_df_from_string_of_paper_pks(selected_papers_string, df_k)
-    options=filtered_df[['paper_pk', 'title']].apply(lambda row: {'label': str(row['paper_pk']) + ' - ' + row['title'], 'value': row['paper_pk']}, axis=1).to_list()
-    return options
+def generate_cooccurrence_heatmap(incidence, x_label, y_label, checked_paper_pks=None, x_level=None, y_level=None, max_entities=30):
+    """Draws the number of papers in which two entities of two labels occur together as heatmap.
+    Args:
+        incidence (EntityIncidence): The paper x entity incidence matrix.
+        x_label (str): The label of the entities in the rows.
+        y_label (str): The label of the entities in the columns.
+        checked_paper_pks (list): The papers to count, all papers if None.
+        x_level (int): The level to roll the row entities up to, None for the entities themselves.
+        y_level (int): The level to roll the column entities up to, None for the entities themselves.
+        max_entities (int): Only the most frequent entities of both labels are shown.
+    Returns:
+        A plotly figure, or None if no paper contains entities of both labels.
+    """
+    cooc=incidence.cooccurrence_matrix(x_label, y_label, checked_paper_pks, x_level, y_level)
+    if cooc.empty:
+        return None
+    rows=cooc.sum(axis=1).sort_values(ascending=False, kind='stable').index[:max_entities]
+    cols=cooc.sum(axis=0).sort_values(ascending=False, kind='stable').index[:max_entities]
+    cooc=cooc.loc[rows, cols]
+    fig=px.imshow(cooc, text_auto=True, aspect='auto', color_continuous_scale='Blues',
+        labels={'x': y_label.lower(), 'y': x_label.lower(), 'color': 'papers'})
+    fig.update_layout(height=max(400, 25*len(rows)+200))
+    return fig
+
+def get_title_dropdown(selection, df_k, paper_index=None):
+    return get_paper_options(selection, df_k, paper_index)
 
-def get_summary_fields(paper_key, engine, dim_ent):
-    paper_query='select title, year, abstract from dim_paper where paper_pk = {}'.format(paper_key)
-    title_year_abstract=load_df_from_query(engine, paper_query)
-    title=title_year_abstract['title'].values[0]
-    year=title_year_abstract['year'].values[0]
-    abstract=title_year_abstract['abstract'].values[0]
-    keyword_query='select keyword_string from dim_keyword dk where keyword_pk in (select keyword_pk from bridge_paper_keyword bpk where keywordgroup_pk in (select keywordgroup_pk from dim_paper dp where paper_pk = {}))'.format(paper_key)
-    keywords=load_df_from_query(engine, keyword_query)
-    author_query='select author_position, surname, firstname, middlename, email, department, institution, country from (select * from (select authorgroup_pk, keywordgroup_pk, paper_pk, title as paper_title from dim_paper dp where paper_pk = {} ) as pap left join bridge_paper_author bpa on pap.authorgroup_pk = bpa.authorgroup_pk) as agr left join dim_author da on agr.author_pk=da.author_pk'.format(paper_key)
-    authors_df=load_df_from_query(engine, author_query)
-    authors_df.sort_values(by=['author_position'], inplace=True)
-    authors_df.drop(columns='author_position', inplace=True)
-    authors_h6=[]
-    for author in [', '.join(a) for a in [[s for s in sl if s != 'MISSING'] for sl in authors_df.values.tolist()]]:
-        authors_h6.append(html.H6(author))
+@metrics.timed_db
+def get_summary_fields(paper_key, db, dim_ent):
+    details=load_paper_details([paper_key], db)[int(paper_key)]
+    authors_h6=[html.H6(author) for author in details['authors']]
     return dbc.Card([
         dbc.CardBody([
             html.Br(),
-            html.H3(title, className='card-title'),
+            html.H3(details['title'], className='card-title'),
             html.Br(),
             html.Div(authors_h6, className='card-subtitle'),
             html.Hr(),
-            html.H4(str(year.year)),
-            html.P(abstract),
-            html.H5('Keywords: ' + ', '.join(keywords['keyword_string'].to_list())),
+            html.H4(str(pd.Timestamp(details['year']).year)),
+            html.P(details['abstract']),
+            html.H5('Keywords: ' + ', '.join(details['keywords'])),
             html.Hr(),
             html.Br(),
             html.Div(children=[
@@ -374,27 +1038,179 @@ def get_summary_fields(paper_key, engine, dim_ent):
         ])
     ])
 
-def load_ents_for_paper_and_label(paper_pk, entity_label, engine):
-    query="select entity_label, entity_name, entity_count, paper_pk from (select entity_pk, entity_count, paper_pk from (fact_entity_detection fed left join dim_sentence ds on fed.sentence_pk = ds.sentence_pk) as fse left join dim_paragraph dp on fse.paragraph_pk = dp.paragraph_pk) as fpa left join dim_entity de on fpa.entity_pk =de.entity_pk where paper_pk={} and entity_label='{}'".format(paper_pk, entity_label)
-    all_ents_pk_label=load_df_from_query(engine, query)
+#title, year, abstract, keywords and authors of the papers opened or prefetched in the detail analysis
+PAPER_DETAIL_CACHE_SIZE=512
+PAPER_DETAIL_CACHE_TTL=600
+_paper_details=OrderedDict()
+_paper_details_lock=threading.Lock()
+#columns of dim_author that make up the name shown in the detail summary, MISSING values are left out
+AUTHOR_DETAIL_COLUMNS=['surname', 'firstname', 'middlename', 'email', 'department', 'institution', 'country']
+
+def _paper_details_from_rows(rows):
+    #splits the rows of the paper_details statement into the details of every paper, the authors ordered by position
+    details={}
+    authors={}
+    for values in zip(*(rows[col].tolist() for col in rows.columns)):
+        row=dict(zip(rows.columns, values))
+        paper_pk=int(row['paper_pk'])
+        paper=details.setdefault(paper_pk, {'keywords': [], 'authors': []})
+        if row['part']=='paper':
+            paper.update(title=row['title'], year=row['year'], abstract=row['abstract'])
+        elif row['part']=='keyword':
+            paper['keywords'].append(row['keyword_string'])
+        else:
+            name=', '.join(row[col] for col in AUTHOR_DETAIL_COLUMNS if row[col] is not None and row[col]!='MISSING')
+            authors.setdefault(paper_pk, []).append((row['author_position'], name))
+    for paper_pk, paper_authors in authors.items():
+        details[paper_pk]['authors']=[name for _, name in sorted(paper_authors, key=lambda author: author[0])]
+    return details
+
+@metrics.timed_db
+def load_paper_details(paper_pks, db):
+    """Returns what the detail summary shows of the papers: title, year, abstract, keywords and author names.
+    All papers that are not in memory are loaded with a single query (one roundtrip), then kept for
+    PAPER_DETAIL_CACHE_TTL seconds, for at most PAPER_DETAIL_CACHE_SIZE papers (the least recently used are evicted).
+    Args:
+        paper_pks (list): The papers (int or str).
+        db (Database): The data access layer.
+    Returns:
+        A dict paper_pk (int): dict of 'title', 'year', 'abstract', 'keywords' (list) and 'authors' (list of str).
+    """
+    pks=list(dict.fromkeys(int(pk) for pk in paper_pks))
+    details={}
+    with _paper_details_lock:
+        now=time.monotonic()
+        for pk in pks:
+            entry=_paper_details.get(pk)
+            if entry is not None and now-entry[0]<=PAPER_DETAIL_CACHE_TTL:
+                _paper_details.move_to_end(pk)
+                details[pk]=entry[1]
+    missing=[pk for pk in pks if pk not in details]
+    if missing:
+        loaded=_paper_details_from_rows(load_named_query(db, 'paper_details', pks=missing))
+        with _paper_details_lock:
+            now=time.monotonic()
+            for pk, paper_details in loaded.items():
+                _paper_details[pk]=(now, paper_details)
+                _paper_details.move_to_end(pk)
+            while len(_paper_details)>PAPER_DETAIL_CACHE_SIZE:
+                _paper_details.popitem(last=False)
+        details.update(loaded)
+    return details
+
+@metrics.timed_db
+def prefetch_paper_details(paper_pks, db):
+    """Loads the details and the detected entities of the checked papers into memory, with one query each for all
+    papers, so that switching between them in the detail analysis needs no query. Only the first
+    PAPER_DETAIL_CACHE_SIZE (details) and ENTITY_FACT_CACHE_SIZE (entities) papers are loaded.
+    Returns:
+        The number of papers whose details are in memory.
+    """
+    pks=list(dict.fromkeys(int(pk) for pk in paper_pks))
+    details=load_paper_details(pks[:PAPER_DETAIL_CACHE_SIZE], db)
+    load_paper_entities_batch(pks[:ENTITY_FACT_CACHE_SIZE], db)
+    return len(details)
+
+#detected entities of the papers opened in the detail analysis, kept so that label and level changes need no query
+ENTITY_FACT_CACHE_SIZE=64
+ENTITY_FACT_CACHE_TTL=600
+_entity_facts=OrderedDict()
+_entity_facts_loading={}
+_entity_facts_lock=threading.Lock()
+
+def _cached_paper_entities(paper_pk):
+    #the cached entities of a paper if they are not older than the TTL, must be called holding _entity_facts_lock
+    entry=_entity_facts.get(paper_pk)
+    if entry is None or time.monotonic()-entry[0]>ENTITY_FACT_CACHE_TTL:
+        return None
+    _entity_facts.move_to_end(paper_pk)
+    return entry[1]
+
+@metrics.timed_db
+def load_paper_entities(paper_pk, db):
+    """Returns the detected entities of all labels with their counts for one paper.
+    The table is loaded with one query when the paper is selected and then kept in memory for ENTITY_FACT_CACHE_TTL
+    seconds, for at most ENTITY_FACT_CACHE_SIZE papers (the least recently used are evicted). Concurrent requests
+    for the same paper (summary, pie and histogram) wait for one query instead of running it several times.
+    Args:
+        paper_pk (int or str): The paper.
+        db (Database): The data access layer.
+    Returns:
+        A pandas dataframe with the columns entity_label, entity_name, entity_count and paper_pk.
+    """
+    paper_pk=int(paper_pk)
+    with _entity_facts_lock:
+        ents=_cached_paper_entities(paper_pk)
+        if ents is not None:
+            return ents
+        loading=_entity_facts_loading.get(paper_pk)
+        owner=loading is None
+        if owner:
+            #this thread loads the paper, the lock is held until the result is there: [lock, result]
+            loading=_entity_facts_loading[paper_pk]=[threading.Lock(), None]
+            loading[0].acquire()
+    if not owner:
+        #wait for the thread loading the paper and take its result, or load it again if its query failed
+        with loading[0]:
+            pass
+        return loading[1] if loading[1] is not None else load_paper_entities(paper_pk, db)
+    try:
+        ents=load_named_query(db, 'paper_entities', pks=[paper_pk])
+        loading[1]=ents
+        with _entity_facts_lock:
+            _store_paper_entities({paper_pk: ents})
+    finally:
+        #only the loading thread removes its entry, so that the entry of a later load is never removed
+        with _entity_facts_lock:
+            del _entity_facts_loading[paper_pk]
+        loading[0].release()
+    return ents
+
+def _store_paper_entities(ents_by_paper):
+    #adds the entities of papers to the cache and evicts the least recently used, must be called holding _entity_facts_lock
+    now=time.monotonic()
+    for paper_pk, ents in ents_by_paper.items():
+        _entity_facts[paper_pk]=(now, ents)
+        _entity_facts.move_to_end(paper_pk)
+    while len(_entity_facts)>ENTITY_FACT_CACHE_SIZE:
+        _entity_facts.popitem(last=False)
+
+@metrics.timed_db
+def load_paper_entities_batch(paper_pks, db):
+    """Loads the detected entities of the papers that are not in memory with one query and keeps them like
+    load_paper_entities does (papers without entities are kept as empty tables)."""
+    pks=list(dict.fromkeys(int(pk) for pk in paper_pks))
+    with _entity_facts_lock:
+        missing=[pk for pk in pks if _cached_paper_entities(pk) is None]
+    if not missing:
+        return
+    ents=load_named_query(db, 'paper_entities', pks=missing)
+    groups=ents.groupby('paper_pk', sort=False).indices
+    ents_by_paper={pk: ents.iloc[groups[pk]].reset_index(drop=True) if pk in groups else ents.iloc[:0] for pk in missing}
+    with _entity_facts_lock:
+        _store_paper_entities(ents_by_paper)
+
+@metrics.timed_db
+def load_ents_for_paper_and_label(paper_pk, entity_label, db):
+    all_ents=load_paper_entities(paper_pk, db)
+    all_ents_pk_label=all_ents[all_ents['entity_label']==entity_label].reset_index(drop=True)
     return all_ents_pk_label
 
-def generate_detail_piechart_or_hist(paper_pk, entity_label, level, engine, dim_ent, ent_hierarchy, fig_type):
-    all_ents=load_ents_for_paper_and_label(paper_pk, entity_label, engine)
+def generate_detail_piechart_or_hist(paper_pk, entity_label, level, db, ent_index, fig_type):
+    all_ents=load_ents_for_paper_and_label(paper_pk, entity_label, db)
     if all_ents.empty:
         return html.P('Sorry, no entities were detected for {}. Try another category!'.format(entity_label), style={'color': '#e74c3c'})
     else:
         #aggregate the entities to the desired level
-        all_ents['entity_name']=all_ents['entity_name'].apply(lambda x: drill_to_level(x, level, dim_ent, ent_hierarchy))
-        #duplicate rows by the count they have in entity_count (as piechart only takes one column as input)
-        all_ents_dup_count=pd.DataFrame(np.repeat(all_ents.values, all_ents['entity_count'].replace(0,1).tolist(), axis=0), columns=all_ents.columns)
+        all_ents['entity_name']=drill_column_to_level(all_ents['entity_name'], level, ent_index)
+        #sum the counts per entity (detections with count 0 count once), in the order the entities appear
+        ent_totals=all_ents['entity_count'].replace(0,1).groupby(all_ents['entity_name'], sort=False, observed=True).sum()
         if fig_type=='pie':
-            fig_pie=px.pie(all_ents_dup_count, names='entity_name')#, color_discrete_sequence=px.colors.sequential.Plasma, title='Publications per journal')
+            fig_pie=px.pie(names=ent_totals.index, values=ent_totals.values)#, color_discrete_sequence=px.colors.sequential.Plasma, title='Publications per journal')
             fig_pie.update_traces(textinfo='value')
             return dcc.Graph(figure=fig_pie)
         else:
-            nbins=all_ents_dup_count.entity_name.nunique()
             fig_hist=go.Figure()
-            fig_hist.add_trace(go.Histogram(x=all_ents_dup_count.entity_name, y=all_ents_dup_count.entity_name, nbinsx=nbins))#, nbinsx=nbins, marker_color='#000099', opacity=0.75))
+            fig_hist.add_trace(go.Bar(x=ent_totals.index, y=ent_totals.values))#, marker_color='#000099', opacity=0.75))
             fig_hist.update_layout(bargap=0.2)
             return dcc.Graph(figure=fig_hist)
\ No newline at end of file
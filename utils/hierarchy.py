@@ -0,0 +1,113 @@
+import pandas as pd
+import numpy as np
+
+
+class EntityHierarchyIndex:
+    """In-memory index over the entity hierarchy, built once at startup from dim_entity and map_entity_hierarchy.
+    Rolling an entity (or a whole column of entities) up to a level is a lookup in a precomputed ancestor table
+    instead of repeated boolean scans over both tables.
+    Args:
+        dim_ent (pandas dataframe): The dim_entity table (entity_pk, entity_name, entity_label, ...).
+        ent_hierarchy (pandas dataframe): The map_entity_hierarchy table (parent_entity_pk, child_entity_pk, depth_from_parent).
+    """
+    def __init__(self, dim_ent, ent_hierarchy):
+        #first occurrence wins in both directions, as with .values[0] on a boolean mask
+        by_pk=dim_ent.drop_duplicates(subset='entity_pk', keep='first')
+        by_name=dim_ent.drop_duplicates(subset='entity_name', keep='first')
+        self.pk_to_name=dict(zip(by_pk['entity_pk'], by_pk['entity_name']))
+        self.name_to_pk=dict(zip(by_name['entity_name'], by_name['entity_pk']))
+        self._pks=pd.Index(by_pk['entity_pk'].to_numpy())
+        #max depth of every entity from its root, i.e. its level in the hierarchy
+        self.max_depth=ent_hierarchy.groupby('child_entity_pk')['depth_from_parent'].max().to_dict()
+        #ancestor-at-level table: row = entity position in self._pks, column = level, value = position of the ancestor (-1 if none)
+        h=ent_hierarchy[['child_entity_pk', 'parent_entity_pk', 'depth_from_parent']].copy()
+        h['level']=h['child_entity_pk'].map(self.max_depth)-h['depth_from_parent']
+        h=h.drop_duplicates(subset=['child_entity_pk', 'level'], keep='first')
+        h['child_pos']=self._pks.get_indexer(h['child_entity_pk'])
+        h['parent_pos']=self._pks.get_indexer(h['parent_entity_pk'])
+        h=h[(h['child_pos']>=0) & (h['parent_pos']>=0) & (h['level']>=0)]
+        n_levels=int(h['level'].max())+1 if not h.empty else 0
+        self.ancestors=np.full((len(self._pks), n_levels), -1, dtype=np.int64)
+        self.ancestors[h['child_pos'].to_numpy(), h['level'].to_numpy().astype(np.int64)]=h['parent_pos'].to_numpy()
+        self._names=by_pk['entity_name'].to_numpy(dtype=object)
+        #positions of the entities looked up by name
+        self._name_pos=pd.Series(self._pks.get_indexer(by_name['entity_pk']), index=by_name['entity_name'].to_numpy())
+        self._build_descendants(ent_hierarchy)
+
+    def _build_descendants(self, ent_hierarchy):
+        """Precomputes the descendant closure of every entity: all entities below it at any depth, with their
+        distance. The pairs of map_entity_hierarchy are closed transitively over the direct (depth 1) links,
+        so that the closure is complete even if the table only holds the direct links.
+        The closure is stored like a CSR matrix: the descendants of the entity at position i are
+        _desc_pos[_desc_ptr[i]:_desc_ptr[i+1]], sorted by depth, with their depths in _desc_depth."""
+        h=pd.DataFrame({
+            'parent': self._pks.get_indexer(ent_hierarchy['parent_entity_pk']),
+            'child': self._pks.get_indexer(ent_hierarchy['child_entity_pk']),
+            'depth': ent_hierarchy['depth_from_parent'].to_numpy(dtype=np.int64)
+        })
+        h=h[(h['parent']>=0) & (h['child']>=0) & (h['parent']!=h['child']) & (h['depth']>0)]
+        links=h[h['depth']==1][['parent', 'child']].drop_duplicates()
+        pairs=h
+        frontier=links.assign(depth=1)
+        while not frontier.empty:
+            #one more link down from every pair found in the last step, the depth of a pair is its shortest path
+            step=frontier.merge(links, left_on='child', right_on='parent', suffixes=('', '_next'))
+            step=pd.DataFrame({'parent': step['parent'], 'child': step['child_next'], 'depth': step['depth']+1})
+            step=step[step['parent']!=step['child']]
+            known=pd.concat([pairs, frontier])
+            step=step.merge(known[['parent', 'child']].drop_duplicates(), how='left', indicator=True)
+            frontier=step[step['_merge']=='left_only'].drop(columns='_merge').drop_duplicates(subset=['parent', 'child'])
+            pairs=pd.concat([pairs, frontier])
+        pairs=pairs.sort_values(['parent', 'depth', 'child']).drop_duplicates(subset=['parent', 'child'])
+        self._desc_ptr=np.zeros(len(self._pks)+1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs['parent'].to_numpy(dtype=np.int64), minlength=len(self._pks)), out=self._desc_ptr[1:])
+        self._desc_pos=pairs['child'].to_numpy(dtype=np.int64)
+        self._desc_depth=pairs['depth'].to_numpy(dtype=np.int64)
+
+    def descendants(self, ent_name, max_depth=None, include_self=True):
+        """Returns the names of the descendants of an entity at all depths (or up to max_depth), nearest first.
+        Args:
+            ent_name (str): The entity name.
+            max_depth (int): The maximum distance below the entity, None for all depths.
+            include_self (bool): Whether the entity itself is the first name of the result.
+        Returns:
+            A list of entity names, empty if the entity is unknown.
+        """
+        pos=self._name_pos.get(ent_name)
+        if pos is None or pos<0:
+            return []
+        start, end=self._desc_ptr[pos], self._desc_ptr[pos+1]
+        desc=self._desc_pos[start:end]
+        if max_depth is not None:
+            desc=desc[self._desc_depth[start:end]<=max_depth]
+        names=self._names[desc].tolist()
+        return [self._names[pos]]+names if include_self else names
+
+    def _level_column(self, level):
+        """Returns the column of the ancestor table for level, or None if no entity can be rolled to that level."""
+        try:
+            level_int=int(level)
+        except (TypeError, ValueError):
+            return None
+        if level_int!=level or level_int<0 or level_int>=self.ancestors.shape[1]:
+            return None
+        return level_int
+
+    def roll_up(self, ent_names, level):
+        """Rolls up a column of entity names to the given hierarchy level in one vectorized lookup.
+        'MISSING' stays 'MISSING' and entities that cannot be rolled to that level keep their own name.
+        Args:
+            ent_names (pandas series or list): The entity names to aggregate.
+            level (int): The target level, 0 being the highest aggregation.
+        Returns:
+            A pandas series of the aggregated entity names, aligned with the input.
+        """
+        ent_names=pd.Series(ent_names) if not isinstance(ent_names, pd.Series) else ent_names
+        col=self._level_column(level)
+        if col is None or ent_names.empty:
+            return ent_names.copy()
+        pos=self._name_pos.reindex(ent_names.to_numpy()).fillna(-1).to_numpy(dtype=np.int64)
+        anc=np.where(pos>=0, self.ancestors[pos, col], -1)
+        rolled=np.where(anc>=0, self._names[anc], ent_names.to_numpy(dtype=object))
+        rolled=np.where(ent_names.to_numpy(dtype=object)=='MISSING', 'MISSING', rolled)
+        return pd.Series(rolled, index=ent_names.index, name=ent_names.name, dtype=object)
@@ -0,0 +1,196 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+def _csr(n_rows, rows, names):
+    """Builds the CSR arrays (indptr, indices) and the sorted vocabulary of a binary incidence matrix from
+    (row, entity name) occurrences, duplicates are counted once."""
+    codes, vocabulary=pd.factorize(pd.Series(names, dtype=object), sort=True)
+    n_cols=max(len(vocabulary), 1)
+    cells=np.unique(rows.astype(np.int64)*n_cols+codes)
+    indptr=np.zeros(n_rows+1, dtype=np.int64)
+    np.cumsum(np.bincount(cells//n_cols, minlength=n_rows), out=indptr[1:])
+    return indptr, (cells%n_cols).astype(np.int32), np.asarray(vocabulary, dtype=object)
+
+def _select_rows(indptr, indices, rows):
+    """Returns the number of entries of every selected row and the entries of the selected rows back to back."""
+    starts=indptr[rows]
+    lengths=indptr[rows+1]-starts
+    offsets=np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(lengths.sum())
+    return lengths, indices[offsets]
+
+
+class EntityIncidence:
+    """Sparse paper x entity incidence matrix: which entities occur in which paper, built once at startup.
+    The matrix is stored per entity label in CSR form, indptr (offsets per paper position) and indices (positions
+    in the sorted vocabulary of the label), so the rows of any subset of papers are slices of one integer array.
+    Rolled up matrices (an entity is replaced by its ancestor at a hierarchy level) are built on first use and kept.
+    Co-occurrence counts of two labels for a subset of papers are the sparse product X^T Y of the selected rows.
+    Args:
+        paper_pks (array): The paper_pks in the order of the rows.
+        entities (dict): label: tuple of two equal length arrays (paper_pks, entity_names), one entry per occurrence.
+            'MISSING' and empty names are left out.
+        ent_index (EntityHierarchyIndex): The entity hierarchy, for the roll-up to a level.
+    """
+    def __init__(self, paper_pks, entities, ent_index):
+        self.paper_pks=np.asarray(paper_pks, dtype=np.int64)
+        self._paper_positions=pd.Index(self.paper_pks)
+        self.ent_index=ent_index
+        self._matrices={}
+        self._entry_rows={}
+        self._lock=threading.Lock()
+        for label, (pks, names) in entities.items():
+            rows=self._paper_positions.get_indexer(np.asarray(pks, dtype=np.int64))
+            names=pd.Series(names, dtype=object)
+            keep=(rows>=0) & names.notna().to_numpy() & (names!='MISSING').to_numpy()
+            self._matrices[(label.lower(), None)]=_csr(len(self.paper_pks), rows[keep], names[keep].to_numpy())
+        self.labels=sorted(label for label, level in self._matrices)
+
+    @property
+    def nbytes(self):
+        """Size of the CSR arrays (and entry rows) of all labels and levels built so far in bytes."""
+        return sum(indptr.nbytes+indices.nbytes for indptr, indices, vocabulary in self._matrices.values())+sum(rows.nbytes for rows in self._entry_rows.values())
+
+    def paper_positions(self, paper_pks=None):
+        """Returns the rows of the given paper_pks (unknown pks are left out), or of all papers if paper_pks is None."""
+        if paper_pks is None:
+            return np.arange(len(self.paper_pks))
+        rows=self._paper_positions.get_indexer(np.unique(np.asarray(paper_pks).astype(np.int64)))
+        return rows[rows>=0]
+
+    def matrix(self, label, level=None):
+        """Returns the incidence matrix of one entity label, rolled up to level if it is not None.
+        Args:
+            label (str): The entity label, e.g. 'topic' (case insensitive).
+            level (int): The hierarchy level, 0 being the highest aggregation. Entities that cannot be rolled
+                up to the level keep their own name.
+        Returns:
+            A tuple (indptr, indices, vocabulary) of the CSR arrays and the entity names of the columns.
+        """
+        label=label.lower()
+        if (label, None) not in self._matrices:
+            raise ValueError('Unknown entity label {}, expected one of {}.'.format(label, ', '.join(self.labels)))
+        key=(label, None if level is None else int(level))
+        with self._lock:
+            if key not in self._matrices:
+                indptr, indices, vocabulary=self._matrices[(label, None)]
+                rolled=self.ent_index.roll_up(pd.Series(vocabulary, dtype=object), key[1]).to_numpy(dtype=object)
+                rows=np.repeat(np.arange(len(self.paper_pks)), np.diff(indptr))
+                self._matrices[key]=_csr(len(self.paper_pks), rows, rolled[indices])
+            return self._matrices[key]
+
+    def paper_mask(self, paper_pks=None):
+        """Returns a boolean array over the rows that is True for the given paper_pks, or None for all papers."""
+        if paper_pks is None:
+            return None
+        mask=np.zeros(len(self.paper_pks), dtype=bool)
+        mask[self.paper_positions(paper_pks)]=True
+        return mask
+
+    def entity_papers(self, label, paper_pks=None, level=None, mask=None):
+        """Returns the number of papers (of paper_pks, or all) per entity of a label as pandas series, largest first.
+        To count several labels for the same papers, the papers can be given as mask (see paper_mask) instead."""
+        indptr, indices, vocabulary=self.matrix(label, level)
+        if mask is None:
+            mask=self.paper_mask(paper_pks)
+        if mask is not None:
+            #the row of every entry, to intersect the entries with the mask of the papers
+            key=(label.lower(), None if level is None else int(level))
+            entry_rows=self._entry_rows.get(key)
+            if entry_rows is None:
+                entry_rows=self._entry_rows.setdefault(key, np.repeat(np.arange(len(self.paper_pks), dtype=np.int32), np.diff(indptr)))
+            indices=indices[mask[entry_rows]]
+        counts=np.bincount(indices, minlength=len(vocabulary))
+        order=np.argsort(-counts, kind='stable')
+        order=order[counts[order]>0]
+        return pd.Series(counts[order], index=vocabulary[order], name='papers')
+
+    def papers_with(self, label, ent_name, level=None):
+        """Returns the sorted paper_pks of the papers in which the entity (rolled up to level if not None) occurs."""
+        indptr, indices, vocabulary=self.matrix(label, level)
+        col=np.searchsorted(vocabulary, ent_name)
+        if col>=len(vocabulary) or vocabulary[col]!=ent_name:
+            return np.empty(0, dtype=np.int64)
+        rows=np.searchsorted(indptr, np.flatnonzero(indices==col), side='right')-1
+        return np.sort(self.paper_pks[rows])
+
+    def cooccurrence(self, x_label, y_label, paper_pks=None, x_level=None, y_level=None):
+        """Counts for every pair of an x and a y entity the papers in which both occur.
+        Args:
+            x_label (str): The entity label of the first entity, e.g. 'technology'.
+            y_label (str): The entity label of the second entity, e.g. 'conceptual_method'.
+            paper_pks (list): The papers to count, all papers if None.
+            x_level (int): The level to roll the x entities up to, None for the entities themselves.
+            y_level (int): The level to roll the y entities up to, None for the entities themselves.
+        Returns:
+            A pandas dataframe with the columns x_entity, y_entity and papers, the most frequent pairs first.
+        """
+        x_indptr, x_indices, x_vocabulary=self.matrix(x_label, x_level)
+        y_indptr, y_indices, y_vocabulary=self.matrix(y_label, y_level)
+        rows=self.paper_positions(paper_pks)
+        x_lengths, x_entries=_select_rows(x_indptr, x_indices, rows)
+        y_lengths, y_entries=_select_rows(y_indptr, y_indices, rows)
+        #X^T Y: pair every x entry of a paper with the y entries of the same paper (the rows of its paper in the selected y rows)
+        x_rows=np.repeat(np.arange(len(rows)), x_lengths)
+        pair_counts, y_paired=_select_rows(np.concatenate([[0], np.cumsum(y_lengths)]), y_entries, x_rows)
+        x_paired=np.repeat(x_entries, pair_counts)
+        y_cols=max(len(y_vocabulary), 1)
+        cells, papers=np.unique(x_paired.astype(np.int64)*y_cols+y_paired, return_counts=True)
+        order=np.lexsort((cells, -papers))
+        cells=cells[order]
+        return pd.DataFrame({
+            'x_entity': x_vocabulary[cells//y_cols],
+            'y_entity': y_vocabulary[cells%y_cols],
+            'papers': papers[order]
+        })
+
+    def cooccurrence_matrix(self, x_label, y_label, paper_pks=None, x_level=None, y_level=None):
+        """Returns the co-occurrence counts as wide pandas dataframe (x entities as rows, y entities as columns)."""
+        pairs=self.cooccurrence(x_label, y_label, paper_pks, x_level, y_level)
+        return pairs.pivot(index='x_entity', columns='y_entity', values='papers').fillna(0).astype(np.int64)
+
+
+class EntityPostings:
+    """Posting lists of the entity columns of the paper dataframe: for every entity, the rows of df_k (and so the
+    papers) in which it occurs, built once at startup. The rows of a set of entities (e.g. an entity and its
+    descendants) are the union of their posting lists, found without comparing every row of df_k.
+    Every column is stored like a CSR matrix: the rows of the i-th entity of the vocabulary of a column are
+    rows[indptr[i]:indptr[i+1]], in the order of df.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k).
+        columns (list): The entity columns, e.g. ['topic', 'technology'].
+    """
+    def __init__(self, df, columns):
+        self.df=df
+        self._postings={}
+        for col in columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                #the codes are small integers, which are sorted by a fast radix sort
+                codes, vocabulary=df[col].cat.codes.to_numpy(), df[col].cat.categories
+            else:
+                codes, vocabulary=pd.factorize(df[col], sort=True)
+            keep=np.flatnonzero(codes>=0)
+            order=keep[np.argsort(codes[keep], kind='stable')]
+            indptr=np.zeros(len(vocabulary)+1, dtype=np.int64)
+            np.cumsum(np.bincount(codes[keep], minlength=len(vocabulary)), out=indptr[1:])
+            self._postings[col]=(indptr, order, pd.Index(vocabulary, dtype=object))
+        self.labels=sorted(self._postings)
+
+    def rows(self, label, ent_names):
+        """Returns the sorted positions of the rows of df in which the column label holds one of ent_names."""
+        label=label.lower()
+        if label not in self._postings:
+            raise ValueError('Unknown entity label {}, expected one of {}.'.format(label, ', '.join(self.labels)))
+        indptr, order, vocabulary=self._postings[label]
+        codes=vocabulary.get_indexer(pd.Index(list(ent_names), dtype=object).unique())
+        _, rows=_select_rows(indptr, order, codes[codes>=0])
+        return np.sort(rows)
+
+    def papers(self, label, ent_names):
+        """Returns the sorted unique paper_pks of the papers in which the column label holds one of ent_names."""
+        return np.unique(self.df['paper_pk'].to_numpy()[self.rows(label, ent_names)])
+
+    def select(self, label, ent_names):
+        """Returns the rows of df in which the column label holds one of ent_names, in the order of df."""
+        return self.df.iloc[self.rows(label, ent_names)]
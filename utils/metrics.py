@@ -0,0 +1,313 @@
+import atexit
+import bisect
+import os
+import tempfile
+import threading
+import time
+from functools import wraps
+from flask import request
+
+#metrics settings that are used if the credentials do not define METRICS_SETTINGS
+DEFAULT_METRICS_SETTINGS={
+    'enabled': True,
+    'directory': os.path.join(tempfile.gettempdir(), 'slr_dashboard_metrics'),
+    'flush_interval': 5,
+    'timing_header': False
+}
+#upper bounds of the histogram buckets
+LATENCY_BUCKETS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+#name: (label, help text, buckets) of every histogram
+HISTOGRAMS={
+    'slr_callback_duration_seconds': ('callback', 'Time of a callback request, including the serialization of the response.', LATENCY_BUCKETS),
+    'slr_callback_compute_seconds': ('callback', 'Time spent in the callback function (in the job process for background callbacks).', LATENCY_BUCKETS),
+    'slr_callback_db_seconds': ('callback', 'Time spent in database helpers per callback.', LATENCY_BUCKETS),
+    'slr_callback_response_bytes': ('callback', 'Size of the callback response in bytes.', SIZE_BUCKETS),
+    'slr_db_helper_duration_seconds': ('helper', 'Time of a database helper of utils/functions.py.', LATENCY_BUCKETS)
+}
+DASH_UPDATE_PATH='/_dash-update-component'
+
+
+def merge_snapshots(target, snapshot):
+    """Adds the histograms of snapshot to target (both dicts (name, label value): [bucket counts, sum, count])."""
+    for key, (counts, total, count) in snapshot.items():
+        if key in target:
+            merged=target[key]
+            merged[0]=[a+b for a, b in zip(merged[0], counts)]
+            merged[1]+=total
+            merged[2]+=count
+        else:
+            target[key]=[list(counts), total, count]
+    return target
+
+def _label_value(value):
+    #escapes a label value for the Prometheus text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus(snapshot):
+    """Formats histograms as Prometheus text exposition format (cumulative buckets, sum and count)."""
+    lines=[]
+    for name, (label, help_text, buckets) in HISTOGRAMS.items():
+        lines+=['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)]
+        for (metric, label_value), (counts, total, count) in sorted(snapshot.items()):
+            if metric!=name:
+                continue
+            labels='{}="{}"'.format(label, _label_value(label_value))
+            cumulative=0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative+=bucket_count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, count))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, repr(float(total))))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, count))
+    return '\n'.join(lines)+'\n'
+
+
+class Metrics:
+    """Lightweight latency instrumentation of the callbacks and database helpers, kept as histograms in memory.
+    Callbacks are measured twice: the callback function itself (compute) and the whole request to
+    /_dash-update-component (duration, including the serialization of the response, and response bytes).
+    Database helpers decorated with timed_db add their time to the callback that is running in the same thread.
+    Every process (server worker, background job) keeps its own histograms and writes them to a local diskcache
+    shared by all processes, at most every flush_interval seconds. metrics_text() adds up the histograms of all processes.
+    A module-level instance (metrics) is used, so that the helpers can be decorated when they are defined;
+    it records nothing until it is configured.
+    """
+    def __init__(self):
+        self.enabled=False
+        self.directory=None
+        self.flush_interval=5
+        self.timing_header=False
+        self._values={}
+        self._lock=threading.Lock()
+        self._local=threading.local()
+        self._cache=None
+        self._cache_pid=None
+        self._dirty=False
+        self._last_flush=0.0
+        self._server_pid=os.getpid()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._before_fork, after_in_child=self._after_fork)
+        atexit.register(self.flush, final=True)
+
+    def configure(self, enabled=True, directory=None, flush_interval=5, timing_header=False):
+        """Turns the recording on or off.
+        Args:
+            enabled (bool): Whether anything is recorded.
+            directory (str): The directory of the diskcache shared by all processes, None to keep the histograms per process.
+            flush_interval (int): Seconds between two writes of the histograms of a process to the shared cache.
+            timing_header (bool): Whether every callback response gets a Server-Timing header (total, compute and db time in ms).
+        """
+        self.enabled=enabled
+        self.directory=directory
+        self.flush_interval=flush_interval
+        self.timing_header=timing_header
+
+    def _before_fork(self):
+        #the histograms recorded so far (e.g. the startup data of a preloading master) are kept under this process
+        if self._dirty:
+            self.flush()
+
+    def _after_fork(self):
+        #a forked process (a server worker or a background job) only records its own requests
+        self._values={}
+        self._lock=threading.Lock()
+        self._local=threading.local()
+        self._dirty=False
+        self._last_flush=time.monotonic()
+
+    def observe(self, name, label_value, value):
+        """Adds a value to the histogram name with the given label value."""
+        self.observe_many(label_value, ((name, value),))
+
+    def observe_many(self, label_value, values):
+        """Adds values to several histograms with the same label value at once.
+        Args:
+            label_value (str): The callback or helper name.
+            values (list): (histogram name, value) tuples.
+        """
+        with self._lock:
+            for name, value in values:
+                buckets=HISTOGRAMS[name][2]
+                histogram=self._values.get((name, label_value))
+                if histogram is None:
+                    histogram=self._values[(name, label_value)]=[[0]*len(buckets), 0.0, 0]
+                index=bisect.bisect_left(buckets, value)
+                if index<len(buckets):
+                    histogram[0][index]+=1
+                histogram[1]+=value
+                histogram[2]+=1
+            self._dirty=True
+
+    def snapshot(self):
+        """Returns a copy of the histograms of this process."""
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    def _shared_cache(self):
+        #a diskcache handle per process
+        if self.directory is None:
+            return None
+        if self._cache_pid!=os.getpid():
+            import diskcache
+            self._cache=diskcache.Cache(self.directory)
+            self._cache_pid=os.getpid()
+        return self._cache
+
+    def flush(self, final=False):
+        """Writes the histograms of this process to the shared cache. With final (the process ends), they are
+        added to the histograms of the processes that have ended and the entry of this process is removed."""
+        cache=self._shared_cache() if self.enabled else None
+        if cache is None or not (self._dirty or final):
+            return
+        self._dirty=False
+        self._last_flush=time.monotonic()
+        snapshot=self.snapshot()
+        if final:
+            with cache.transact(retry=True):
+                cache.set('ended', merge_snapshots(cache.get('ended', {}, retry=True), snapshot), retry=True)
+                cache.delete(('process', os.getpid()), retry=True)
+            self._values={}
+        else:
+            #entries of processes that were killed expire after a day
+            cache.set(('process', os.getpid()), snapshot, expire=86400, retry=True)
+
+    def _maybe_flush(self):
+        if self._dirty and time.monotonic()-self._last_flush>=self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """Returns the histograms of all processes added up (only of this process without shared cache)."""
+        cache=self._shared_cache() if self.enabled else None
+        if cache is None:
+            return self.snapshot()
+        self.flush()
+        total={}
+        for key in list(cache.iterkeys()):
+            if key=='ended' or (isinstance(key, tuple) and key[0]=='process'):
+                merge_snapshots(total, cache.get(key, {}, retry=True))
+        return total
+
+    def metrics_text(self):
+        """Returns the histograms of all processes in Prometheus text format."""
+        return format_prometheus(self.collect())
+
+    def timed_db(self, function):
+        """Decorator of a database helper: records its time per helper and adds it to the running callback.
+        Nested helpers are only added once."""
+        @wraps(function)
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            local=self._local
+            depth=getattr(local, 'db_depth', 0)
+            local.db_depth=depth+1
+            start=time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed=time.perf_counter()-start
+                local.db_depth=depth
+                if depth==0:
+                    local.db_time=getattr(local, 'db_time', 0.0)+elapsed
+                self.observe('slr_db_helper_duration_seconds', function.__name__, elapsed)
+        return timed
+
+    def timed_callback(self, function):
+        """Decorator of a callback function: records its compute time. Outside of a request (a background job
+        runs in its own process), the database time of the callback is recorded as well and the histograms are
+        written to the shared cache when the callback returns."""
+        @wraps(function)
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            local=self._local
+            in_request=getattr(local, 'request_start', None) is not None
+            if not in_request:
+                local.db_time=0.0
+            start=time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed=time.perf_counter()-start
+                local.compute_time=elapsed
+                if in_request:
+                    #the request is recorded under the name of its callback when it ends
+                    local.callback=function.__name__
+                else:
+                    self.observe_many(function.__name__, (('slr_callback_compute_seconds', elapsed), ('slr_callback_db_seconds', local.db_time)))
+                    if os.getpid()!=self._server_pid:
+                        self.flush(final=True)
+        return timed
+
+    def instrument_app(self, app):
+        """Records every callback of a Dash app: wraps the callback functions registered with app.callback from now on
+        and times the requests to /_dash-update-component. Call it before the callbacks are defined."""
+        self._server_pid=os.getpid()
+        if not self.enabled:
+            return
+        register_callback=app.callback
+        #callback function names by the output id Dash uses in the request
+        callback_names={}
+
+        @wraps(register_callback)
+        def callback(*args, **kwargs):
+            decorator=register_callback(*args, **kwargs)
+            return lambda function: decorator(self.timed_callback(function))
+        app.callback=callback
+
+        def callback_name(output):
+            if output not in callback_names:
+                entry=app.callback_map.get(output)
+                callback_names[output]=entry['callback'].__name__ if entry else output
+            return callback_names[output]
+
+        @app.server.before_request
+        def start_request():
+            if self.enabled and request.path.endswith(DASH_UPDATE_PATH):
+                self._local.request_start=time.perf_counter()
+                self._local.db_time=0.0
+                self._local.compute_time=None
+                self._local.callback=None
+
+        @app.server.after_request
+        def end_request(response):
+            start=getattr(self._local, 'request_start', None)
+            if start is None:
+                return response
+            local=self._local
+            local.request_start=None
+            elapsed=time.perf_counter()-start
+            values=[('slr_callback_duration_seconds', elapsed), ('slr_callback_db_seconds', local.db_time),
+                ('slr_callback_response_bytes', response.calculate_content_length() or 0)]
+            name=local.callback
+            if name is None:
+                #the callback function did not run in this request (a background callback), the name is taken from the output
+                name=callback_name((request.get_json(silent=True) or {}).get('output', ''))
+            else:
+                values.append(('slr_callback_compute_seconds', local.compute_time))
+            self.observe_many(name, values)
+            if self.timing_header:
+                response.headers['Server-Timing']='total;dur={:.1f}, compute;dur={:.1f}, db;dur={:.1f}'.format(
+                    elapsed*1000, (local.compute_time or 0.0)*1000, local.db_time*1000)
+            self._maybe_flush()
+            return response
+
+
+#the instance of the application, configured in app.py
+metrics=Metrics()
+
+
+def create_metrics(app, settings=None):
+    """Configures the module-level Metrics with the settings and instruments the callbacks of the app.
+    Args:
+        app (dash.Dash): The app, before its callbacks are defined.
+        settings (dict): 'enabled', 'directory' (the shared cache, None for per process histograms), 'flush_interval'
+            and 'timing_header', missing values are taken from DEFAULT_METRICS_SETTINGS.
+    Returns:
+        The Metrics instance.
+    """
+    settings=dict(DEFAULT_METRICS_SETTINGS, **(settings or {}))
+    metrics.configure(**settings)
+    metrics.instrument_app(app)
+    return metrics
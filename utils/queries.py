@@ -0,0 +1,24 @@
+#Registry of the SQL statements that are run per callback. Values are passed as bound parameters,
+#lists of paper_pks as one array parameter (= ANY(:pks)), so every statement has a single, constant text
+#for one paper as well as for many. On PostgreSQL they are prepared once per pooled connection (see Database).
+QUERIES={
+    #journal of every paper
+    'paper_journals': 'select * from (select journal_pk, paper_pk, title as paper_title from dim_paper dp where paper_pk = ANY(:pks)) as pap left join dim_journal dj on pap.journal_pk = dj.journal_pk',
+    #authors (with position, institution and country) of every paper
+    'paper_authors': 'select * from (select * from (select authorgroup_pk, paper_pk, title as paper_title from dim_paper dp where paper_pk = ANY(:pks)) as pap left join bridge_paper_author bpa on pap.authorgroup_pk = bpa.authorgroup_pk) as agr left join dim_author da on agr.author_pk=da.author_pk',
+    #citation key and journal of every paper, for the BibTeX export
+    'paper_references': 'select dp.paper_pk, dp.citekey, dj.title as journal from dim_paper dp left join dim_journal dj on dp.journal_pk = dj.journal_pk where dp.paper_pk = ANY(:pks)',
+    #author names of every paper in the order of authorship
+    'paper_author_names': 'select dp.paper_pk, da.surname, da.firstname, da.middlename from dim_paper dp join bridge_paper_author bpa on dp.authorgroup_pk = bpa.authorgroup_pk join dim_author da on bpa.author_pk = da.author_pk where dp.paper_pk = ANY(:pks) order by dp.paper_pk, bpa.author_position',
+    #everything the detail summary shows, in one roundtrip: a 'paper' row (title, year, abstract), a 'keyword' row per keyword
+    #and an 'author' row per author (with position) of every paper
+    'paper_details': ("select dp.paper_pk, 'paper' as part, 0 as author_position, dp.title, dp.year, dp.abstract, null as keyword_string, "
+        "null as surname, null as firstname, null as middlename, null as email, null as department, null as institution, null as country "
+        "from dim_paper dp where dp.paper_pk = ANY(:pks) "
+        "union all select dp.paper_pk, 'keyword', 0, null, null, null, dk.keyword_string, null, null, null, null, null, null, null "
+        "from dim_paper dp join bridge_paper_keyword bpk on dp.keywordgroup_pk = bpk.keywordgroup_pk join dim_keyword dk on bpk.keyword_pk = dk.keyword_pk where dp.paper_pk = ANY(:pks) "
+        "union all select dp.paper_pk, 'author', bpa.author_position, null, null, null, null, da.surname, da.firstname, da.middlename, da.email, da.department, da.institution, da.country "
+        "from dim_paper dp join bridge_paper_author bpa on dp.authorgroup_pk = bpa.authorgroup_pk join dim_author da on bpa.author_pk = da.author_pk where dp.paper_pk = ANY(:pks)"),
+    #detected entities of all labels with their counts for every paper
+    'paper_entities': 'select entity_label, entity_name, entity_count, paper_pk from (select entity_pk, entity_count, paper_pk from (fact_entity_detection fed left join dim_sentence ds on fed.sentence_pk = ds.sentence_pk) as fse left join dim_paragraph dp on fse.paragraph_pk = dp.paragraph_pk) as fpa left join dim_entity de on fpa.entity_pk =de.entity_pk where paper_pk = ANY(:pks)',
+}
@@ -0,0 +1,344 @@
+import re
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN=re.compile(r'\w+')
+#separates the values of different columns in the combined field, so that phrases never span two columns
+FIELD_SEPARATOR='\x1f'
+ALL_FIELDS='all'
+
+
+def tokenize(text):
+    """Splits a text into lower case word tokens."""
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def lower_texts(texts):
+    """Returns the texts of a series as an object array of lower case strings."""
+    return texts.fillna('').astype(str).str.lower().to_numpy(dtype=object)
+
+def tokenize_texts(texts, counts=False):
+    """Returns the set of tokens of every (lower case) text, or a Counter of token frequencies if counts."""
+    if counts:
+        return [Counter(TOKEN_PATTERN.findall(text)) for text in texts]
+    return [set(TOKEN_PATTERN.findall(text)) for text in texts]
+
+def top_k(scores, k):
+    """Returns the positions of the k highest scores in descending order.
+    Only the k selected scores are sorted (partial sort), ties are broken by position so that pages are stable.
+    """
+    n=len(scores)
+    if k<=0 or n==0:
+        return np.empty(0, dtype=np.int64)
+    if k<n:
+        threshold=np.partition(scores, n-k)[n-k]
+        above=np.flatnonzero(scores>threshold)
+        ties=np.flatnonzero(scores==threshold)[:k-len(above)]
+        top=np.concatenate([above, ties])
+    else:
+        top=np.arange(n)
+    return top[np.lexsort((top, -scores[top]))]
+
+def is_phrase(text, tokens):
+    #several tokens, or one token with punctuation (e.g. "chain,"), are verified on the texts
+    return len(tokens)>1 or (len(tokens)==1 and text.strip().lower()!=tokens[0])
+
+def parse_query(query):
+    """Splits a search query into phrases (quoted parts and words with punctuation, e.g. e-commerce) and single terms.
+    Returns:
+        A tuple (terms, phrases): terms is a list of tokens, phrases a list of the lower case texts of the phrases.
+    """
+    terms=[]
+    phrases=[]
+    for quoted, word in re.findall(r'"([^"]*)"|(\S+)', query or ''):
+        text=quoted if quoted else word
+        tokens=tokenize(text)
+        if is_phrase(text, tokens):
+            phrases.append(text.strip().lower())
+        else:
+            terms.extend(tokens)
+    return terms, phrases
+
+def phrase_pattern(phrase, match='prefix'):
+    """Compiles the regex verifying a phrase on the lower case texts: its words and punctuation literally (e-commerce
+    matches e-commerce, not e commerce), its whitespace as any whitespace, but never as the separator of the
+    fields of the combined field.
+    """
+    pieces=re.findall(r'\w+|\s+|[^\w\s]+', str(phrase).strip().lower())
+    pattern=''.join(r'[^\S{}]+'.format(FIELD_SEPARATOR) if piece.isspace() else re.escape(piece) for piece in pieces)
+    return re.compile(r'\b'+pattern if match!='infix' and TOKEN_PATTERN.match(pieces[0]) else pattern)
+
+
+class StoredTexts:
+    """The lower cased texts of a field that stay in a TextStore (see utils/text_store.py) instead of memory,
+    indexed by paper position like the texts of a FieldIndex. A text is only decompressed when it is accessed.
+    Args:
+        store (TextStore): The store of the texts.
+        paper_pks (numpy array): The paper_pk of every paper position.
+    """
+    def __init__(self, store, paper_pks):
+        self.store=store
+        self.positions=store.positions(paper_pks)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, pos):
+        store_pos=self.positions[pos]
+        return self.store.text_at(store_pos).lower() if store_pos>=0 else ''
+
+
+class FieldIndex:
+    """Inverted index of one text field: a sorted vocabulary with the postings (paper positions) of every token
+    stored back to back in one integer array, plus the lower cased texts to verify phrase matches.
+    If the tokens are given with their counts, term frequencies and text lengths are kept for BM25 scoring.
+    Args:
+        texts (pandas series): The text of the field per paper, in the order of the paper positions, or StoredTexts.
+        doc_tokens (list): The set (or Counter) of tokens of every text, if they have already been computed.
+        stored_texts (list): StoredTexts that are part of the field besides texts (the abstracts of the combined
+            field if they are kept in a TextStore), phrases not found in texts are verified on them.
+    """
+    def __init__(self, texts, doc_tokens=None, stored_texts=()):
+        self.texts=texts if isinstance(texts, StoredTexts) else lower_texts(texts)
+        self.stored_texts=list(stored_texts)
+        if doc_tokens is None:
+            doc_tokens=tokenize_texts(self.texts)
+        positions=np.repeat(np.arange(len(doc_tokens), dtype=np.int64), [len(tokens) for tokens in doc_tokens])
+        codes, vocabulary=pd.factorize(np.array([t for tokens in doc_tokens for t in tokens], dtype=object))
+        with_counts=isinstance(doc_tokens[0], Counter) if doc_tokens else False
+        #sort the vocabulary so that prefixes are contiguous ranges, then group the postings by token
+        vocabulary=np.asarray(vocabulary, dtype=str)
+        order=np.argsort(vocabulary, kind='stable')
+        rank=np.empty_like(order)
+        rank[order]=np.arange(len(order))
+        token_ranks=rank[codes]
+        self.vocabulary=vocabulary[order]
+        self.vocabulary_list=self.vocabulary.tolist()
+        postings_order=np.argsort(token_ranks, kind='stable')
+        self.postings=positions[postings_order]
+        self.document_frequency=np.bincount(token_ranks, minlength=len(self.vocabulary))
+        self.offsets=np.concatenate([[0], np.cumsum(self.document_frequency)]).astype(np.int64)
+        self.frequencies=None
+        if with_counts:
+            #term frequency of every posting and length of every text, the statistics BM25 needs
+            self.frequencies=np.fromiter((c for tokens in doc_tokens for c in tokens.values()), dtype=np.int32, count=len(positions))[postings_order]
+            self.lengths=np.fromiter((sum(tokens.values()) for tokens in doc_tokens), dtype=np.int64, count=len(doc_tokens))
+            self.average_length=max(self.lengths.mean(), 1.0) if len(self.lengths) else 1.0
+
+    def token_range(self, token, prefix=True):
+        """Returns the range of vocabulary positions matching token (all tokens starting with it if prefix)."""
+        start=np.searchsorted(self.vocabulary, token, side='left')
+        if prefix:
+            stop=np.searchsorted(self.vocabulary, token+'\U0010ffff', side='left')
+        else:
+            stop=start+1 if start<len(self.vocabulary) and self.vocabulary[start]==token else start
+        return start, stop
+
+    def token_ids(self, token, match='prefix'):
+        """Returns the vocabulary positions of the tokens matching token.
+        Args:
+            token (str): The lower case token to look up.
+            match (str): 'exact' for whole tokens, 'prefix' for tokens starting with token (a range in the sorted
+                vocabulary) or 'infix' for tokens containing token anywhere (a scan over the vocabulary, not the corpus).
+        """
+        if match=='infix':
+            return np.array([i for i, vocable in enumerate(self.vocabulary_list) if token in vocable], dtype=np.int64)
+        start, stop=self.token_range(token, prefix=(match=='prefix'))
+        return np.arange(start, max(start, stop), dtype=np.int64)
+
+    def _posting_slices(self, token_ids):
+        #positions in the postings array of all postings of the given tokens
+        if len(token_ids)==1:
+            return np.arange(self.offsets[token_ids[0]], self.offsets[token_ids[0]+1])
+        return np.concatenate([np.arange(self.offsets[i], self.offsets[i+1]) for i in token_ids])
+
+    def lookup(self, token, match='prefix'):
+        """Returns the sorted, deduplicated paper positions that contain token (see token_ids for match)."""
+        token_ids=self.token_ids(token, match)
+        if len(token_ids)==0:
+            return np.empty(0, dtype=np.int64)
+        if match!='infix':
+            matches=self.postings[self.offsets[token_ids[0]]:self.offsets[token_ids[-1]+1]]
+        else:
+            matches=self.postings[self._posting_slices(token_ids)]
+        return matches if len(token_ids)==1 else np.unique(matches)
+
+    def bm25(self, tokens, match='prefix', k1=1.2, b=0.75):
+        """Returns the BM25 score of every paper for the given query tokens.
+        A query token matching several indexed tokens (prefix, infix) scores all of them.
+        """
+        scores=np.zeros(len(self.texts))
+        if self.frequencies is None:
+            return scores
+        n_docs=len(self.texts)
+        for token in tokens:
+            token_ids=self.token_ids(token, match)
+            if len(token_ids)==0:
+                continue
+            slices=self._posting_slices(token_ids)
+            df=self.document_frequency[token_ids]
+            idf=np.repeat(np.log(1+(n_docs-df+0.5)/(df+0.5)), df)
+            docs=self.postings[slices]
+            tf=self.frequencies[slices]
+            norm=k1*(1-b+b*self.lengths[docs]/self.average_length)
+            np.add.at(scores, docs, idf*tf*(k1+1)/(tf+norm))
+        return scores
+
+    def match(self, terms, phrases, match='prefix'):
+        """Returns the paper positions containing all terms and all phrases (AND)."""
+        result=None
+        for token in terms+[t for phrase in phrases for t in tokenize(phrase)]:
+            positions=self.lookup(token, match)
+            result=positions if result is None else np.intersect1d(result, positions, assume_unique=True)
+            if len(result)==0:
+                return result
+        if result is None:
+            return np.arange(len(self.texts), dtype=np.int64)
+        for phrase in phrases:
+            #the index only gives candidates for phrases, the words and what separates them are verified on their texts
+            pattern=phrase_pattern(phrase, match)
+            result=result[[self._contains(pattern, pos) for pos in result]]
+        return result
+
+    def _contains(self, pattern, pos):
+        #the texts in memory are searched first, stored texts are only decompressed if the phrase is not found there
+        return bool(pattern.search(self.texts[pos])) or any(pattern.search(texts[pos]) for texts in self.stored_texts)
+
+
+class SearchIndex:
+    """Tokenized inverted index over the papers of df_k, built once at startup.
+    Every field (title, keywords, abstract) is indexed per paper, the combined field 'all' contains the values
+    of all columns of all rows of a paper. Searches are case insensitive, terms match tokens exactly, as prefix
+    or anywhere inside (infix) and quoted parts are matched as phrases.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe (df_k), possibly with several rows per paper_pk.
+        fields (list): The text columns to index separately.
+        text_store (TextStore): The store of the fields that are not columns of df (the abstracts, if df_k is
+            loaded without them), their texts are only read to verify phrases.
+    """
+    def __init__(self, df, fields=('title', 'keywords', 'abstract'), text_store=None):
+        papers=df.drop_duplicates(subset='paper_pk', keep='first')
+        self.paper_pks=papers['paper_pk'].to_numpy()
+        self.fields={}
+        #the combined field reuses the tokens of the single fields, so that abstracts are only tokenized once
+        all_texts=[]
+        all_tokens=None
+        stored_texts=[]
+        for field in fields:
+            if field in papers.columns:
+                texts=lower_texts(papers[field])
+                field_texts=pd.Series(texts)
+                all_texts.append(texts)
+            else:
+                #decompressed one at a time while tokenizing, the combined field verifies phrases on the store as well
+                field_texts=StoredTexts(text_store, self.paper_pks)
+                texts=(field_texts[pos] for pos in range(len(field_texts)))
+                stored_texts.append(field_texts)
+            doc_tokens=tokenize_texts(texts, counts=True)
+            self.fields[field]=FieldIndex(field_texts, doc_tokens)
+            all_tokens=[set(t) for t in doc_tokens] if all_tokens is None else [a | t.keys() for a, t in zip(all_tokens, doc_tokens)]
+        other_texts=lower_texts(self._combined_texts(df.drop(columns=[field for field in fields if field in df.columns])))
+        other_tokens=tokenize_texts(other_texts)
+        all_tokens=other_tokens if all_tokens is None else [a | b for a, b in zip(all_tokens, other_tokens)]
+        all_texts.append(other_texts)
+        combined=pd.Series([FIELD_SEPARATOR.join(values) for values in zip(*all_texts)])
+        self.fields[ALL_FIELDS]=FieldIndex(combined, all_tokens, stored_texts)
+
+    def _combined_texts(self, df):
+        #every distinct value of every other column of a paper, separated so that phrases stay inside one value
+        values=df.astype(str).melt(id_vars='paper_pk', value_name='text')[['paper_pk', 'text']]
+        values['paper_pk']=values['paper_pk'].astype(self.paper_pks.dtype)
+        values=values.drop_duplicates()
+        combined=values.groupby('paper_pk', sort=False)['text'].agg(FIELD_SEPARATOR.join)
+        combined=combined.reindex(self.paper_pks).fillna('')+FIELD_SEPARATOR+pd.Series(self.paper_pks, index=self.paper_pks).astype(str)
+        return combined.reset_index(drop=True)
+
+    def search_positions(self, query, fields, as_phrase=False, match='prefix'):
+        """Returns the sorted paper positions matching query in any of the fields.
+        Within a field all terms must match (AND), the fields are combined with OR.
+        Args:
+            query (str): The search query.
+            fields (list): The fields to search, 'all' for the combined field.
+            as_phrase (bool): Treat the whole query as one phrase.
+            match (str): How terms match tokens, 'exact', 'prefix' or 'infix' (see FieldIndex.lookup).
+        """
+        if as_phrase:
+            tokens=tokenize(query)
+            terms, phrases=([], [query.strip().lower()]) if is_phrase(query, tokens) else (tokens, [])
+        else:
+            terms, phrases=parse_query(query)
+        result=np.empty(0, dtype=np.int64)
+        for field in fields:
+            result=np.union1d(result, self.fields[field].match(terms, phrases, match))
+        return result
+
+    def search(self, query, fields, as_phrase=False, match='prefix'):
+        """Returns the deduplicated paper_pks matching query in any of the fields (see search_positions)."""
+        return self.paper_pks[self.search_positions(query, fields, as_phrase, match)]
+
+    def score(self, query, field_weights, match='prefix'):
+        """Returns the relevance of every paper for query as weighted sum of the BM25 scores of the fields.
+        The term statistics are computed once when the index is built, so scoring only walks the postings of the query terms.
+        Args:
+            query (str): The search query, all words of quoted phrases are scored as single terms.
+            field_weights (dict): The weight of every field, e.g. {'title': 3, 'keywords': 2, 'abstract': 1}.
+            match (str): How terms match tokens, 'exact', 'prefix' or 'infix'.
+        Returns:
+            A numpy array with one score per paper, in the order of paper_pks.
+        """
+        terms, phrases=parse_query(query)
+        tokens=terms+[t for phrase in phrases for t in tokenize(phrase)]
+        scores=np.zeros(len(self.paper_pks))
+        for field, weight in field_weights.items():
+            scores+=weight*self.fields[field].bm25(tokens, match)
+        return scores
+
+
+def title_ngrams(titles, max_n=3):
+    """Returns the word n-grams (1 to max_n words) of every title as sets of lower case strings."""
+    ngrams=[]
+    for title in lower_texts(titles):
+        tokens=TOKEN_PATTERN.findall(title)
+        ngrams.append({' '.join(tokens[i:i+n]) for n in range(1, max_n+1) for i in range(len(tokens)-n+1)})
+    return ngrams
+
+
+class PrefixIndex:
+    """Completions of typed prefixes, built once at startup: the lower case keys of all completions in one sorted
+    array, so that the keys starting with a prefix are a contiguous range found by binary search.
+    Every completion is found by its whole text (and by the start of each of its words if word_starts), and ranked
+    by its frequency (the number of papers it occurs in).
+    Args:
+        texts (list): The completions, e.g. entity names.
+        frequencies (list): The frequency of every completion.
+        word_starts (bool): Whether a completion is found by the start of every word, not only of its text.
+    """
+    def __init__(self, texts, frequencies, word_starts=True):
+        texts=pd.Series(np.asarray(frequencies, dtype=np.int64), index=pd.Index(list(texts), dtype=object))
+        #a completion that occurs several times keeps its highest frequency
+        texts=texts.groupby(level=0, sort=True).max()
+        self.texts=texts.index.to_numpy(dtype=object)
+        self.frequencies=texts.to_numpy()
+        keys=[]
+        text_ids=[]
+        for text_id, text in enumerate(self.texts):
+            lower=str(text).lower()
+            starts={0}|{match.start() for match in TOKEN_PATTERN.finditer(lower)} if word_starts else {0}
+            keys.extend(lower[start:] for start in sorted(starts))
+            text_ids.extend([text_id]*len(starts))
+        keys=np.asarray(keys, dtype=str)
+        order=np.argsort(keys, kind='stable')
+        self.keys=keys[order]
+        self.text_ids=np.asarray(text_ids, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def complete(self, prefix, k=10):
+        """Returns the k most frequent completions (whole text or a word of it starting with prefix, case insensitive),
+        most frequent first. An empty prefix returns the k most frequent completions."""
+        prefix=(prefix or '').lower()
+        start=np.searchsorted(self.keys, prefix, side='left')
+        stop=np.searchsorted(self.keys, prefix+'\U0010ffff', side='left')
+        text_ids=np.unique(self.text_ids[start:stop])
+        return self.texts[text_ids[top_k(self.frequencies[text_ids], k)]].tolist()
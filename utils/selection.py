@@ -0,0 +1,134 @@
+import base64
+import zlib
+import numpy as np
+import pandas as pd
+
+
+def to_paper_pk_array(paper_pks):
+    """Returns the paper_pks (list, array or None, of int or str) as sorted array of unique int64.
+    Raises:
+        ValueError: If a pk is not an integer or does not fit into int64.
+    """
+    if paper_pks is None:
+        return np.empty(0, dtype=np.int64)
+    try:
+        return np.unique(np.asarray(paper_pks).astype(np.int64))
+    except OverflowError as e:
+        raise ValueError('A paper_pk is out of range ({}).'.format(e)) from e
+
+def encode_paper_pks(paper_pks):
+    """Encodes a set of paper_pks compactly for the browser: the differences of the sorted pks as 64 bit integers,
+    stored byte plane by byte plane (all lowest bytes first, then all second bytes, ...), zlib compressed and base64
+    encoded. The high byte planes of small differences are all zero, so that even large selections stay small.
+    Returns:
+        A str ('' for no papers).
+    """
+    pks=to_paper_pk_array(paper_pks)
+    if len(pks)==0:
+        return ''
+    deltas=np.diff(pks, prepend=0).astype('<i8')
+    planes=deltas.view(np.uint8).reshape(-1, 8).T.tobytes()
+    return base64.urlsafe_b64encode(zlib.compress(planes)).decode('ascii')
+
+def decode_paper_pks(encoded):
+    """Decodes a set of paper_pks written by encode_paper_pks, returns a sorted int64 array.
+    Raises:
+        ValueError: If encoded is not an encoding of encode_paper_pks (e.g. a tampered or outdated browser store).
+    """
+    if not encoded:
+        return np.empty(0, dtype=np.int64)
+    try:
+        planes=np.frombuffer(zlib.decompress(base64.urlsafe_b64decode(encoded)), dtype=np.uint8)
+        deltas=np.ascontiguousarray(planes.reshape(8, -1).T).view('<i8').ravel()
+    except (TypeError, ValueError, zlib.error) as e:
+        raise ValueError('The paper selection could not be decoded ({}).'.format(e)) from e
+    return np.cumsum(deltas).astype(np.int64)
+
+def update_selection(selection, add=None, remove=None):
+    """Returns the selection (sorted int64 array) without the papers in remove and with the papers in add."""
+    selection=np.setdiff1d(selection, to_paper_pk_array(remove), assume_unique=True)
+    return np.union1d(selection, to_paper_pk_array(add))
+
+
+def _differs_within_papers(column, same_paper):
+    #whether a column (sorted by paper_pk) has different values in two rows of the same paper, missing values are equal
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        values=column.cat.codes.to_numpy()
+    else:
+        values=column.to_numpy()
+    missing=pd.isna(values)
+    differs=(values[1:]!=values[:-1]) & ~(missing[1:] & missing[:-1])
+    return bool((differs & same_paper).any())
+
+
+class PaperIndex:
+    """Index of the paper dataframe (df_k) by paper_pk, built once at startup. df_k has several rows per paper (one
+    per combination of entities), so it is split into two frames sorted by paper_pk:
+    papers, one row per paper with the columns that are the same in all rows of a paper (title, year, abstract, ...),
+    and rows, the narrow frame of paper_pk and the columns that differ between the rows of a paper (the entities).
+    The text columns of both frames refer to the same string objects as df_k, they are not copied.
+    A selection of papers is looked up by binary search over the sorted paper_pks and taken from these frames with
+    only the columns a chart needs, instead of comparing every row of the wide df_k.
+    Args:
+        df (pandas dataframe): The prepared paper dataframe, several rows per paper are allowed.
+    """
+    def __init__(self, df):
+        self.df=df
+        row_pks=df['paper_pk'].to_numpy(dtype=np.int64)
+        #df rows sorted by paper_pk, the rows of the i-th paper_pk are _order[_starts[i]:_starts[i+1]]
+        self._order=np.argsort(row_pks, kind='stable')
+        sorted_pks=row_pks[self._order]
+        self.paper_pks, counts=np.unique(sorted_pks, return_counts=True)
+        self._starts=np.concatenate([[0], np.cumsum(counts)])
+        sorted_df=df.take(self._order)
+        same_paper=sorted_pks[1:]==sorted_pks[:-1]
+        varying=[col for col in df.columns if col!='paper_pk' and _differs_within_papers(sorted_df[col], same_paper)]
+        self.papers=sorted_df.iloc[self._starts[:-1]].drop(columns=varying).set_index('paper_pk')
+        self.rows=sorted_df[['paper_pk']+varying].reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.paper_pks)
+
+    def positions(self, paper_pks):
+        """Returns the positions of the given paper_pks in self.paper_pks, unknown pks are left out."""
+        pks=to_paper_pk_array(paper_pks)
+        pos=np.searchsorted(self.paper_pks, pks)
+        inside=pos<len(self.paper_pks)
+        pos, pks=pos[inside], pks[inside]
+        return pos[self.paper_pks[pos]==pks]
+
+    def _sorted_rows(self, pos):
+        #positions in the sorted rows of the papers at pos, and the position of the paper of every row
+        starts=self._starts[pos]
+        lengths=self._starts[pos+1]-starts
+        return np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(lengths.sum()), np.repeat(pos, lengths)
+
+    def select(self, paper_pks):
+        """Returns all columns of the rows of df of the given papers, in the order of df (like df[df.paper_pk.isin(paper_pks)])."""
+        rows, _=self._sorted_rows(self.positions(paper_pks))
+        return self.df.iloc[np.sort(self._order[rows])]
+
+    def paper_frame(self, paper_pks, columns):
+        """Returns paper_pk and the given columns of the papers, one row per paper, sorted by paper_pk.
+        The columns must be the same in all rows of a paper (see self.papers), a ValueError is raised otherwise.
+        """
+        varying=[col for col in columns if col not in self.papers.columns]
+        if varying:
+            raise ValueError('The columns {} differ between the rows of a paper.'.format(', '.join(varying)))
+        pos=self.positions(paper_pks)
+        frame={'paper_pk': self.paper_pks[pos]}
+        for col in columns:
+            frame[col]=self.papers[col].take(pos).reset_index(drop=True)
+        return pd.DataFrame(frame)
+
+    def row_frame(self, paper_pks, columns):
+        """Returns paper_pk and the given columns of all rows of the papers, sorted by paper_pk. Columns of the
+        papers frame are repeated for every row of a paper."""
+        rows, paper_pos=self._sorted_rows(self.positions(paper_pks))
+        frame={'paper_pk': self.paper_pks[paper_pos]}
+        for col in columns:
+            if col in self.rows.columns:
+                frame[col]=self.rows[col].take(rows).reset_index(drop=True)
+            else:
+                frame[col]=self.papers[col].take(paper_pos).reset_index(drop=True)
+        return pd.DataFrame(frame)
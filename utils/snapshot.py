@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from sqlalchemy import inspect
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa=None
+
+logger=logging.getLogger(__name__)
+
+#increase whenever the preparation of the cached frames changes, so that old snapshots are rebuilt
+SNAPSHOT_FORMAT_VERSION=5
+#the warehouse tables the startup frames are built from
+SOURCE_TABLES=('aggregation_paper', 'bridge_paper_keyword', 'dim_keyword', 'dim_entity', 'map_entity_hierarchy', 'fact_entity_detection', 'dim_sentence', 'dim_paragraph',
+    'dim_paper', 'dim_journal', 'bridge_paper_author', 'dim_author')
+
+#snapshot settings that are used if the credentials do not define SNAPSHOT_SETTINGS
+DEFAULT_SNAPSHOT_SETTINGS={
+    'enabled': True,
+    'directory': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.snapshots'),
+    'warehouse_version': None
+}
+
+
+def warehouse_fingerprint(db, tables=SOURCE_TABLES, warehouse_version=None):
+    """Computes a fingerprint of the source tables, which changes whenever the warehouse content changes.
+    It hashes column names and types of every table and, on PostgreSQL, the cumulative number of inserted, updated
+    and deleted rows (pg_stat_user_tables), so that the large fact and bridge tables are never scanned.
+    Other databases (a SQLite stand-in) and relations without statistics (views) are fingerprinted by their row count.
+    Args:
+        db (Database): The data access layer for the warehouse.
+        tables (list): The names of the tables the cached frames depend on.
+        warehouse_version (str): An explicit version of the warehouse (e.g. the date of the last ETL run), used
+            instead of the table statistics if set.
+    Returns:
+        A hex string.
+    """
+    state={'format': SNAPSHOT_FORMAT_VERSION}
+    if warehouse_version is not None:
+        state['version']=str(warehouse_version)
+    else:
+        with db.connect() as connection:
+            inspector=inspect(connection)
+            changes={}
+            if db.engine.dialect.name=='postgresql':
+                stats=connection.exec_driver_sql('select relname, n_tup_ins, n_tup_upd, n_tup_del from pg_stat_user_tables where schemaname = current_schema()').fetchall()
+                changes={relname: [inserted, updated, deleted] for relname, inserted, updated, deleted in stats}
+            for table in tables:
+                state[table]={'columns': [(column['name'], str(column['type'])) for column in inspector.get_columns(table)]}
+                if table in changes:
+                    state[table]['changes']=changes[table]
+                else:
+                    state[table]['rows']=connection.exec_driver_sql('select count(*) from {}'.format(table)).scalar()
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class SnapshotCache:
+    """Local cache of the dataframes loaded and prepared at startup, stored as uncompressed Arrow IPC (feather)
+    files in one directory per warehouse fingerprint. A warm start reads the files instead of querying the warehouse,
+    numeric columns without missing values without a copy, text columns are converted to python strings.
+    The frames are rebuilt only if the fingerprint changed.
+    Args:
+        directory (str): The directory holding the snapshots.
+        enabled (bool): Use the cache at all (it is disabled as well if pyarrow is not installed).
+    """
+    def __init__(self, directory, enabled=True):
+        self.directory=directory
+        self.enabled=enabled and pa is not None
+        if enabled and pa is None:
+            logger.warning('pyarrow is not installed, the startup snapshot cache is disabled')
+
+    def _path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint)
+
+    @staticmethod
+    def _read_frame(path):
+        #one block per column and the arrow buffers released while converting, so that a table is never held twice;
+        #numeric columns without missing values stay read-only views of the mapped file
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+
+    def load(self, fingerprint):
+        """Returns the cached frames of fingerprint as dict of name: dataframe, or None if there is no complete snapshot."""
+        path=self._path(fingerprint)
+        if not self.enabled or not os.path.exists(os.path.join(path, 'manifest.json')):
+            return None
+        try:
+            with open(os.path.join(path, 'manifest.json')) as f:
+                names=json.load(f)['frames']
+            return {name: self._read_frame(os.path.join(path, name+'.arrow')) for name in names}
+        except (OSError, ValueError, KeyError, pa.ArrowException) as e:
+            logger.warning('snapshot %s could not be read (%s), rebuilding it', fingerprint, e)
+            return None
+
+    def store(self, fingerprint, frames):
+        """Writes the frames (dict of name: dataframe) as snapshot of fingerprint and removes older snapshots.
+        The files are written to a temporary directory first and moved in place at once, so that processes
+        starting at the same time never read a partial snapshot.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp=tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for name, df in frames.items():
+                #one record batch per frame, a column of several batches could not be read without a copy
+                feather.write_feather(df.reset_index(drop=True), os.path.join(tmp, name+'.arrow'), compression='uncompressed', chunksize=max(len(df), 1))
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'created': time.time(), 'frames': {name: len(df) for name, df in frames.items()}}, f)
+            os.rename(tmp, self._path(fingerprint))
+        except (OSError, pa.ArrowException) as e:
+            #another process stored the same snapshot first, or the frames can not be stored as arrow
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(self._path(fingerprint), 'manifest.json')):
+                logger.warning('snapshot %s could not be stored: %s', fingerprint, e)
+            return
+        for entry in os.listdir(self.directory):
+            if entry!=fingerprint and not entry.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def load_or_build(self, fingerprint, build):
+        """Returns the cached frames of fingerprint, or builds them with build() (a function returning a dict
+        of name: dataframe) and stores them. Logs whether it was a warm (cached) or cold load and its duration.
+        """
+        start=time.perf_counter()
+        frames=self.load(fingerprint)
+        if frames is not None:
+            logger.info('warm load of startup data from snapshot %s in %.2f s', fingerprint, time.perf_counter()-start)
+            return frames
+        frames=build()
+        built=time.perf_counter()
+        self.store(fingerprint, frames)
+        logger.info('cold load of startup data from the warehouse in %.2f s (snapshot %s stored in %.2f s)', built-start, fingerprint, time.perf_counter()-built)
+        return frames
@@ -0,0 +1,159 @@
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from collections import Counter
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+#text store settings that are used if the credentials do not define TEXT_STORE_SETTINGS
+DEFAULT_TEXT_STORE_SETTINGS={
+    'enabled': False,
+    'directory': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.text_store'),
+    'level': 6
+}
+#maximum size of a preset zlib dictionary
+DICTIONARY_SIZE=32768
+#texts the dictionary is built from
+DICTIONARY_SAMPLE=2000
+WORD_PATTERN=re.compile(r'\w+\W*')
+
+
+def build_dictionary(texts, size=DICTIONARY_SIZE):
+    """Returns a preset zlib dictionary of the most frequent words (with the following space or punctuation) of texts.
+    The most frequent words are put at the end, where zlib finds them with the shortest distances.
+    """
+    counts=Counter(word for text in texts for word in WORD_PATTERN.findall(text))
+    words=[]
+    length=0
+    for word, _ in counts.most_common():
+        length+=len(word.encode())
+        if length>size:
+            break
+        words.append(word)
+    return ''.join(reversed(words)).encode()
+
+
+class TextStore:
+    """Long texts of the papers (the abstracts) kept out of memory, in files of one directory that are memory mapped:
+    the sorted paper_pks (paper_pks.npy), the start of every compressed text in texts.bin (offsets.npy) and the
+    preset dictionary (dictionary.bin). Every text is compressed on its own with the shared dictionary, so that
+    a text is read by a binary search and one decompression, and short texts compress almost as well as one large text.
+    The mapped pages are shared by all processes (server workers, background jobs) through the page cache.
+    Args:
+        path (str): The directory written by TextStore.write.
+    """
+    def __init__(self, path):
+        self.path=path
+        self.paper_pks=np.load(os.path.join(path, 'paper_pks.npy'), mmap_mode='r')
+        self.offsets=np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'dictionary.bin'), 'rb') as f:
+            self.dictionary=f.read()
+        with open(os.path.join(path, 'texts.bin'), 'rb') as f:
+            #an empty file can not be mapped
+            self.data=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1]>0 else b''
+
+    @classmethod
+    def write(cls, path, paper_pks, texts, level=6):
+        """Writes the texts of the papers as text store to path (a new directory).
+        The files are written to a temporary directory first and moved in place at once, so that processes
+        starting at the same time never read a partial store.
+        Args:
+            path (str): The directory of the store.
+            paper_pks (list): The paper_pk of every text.
+            texts (list): The texts, missing texts (None, NaN) are stored as empty strings.
+            level (int): The zlib compression level.
+        Returns:
+            The TextStore.
+        """
+        paper_pks=np.asarray(paper_pks, dtype=np.int64)
+        texts=[text if isinstance(text, str) else '' for text in texts]
+        order=np.argsort(paper_pks, kind='stable')
+        dictionary=build_dictionary(texts[i] for i in order[:DICTIONARY_SAMPLE])
+        parent=os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp=tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+        try:
+            offsets=np.zeros(len(texts)+1, dtype=np.int64)
+            with open(os.path.join(tmp, 'texts.bin'), 'wb') as f:
+                for i, pos in enumerate(order):
+                    compressor=zlib.compressobj(level, zdict=dictionary)
+                    blob=compressor.compress(texts[pos].encode())+compressor.flush()
+                    f.write(blob)
+                    offsets[i+1]=offsets[i]+len(blob)
+            np.save(os.path.join(tmp, 'paper_pks.npy'), paper_pks[order])
+            np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+            with open(os.path.join(tmp, 'dictionary.bin'), 'wb') as f:
+                f.write(dictionary)
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            #another process wrote the same store first
+            if not os.path.exists(os.path.join(path, 'offsets.npy')):
+                raise
+        return cls(path)
+
+    def __len__(self):
+        return len(self.paper_pks)
+
+    def nbytes(self):
+        """Returns the size of the compressed texts in bytes."""
+        return int(self.offsets[-1])
+
+    def positions(self, paper_pks):
+        """Returns the positions of the given paper_pks in the store, in their order (duplicates included), -1 for unknown pks."""
+        pks=np.asarray(paper_pks).astype(np.int64).ravel()
+        if len(self.paper_pks)==0:
+            return np.full(len(pks), -1, dtype=np.int64)
+        pos=np.searchsorted(self.paper_pks, pks)
+        pos[pos>=len(self.paper_pks)]=0
+        found=self.paper_pks[pos]==pks
+        return np.where(found, pos, -1)
+
+    def text_at(self, pos):
+        """Returns the text at a position of the store."""
+        decompressor=zlib.decompressobj(zdict=self.dictionary)
+        blob=self.data[self.offsets[pos]:self.offsets[pos+1]]
+        return (decompressor.decompress(blob)+decompressor.flush()).decode()
+
+    def get(self, paper_pk, default=''):
+        """Returns the text of a paper, default if it is not in the store."""
+        pos=self.positions([paper_pk])[0]
+        return self.text_at(pos) if pos>=0 else default
+
+    def get_many(self, paper_pks, default=''):
+        """Returns the texts of the given papers as list, in their order (default for unknown papers)."""
+        return [self.text_at(pos) if pos>=0 else default for pos in self.positions(paper_pks)]
+
+
+def load_or_build_text_store(directory, fingerprint, load_texts, level=6):
+    """Opens the text store of a warehouse fingerprint, or writes it first with the texts returned by load_texts()
+    (a function returning a tuple of paper_pks and texts) and removes the stores of other fingerprints.
+    Args:
+        directory (str): The directory holding one store per fingerprint.
+        fingerprint (str): The fingerprint of the warehouse the texts are loaded from.
+        load_texts (function): Loads the texts from the warehouse.
+        level (int): The zlib compression level.
+    Returns:
+        A TextStore.
+    """
+    path=os.path.join(directory, fingerprint)
+    start=time.perf_counter()
+    if os.path.exists(os.path.join(path, 'offsets.npy')):
+        try:
+            return TextStore(path)
+        except (OSError, ValueError) as e:
+            logger.warning('text store %s could not be read (%s), rebuilding it', fingerprint, e)
+            shutil.rmtree(path, ignore_errors=True)
+    paper_pks, texts=load_texts()
+    store=TextStore.write(path, paper_pks, texts, level)
+    logger.info('text store %s of %d texts (%.1f MB compressed) written in %.2f s', fingerprint, len(store), store.nbytes()/2**20, time.perf_counter()-start)
+    for entry in os.listdir(directory):
+        if entry!=fingerprint and not entry.startswith('.tmp-'):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return store